@@ -0,0 +1,39 @@
+import os
+
+import plotly
+from django.conf import settings
+from django.contrib.staticfiles.finders import BaseFinder
+from django.core.files.storage import FileSystemStorage
+
+PLOTLY_JS = "plotly.min.js"
+
+
+class PlotlyJsFinder(BaseFinder):
+    """
+    Finds plotly.min.js of the installed plotly package, under
+    PLOTLY_STATIC_PREFIX, see the plotly_js_url template tag.
+
+    Only this file is served and collected. The rest of the package
+    data of plotly, such as its example datasets, is not.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.storage = FileSystemStorage(location=os.path.join(
+            os.path.dirname(plotly.__file__), "package_data"))
+        self.storage.prefix = settings.PLOTLY_STATIC_PREFIX
+
+    def check(self, **kwargs):
+        return []
+
+    def find(self, path, all=False, **kwargs):
+        if path != f"{settings.PLOTLY_STATIC_PREFIX}/{PLOTLY_JS}":
+            return []
+        matched_path = self.storage.path(PLOTLY_JS)
+        if not os.path.isfile(matched_path):
+            return []
+        return [matched_path] if all else matched_path
+
+    def list(self, ignore_patterns):
+        if self.storage.exists(PLOTLY_JS):
+            yield PLOTLY_JS, self.storage
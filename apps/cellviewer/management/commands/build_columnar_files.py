@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from apps.cellviewer.models.SavedFile import SavedFile
+
+
+class Command(BaseCommand):
+    help = "Writes the columnar copy of saved files that do not have one yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="Rewrite the copy of every file, even if it "
+                                 "already exists")
+
+    def handle(self, *args, **options):
+        written = 0
+        for saved_file in SavedFile.objects.all().iterator():
+            if saved_file.has_columnar_file() and not options['force']:
+                continue
+            try:
+                saved_file.write_columnar_file()
+            except FileNotFoundError:
+                self.stderr.write(f"Missing file for SavedFile "
+                                  f"{saved_file.id}: {saved_file.file.name}")
+                continue
+            written += 1
+        self.stdout.write(f"Wrote {written} columnar file(s)")
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from apps.cellviewer.models.SavedFile import SavedFile
+
+
+class Command(BaseCommand):
+    help = "Builds the well threshold index, well histogram cube and " \
+           "substance histograms of saved files that do not have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="Rebuild the index, cube and histograms of "
+                                 "every file, "
+                                 "even if they already exist")
+
+    def handle(self, *args, **options):
+        written = 0
+        for saved_file in SavedFile.objects.all().iterator():
+            build_index = not saved_file.has_well_index() or options['force']
+            build_cube = not saved_file.has_well_cube() or options['force']
+            build_histograms = not saved_file.has_substance_histograms() \
+                or options['force']
+            if not build_index and not build_cube and not build_histograms:
+                continue
+            try:
+                df = saved_file.load_polars_dataframe()
+                if build_index:
+                    saved_file.write_well_index(df)
+                if build_cube:
+                    saved_file.write_well_cube(df)
+                if build_histograms:
+                    saved_file.write_substance_histograms(df)
+            except FileNotFoundError:
+                self.stderr.write(f"Missing file for SavedFile "
+                                  f"{saved_file.id}: {saved_file.file.name}")
+                continue
+            written += 1
+        self.stdout.write(f"Built the index, cube and histograms of "
+                          f"{written} file(s)")
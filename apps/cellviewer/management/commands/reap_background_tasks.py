@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.cellviewer.models.BackgroundTask import BackgroundTask
+
+
+class Command(BaseCommand):
+    help = "Fails the background tasks that did not finish within " \
+           "BACKGROUND_TASK_TIMEOUT and removes the finished tasks older " \
+           "than BACKGROUND_TASK_RETENTION, for example from cron"
+
+    def handle(self, *args, **options):
+        failed, removed = BackgroundTask.objects.reap()
+        self.stdout.write(f"Failed {failed} expired task(s), "
+                          f"removed {removed} finished task(s)")
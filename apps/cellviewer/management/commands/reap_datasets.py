@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from apps.cellviewer.util.dataset_store import reap_expired_datasets
+
+
+class Command(BaseCommand):
+    help = "Removes the server side copies of unsaved files that have expired"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int,
+                            help="Time to live in seconds, defaults to the "
+                                 "DATASET_STORE_TTL setting")
+
+    def handle(self, *args, **options):
+        removed = reap_expired_datasets(options['ttl'])
+        self.stdout.write(f"Removed {removed} expired dataset(s)")
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.cellviewer.models.SavedJob import SavedJob
+from apps.users.models import Profile
+
+
+class Command(BaseCommand):
+    help = "Compares the used storage kept on each profile with the " \
+           "storage calculated from the jobs of the user, and corrects " \
+           "it when they differ. Meant to be run periodically, for " \
+           "example nightly from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report the differences")
+
+    def handle(self, *args, **options):
+        corrected = 0
+        for user_id in Profile.objects.values_list("user_id", flat=True):
+            with transaction.atomic():
+                # A job saved or deleted in between would otherwise be
+                # counted twice
+                SavedJob.objects.lock_users_used_file_storage(user_id)
+                stored = SavedJob.objects.get_users_used_file_storage(user_id)
+                calculated = SavedJob.objects \
+                    .calculate_users_used_file_storage(user_id)
+                drift = calculated - stored
+                if not drift:
+                    continue
+                corrected += 1
+                self.stderr.write(f"User {user_id}: stored {stored} B, "
+                                  f"calculated {calculated} B")
+                if not options['dry_run']:
+                    SavedJob.objects.add_to_users_used_file_storage(
+                        user_id, drift)
+        self.stdout.write(f"{corrected} profile(s) differed"
+                          + ("" if options['dry_run'] else ", corrected"))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+import apps.cellviewer.tasks
+from apps.cellviewer.models.BackgroundTask import BackgroundTask
+from apps.cellviewer.util.background_tasks import run_task
+
+
+class Command(BaseCommand):
+    help = "Runs the pending background tasks from the database, " \
+           "for when BACKGROUND_TASK_WORKERS is 0. Expired tasks are " \
+           "failed and old finished tasks removed as it goes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1,
+                            help="Seconds to wait when no task is pending")
+        parser.add_argument('--once', action='store_true',
+                            help="Stop when no task is pending")
+
+    def handle(self, *args, **options):
+        while True:
+            failed, removed = BackgroundTask.objects.reap()
+            if failed or removed:
+                self.stdout.write(f"Failed {failed} expired task(s), "
+                                  f"removed {removed} finished task(s)")
+            
+            task = BackgroundTask.objects.next_pending()
+            if task is None:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            if run_task(task):
+                task.refresh_from_db()
+                self.stdout.write(f"Task {task.id} ({task.name}): {task.status}")
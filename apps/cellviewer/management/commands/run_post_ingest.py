@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from apps.cellviewer.models.SavedFile import SavedFile
+
+
+class Command(BaseCommand):
+    help = "Runs the post ingest pipeline of saved files whose stages " \
+           "are not all done, for example after a stage failed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="Run every stage of every file, even if it "
+                                 "is already done")
+
+    def handle(self, *args, **options):
+        completed, failed = 0, 0
+        for saved_file in SavedFile.objects.all().iterator():
+            if saved_file.post_ingest_done and not options['force']:
+                continue
+            saved_file.run_post_ingest(options['force'])
+            if saved_file.post_ingest_done:
+                completed += 1
+            else:
+                failed += 1
+                self.stderr.write(f"SavedFile {saved_file.id}: "
+                                  f"{saved_file.post_ingest_state}")
+        self.stdout.write(f"Completed the pipeline of {completed} file(s), "
+                          f"{failed} failed")
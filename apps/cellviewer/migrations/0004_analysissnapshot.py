@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cellviewer', '0003_alter_filteredfile_created_by_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_hash', models.TextField()),
+                ('substance_thresholds', models.TextField(default=None, null=True)),
+                ('substance_names', models.JSONField()),
+                ('amount_of_sites', models.IntegerField()),
+                ('row_names', models.JSONField()),
+                ('col_names', models.JSONField()),
+                ('well_counts', models.JSONField()),
+                ('filtered_well_counts', models.JSONField()),
+                ('date', models.DateTimeField(auto_now=True)),
+                ('filtered_file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot', to='cellviewer.filteredfile')),
+            ],
+        ),
+    ]
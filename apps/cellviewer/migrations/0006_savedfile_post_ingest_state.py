@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cellviewer', '0005_backgroundtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='savedfile',
+            name='post_ingest_state',
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:54
+
+import os
+import shutil
+
+from django.db import migrations, models
+from django.db.models import Count
+
+from apps.cellviewer.util.columnar import columnar_path
+from apps.cellviewer.util.substance_histograms import substance_histograms_path
+from apps.cellviewer.util.well_cube import well_cube_path
+from apps.cellviewer.util.well_index import well_index_path
+
+
+def merge_duplicate_files(apps, schema_editor):
+    """
+    Before the hash can be unique, files that were saved more than once
+    are merged into the oldest SavedFile with that hash. The jobs of the
+    other copies are pointed to it, and the other copies are removed,
+    together with the files derived from them.
+    """
+    SavedFile = apps.get_model("cellviewer", "SavedFile")
+    FilteredFile = apps.get_model("cellviewer", "FilteredFile")
+
+    duplicated = SavedFile.objects.values("hash") \
+        .annotate(copies=Count("id")).filter(copies__gt=1)
+    for row in duplicated:
+        keep, *copies = SavedFile.objects.filter(hash=row["hash"]).order_by("id")
+        FilteredFile.objects.filter(saved_file__in=copies).update(saved_file=keep)
+
+        for copy in copies:
+            if copy.file.name and copy.file.name != keep.file.name:
+                path = copy.file.path
+                for file_path in (path, columnar_path(path), well_cube_path(path),
+                                  substance_histograms_path(path)):
+                    if os.path.isfile(file_path):
+                        os.remove(file_path)
+                shutil.rmtree(well_index_path(path), ignore_errors=True)
+            copy.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cellviewer', '0006_savedfile_post_ingest_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_files, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='savedfile',
+            name='hash',
+            field=models.CharField(max_length=64, unique=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:55
+
+from django.db import migrations, models
+
+from apps.cellviewer.util.fingerprint import label_matrix_fingerprint
+
+
+def fingerprint_existing_matrices(apps, schema_editor):
+    LabelMatrix = apps.get_model("cellviewer", "LabelMatrix")
+    for matrix in LabelMatrix.objects.all().iterator():
+        matrix.fingerprint = label_matrix_fingerprint(
+            matrix.matrix_name, matrix.row_count, matrix.col_count,
+            matrix.rows, matrix.cols, matrix.cells)
+        matrix.save(update_fields=["fingerprint"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cellviewer', '0007_savedfile_unique_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='labelmatrix',
+            name='fingerprint',
+            field=models.CharField(db_index=True, default='', max_length=64),
+        ),
+        migrations.RunPython(fingerprint_existing_matrices,
+                             migrations.RunPython.noop),
+    ]
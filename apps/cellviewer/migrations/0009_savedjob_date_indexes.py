@@ -0,0 +1,27 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cellviewer', '0008_labelmatrix_fingerprint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='savedjob',
+            index=models.Index(fields=['-date', '-id'], name='savedjob_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='savedjob',
+            index=models.Index(fields=['user', '-date', '-id'], name='savedjob_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='savedjob',
+            index=models.Index(fields=['dimension', '-date', '-id'], name='savedjob_dimension_date_idx'),
+        ),
+    ]
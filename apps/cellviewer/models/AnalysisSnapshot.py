@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from django.db import models
+
+from apps.cellviewer.util.matrix_functions import \
+    plates_to_well_counts_and_percent
+
+
+class AnalysisSnapshot(models.Model):
+    """
+    The analysis of a FilteredFile with its saved thresholds, stored
+    so the saved job can be shown without reading the file.
+
+    It holds the well counts and the filtered well counts per well,
+    the percentages are calculated from these when they are used.
+    Besides that it holds the substance names and the amount of sites,
+    which would otherwise also need the file.
+
+    The hash of the file and the thresholds the snapshot was made
+    with are stored with it. If either is no longer the same as on
+    the FilteredFile, the snapshot is not valid anymore and it is made
+    again, see FilteredFile.get_snapshot.
+    """
+    filtered_file = models.OneToOneField(
+        "cellviewer.FilteredFile", on_delete=models.CASCADE,
+        related_name="snapshot"
+    )
+
+    file_hash = models.TextField()
+    substance_thresholds = models.TextField(null=True, default=None)
+
+    substance_names = models.JSONField()
+    amount_of_sites = models.IntegerField()
+
+    row_names = models.JSONField()
+    col_names = models.JSONField()
+    well_counts = models.JSONField()
+    filtered_well_counts = models.JSONField()
+
+    date = models.DateTimeField(auto_now=True)
+
+    def is_valid_for(self, filtered_file) -> bool:
+        return self.file_hash == filtered_file.saved_file.hash and \
+            self.substance_thresholds == filtered_file.substance_thresholds
+
+    def get_well_counts_and_percent(self) -> tuple[
+            pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """
+        The matrices in the same format as
+        calculate_well_counts_and_percent.
+        """
+        return plates_to_well_counts_and_percent(
+            np.array(self.well_counts, dtype=np.int64).reshape(
+                len(self.row_names), len(self.col_names)),
+            np.array(self.filtered_well_counts, dtype=np.int64).reshape(
+                len(self.row_names), len(self.col_names)),
+            self.row_names, self.col_names
+        )
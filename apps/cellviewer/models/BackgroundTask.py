@@ -0,0 +1,268 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models, transaction, connection
+from django.utils import timezone
+
+from apps.cellviewer.util.background_tasks import run_task, submit
+
+
+# The seconds between the maintenance of the tasks, see
+# BackgroundTaskManager.maintain
+MAINTENANCE_INTERVAL = 60
+_last_maintenance = None
+_maintenance_lock = threading.Lock()
+# Tasks created before this are not started by this process,
+# see BackgroundTaskManager.maintain
+_process_started = timezone.now()
+
+
+class BackgroundTaskManager(models.Manager):
+
+    def enqueue(self, name: str, arguments: dict, user: User | int
+                ) -> "BackgroundTask":
+        """
+        Stores a task to be run outside of the request, and returns it.
+        The request can then return a page that polls the task,
+        see views/background_tasks.py.
+
+        Once the transaction that stores it is committed, the task is
+        started, see start.
+
+        Args:
+            name: The name the task function is registered under,
+                see background_task
+            arguments: The keyword arguments of the function, as JSON
+            user: The user that started the task
+
+        Returns:
+
+        """
+        if isinstance(user, User):
+            user = user.id
+        transaction.on_commit(self.maintain)
+        task = self.create(name=name, arguments=arguments,
+                           created_by_id=user)
+
+        transaction.on_commit(lambda: self.start(task.id))
+        return task
+
+    @staticmethod
+    def start(task_id: int) -> bool:
+        """
+        Starts a stored task.
+        
+        With BACKGROUND_TASK_USE_CELERY, the task is sent to the Celery
+        workers, see apps/cellviewer/tasks.py. Otherwise, with
+        BACKGROUND_TASK_WORKERS above 0, it is started in the thread
+        pool of this process. With 0, it waits in the database until a
+        worker started with the run_background_tasks command picks it
+        up. The last two do not need anything besides the database.
+        
+        Args:
+            task_id:
+
+        Returns: If the task was started, False if it waits for
+            the run_background_tasks command
+
+        """
+        if settings.BACKGROUND_TASK_USE_CELERY:
+            from apps.cellviewer.tasks import run_background_task
+            run_background_task.delay(task_id)
+            return True
+        if settings.BACKGROUND_TASK_WORKERS > 0:
+            submit(run_task_by_id, task_id,
+                   max_workers=settings.BACKGROUND_TASK_WORKERS)
+            return True
+        return False
+
+    def next_pending(self) -> "BackgroundTask | None":
+        return self.filter(status=BackgroundTask.PENDING) \
+            .order_by("created").first()
+
+    def reap(self) -> tuple[int, int]:
+        """
+        Fails the tasks that did not finish within
+        BACKGROUND_TASK_TIMEOUT, pending or running, and removes the
+        finished tasks older than BACKGROUND_TASK_RETENTION.
+        
+        Without this the table keeps every result ever made, and a task
+        of which nobody polls the page would stay pending forever.
+        
+        Returns: The amount of failed and of removed tasks
+
+        """
+        now = timezone.now()
+        expired = now - timedelta(seconds=settings.BACKGROUND_TASK_TIMEOUT)
+        failed = self.filter(
+            status__in=(BackgroundTask.PENDING, BackgroundTask.RUNNING),
+            created__lt=expired
+        ).update(status=BackgroundTask.FAILED, finished=now,
+                 message="The task took too long, please try again")
+        
+        retention = timedelta(seconds=settings.BACKGROUND_TASK_RETENTION)
+        removed, _ = self.filter(
+            status__in=(BackgroundTask.DONE, BackgroundTask.FAILED),
+            finished__lt=now - retention
+        ).delete()
+        return failed, removed
+    
+    def requeue_pending(self, created_before: datetime = None) -> int:
+        """
+        Starts the pending tasks again, see start.
+        
+        Tasks started in a thread are lost when the process stops before
+        they ran, they stay pending in the database. Another process
+        can start them again, a task is only run by whoever claims it
+        first, so a task that is still queued elsewhere does not run
+        twice.
+        
+        Args:
+            created_before: Only the tasks created before this
+
+        Returns: The amount of started tasks
+
+        """
+        pending = self.filter(status=BackgroundTask.PENDING)
+        if created_before is not None:
+            pending = pending.filter(created__lt=created_before)
+        task_ids = list(pending.order_by("created")
+                        .values_list("id", flat=True))
+        started = 0
+        for task_id in task_ids:
+            started += self.start(task_id)
+        return started
+    
+    def maintain(self) -> None:
+        """
+        Runs reap at most once every MAINTENANCE_INTERVAL seconds per
+        process, and requeue_pending the first time in a process, so
+        tasks lost by a restart are picked up again. The tasks created
+        since the process started were already started by it.
+        
+        This is done when tasks are enqueued and polled, in the same
+        way storing a dataset removes the expired datasets.
+        The reap_background_tasks command does the same from cron.
+        """
+        global _last_maintenance
+        with _maintenance_lock:
+            first = _last_maintenance is None
+            if not first and \
+                    time.monotonic() - _last_maintenance < MAINTENANCE_INTERVAL:
+                return
+            _last_maintenance = time.monotonic()
+        
+        self.reap()
+        if first:
+            self.requeue_pending(created_before=_process_started)
+
+
+class BackgroundTask(models.Model):
+    """
+    A heavy operation that runs outside of the request that started
+    it, such as comparing many experiments.
+
+    The status and progress are stored, so any request, in any worker,
+    can show how far along the task is. The result, usually the HTML
+    to show, is stored when the task is done.
+
+    A task that is not done within BACKGROUND_TASK_TIMEOUT seconds
+    after it was created is seen as failed, for example because the
+    server restarted while it was running. Finished tasks are removed
+    after BACKGROUND_TASK_RETENTION seconds, see
+    BackgroundTaskManager.reap.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [(PENDING, "Pending"), (RUNNING, "Running"),
+                (DONE, "Done"), (FAILED, "Failed")]
+
+    name = models.CharField(max_length=100)
+    arguments = models.JSONField(default=dict)
+
+    status = models.CharField(max_length=10, choices=STATUSES,
+                              default=PENDING)
+    progress = models.FloatField(default=0)
+    message = models.TextField(blank=True, default="")
+    result = models.TextField(null=True, default=None)
+
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, default=None)
+    finished = models.DateTimeField(null=True, default=None)
+
+    objects = BackgroundTaskManager()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.DONE, self.FAILED)
+
+    def _update(self, **fields) -> int:
+        """
+        Updates the fields on the instance and on only that row,
+        so progress updates do not overwrite the other fields.
+        """
+        for field, value in fields.items():
+            setattr(self, field, value)
+        return BackgroundTask.objects.filter(id=self.id).update(**fields)
+
+    def claim(self) -> bool:
+        """
+        Marks the task as running, if it is still pending.
+        Returns if this call claimed the task.
+        """
+        claimed = BackgroundTask.objects.filter(
+            id=self.id, status=self.PENDING
+        ).update(status=self.RUNNING, started=timezone.now())
+        if claimed:
+            self.refresh_from_db()
+        return bool(claimed)
+
+    def set_progress(self, progress: float, message: str = "") -> None:
+        """
+        Args:
+            progress: Between 0 and 1
+            message: What the task is doing at the moment
+
+        Returns:
+
+        """
+        self._update(progress=progress, message=message)
+
+    def finish(self, result: str) -> None:
+        self._update(status=self.DONE, progress=1, result=result,
+                     finished=timezone.now())
+
+    def fail(self, message: str) -> None:
+        self._update(status=self.FAILED, message=message,
+                     finished=timezone.now())
+
+    def fail_if_expired(self) -> bool:
+        """
+        Fails the task if it is not finished and has taken longer than
+        BACKGROUND_TASK_TIMEOUT. Returns if it failed the task.
+        """
+        timeout = timedelta(seconds=settings.BACKGROUND_TASK_TIMEOUT)
+        if self.is_finished or timezone.now() - self.created < timeout:
+            return False
+        self.fail("The task took too long, please try again")
+        return True
+
+
+def run_task_by_id(task_id: int) -> None:
+    """
+    Runs a task in a thread of the pool, or in a Celery worker.
+    A task that was removed in the meantime is skipped. The thread has
+    its own database connection, which is closed when the task is done.
+    """
+    try:
+        task = BackgroundTask.objects.filter(id=task_id).first()
+        if task is not None:
+            run_task(task)
+    finally:
+        connection.close()
@@ -7,8 +7,10 @@ from django.db import models
 
 from apps.cellviewer.models.SavedJob import SavedJob
 from apps.cellviewer.models.SavedFile import SavedFile
+from apps.cellviewer.models.AnalysisSnapshot import AnalysisSnapshot
 from apps.cellviewer.util.matrix_functions import \
     calculate_well_counts_and_percent
+from apps.cellviewer.util.result_cache import well_counts_cache
 
 
 class FilteredFile(models.Model):
@@ -61,23 +63,107 @@ class FilteredFile(models.Model):
                 self.substance_thresholds.split(";")]
     
     def load_polars_dataframe(self) -> pl.DataFrame:
-        file = self.saved_file.file
-        
-        return pl.read_csv(file)
+        return self.saved_file.load_polars_dataframe()
     
     def get_well_counts_and_percent(self, df=None,
                                          substance_thresholds=None):
-        if df is None:
-            df = self.load_polars_dataframe()
+        """
+        Calculates the well counts, filtered well counts and percentage
+        of the file.
         
+        The result is cached by the hash of the file and the
+        thresholds, see WellCountsCache, so opening the same job again
+        does not calculate anything.
+        
+        If it is not cached and no DataFrame is passed, the
+        WellThresholdIndex of the file is used when it exists, which
+        does not need to load the cells at all. Otherwise the file
+        is loaded.
+        
+        Args:
+            df:
+            substance_thresholds: Uses the saved thresholds if None
+
+        Returns:
+
+        """
         if substance_thresholds is None:
             substance_thresholds = self.get_substance_thresholds_as_list
         
-        well_count_matrix, filtered_well_count_matrix, \
-            well_count_matrix_percent = \
-            calculate_well_counts_and_percent(
-                df, substance_thresholds
+        def calculate():
+            if df is None:
+                well_index = self.saved_file.load_well_index()
+                if well_index is not None:
+                    return well_index.well_counts_and_percent(
+                        substance_thresholds)
+                return calculate_well_counts_and_percent(
+                    self.load_polars_dataframe(), substance_thresholds)
+            return calculate_well_counts_and_percent(
+                df, substance_thresholds)
+        
+        return well_counts_cache.get_or_calculate(
+            self.saved_file.hash, substance_thresholds, calculate)
+    
+    def write_snapshot(self, df: pl.DataFrame = None) -> AnalysisSnapshot:
+        """
+        (Re)writes the AnalysisSnapshot of the saved thresholds.
+        
+        The counts come from get_well_counts_and_percent. The substance
+        names and amount of sites come from the WellThresholdIndex
+        of the file, or from the DataFrame if the file has no index.
+        If the DataFrame is needed and not passed, it is loaded.
+        
+        Args:
+            df:
+
+        Returns:
+
+        """
+        well_index = None
+        if df is None:
+            well_index = self.saved_file.load_well_index()
+            if well_index is None:
+                df = self.load_polars_dataframe()
+        
+        if well_index is not None:
+            substance_names = list(well_index.substances)
+            amount_of_sites = int(well_index.amount_of_sites)
+        else:
+            substance_names = list(df.columns[3:])
+            amount_of_sites = int(df["Site"].max())
+        
+        well_count_matrix, filtered_well_count_matrix, _ = \
+            self.get_well_counts_and_percent(df)
+        
+        snapshot, _ = AnalysisSnapshot.objects.update_or_create(
+            filtered_file=self,
+            defaults=dict(
+                file_hash=self.saved_file.hash,
+                substance_thresholds=self.substance_thresholds,
+                substance_names=substance_names,
+                amount_of_sites=amount_of_sites,
+                row_names=list(well_count_matrix.index),
+                col_names=list(well_count_matrix.columns),
+                well_counts=well_count_matrix.to_numpy().ravel().tolist(),
+                filtered_well_counts=filtered_well_count_matrix.to_numpy()
+                .ravel().tolist(),
             )
+        )
+        return snapshot
+    
+    def get_snapshot(self) -> AnalysisSnapshot:
+        """
+        The AnalysisSnapshot of the saved thresholds.
+        If it does not exist, or the file or thresholds have changed
+        since it was made, it is written again.
         
-        return well_count_matrix, filtered_well_count_matrix, \
-            well_count_matrix_percent
+        Returns:
+
+        """
+        try:
+            snapshot = self.snapshot
+        except AnalysisSnapshot.DoesNotExist:
+            return self.write_snapshot()
+        if not snapshot.is_valid_for(self):
+            return self.write_snapshot()
+        return snapshot
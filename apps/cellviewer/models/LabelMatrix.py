@@ -6,6 +6,8 @@ from django.db.models import Q, Value
 from django.db.models.functions import Concat
 from django.db.models import QuerySet
 
+from apps.cellviewer.util.fingerprint import label_matrix_fingerprint
+
 
 class LabelMatrixManager(models.Manager):
     
@@ -112,6 +114,12 @@ class LabelMatrixManager(models.Manager):
         Searches if an equivalent matrix exists.
         It will compare all identifying variables to each other.
         
+        The matrices are looked up by the indexed fingerprint of
+        these variables, see label_matrix_fingerprint, instead of
+        comparing the long rows, cols and cells text of every matrix.
+        The variables themselves are only compared for the matrices
+        with the same fingerprint.
+        
         It only compares to the own user's matrices and public
         matrices.
         It is possible if two users make the exact same matrix
@@ -142,8 +150,12 @@ class LabelMatrixManager(models.Manager):
         Returns:
 
         """
+        fingerprint = label_matrix_fingerprint(
+            label_matrix_name, row_count, col_count,
+            rows_str, cols_str, cells_str)
         return self.filter(
             Q(created_by=user) | Q(public=True),
+            fingerprint=fingerprint,
             matrix_name=label_matrix_name,
             row_count=row_count,
             col_count=col_count,
@@ -215,8 +227,20 @@ class LabelMatrix(models.Model):
     cols = models.TextField()
     cells = models.TextField()
     
+    fingerprint = models.CharField(max_length=64, db_index=True, default="")
+    
     objects = LabelMatrixManager()
     
+    def save(self, *args, **kwargs):
+        """
+        Keeps the fingerprint up to date with the name and labels,
+        every time the matrix is saved.
+        """
+        self.fingerprint = label_matrix_fingerprint(
+            self.matrix_name, self.row_count, self.col_count,
+            self.rows, self.cols, self.cells)
+        return super().save(*args, **kwargs)
+    
     def update(self, rows: tuple[str], cols: tuple[str], cells: tuple[str], label_matrix_name: str, keep_when_unused, public):
         """
         Updates an existing instance with the new values.
@@ -234,7 +258,7 @@ class LabelMatrix(models.Model):
         Returns: instance id
 
         """
-        rows_str, cols_str, cells_str = self.objects.joiner(rows), self.objects.joiner(cols), self.objects.joiner \
+        rows_str, cols_str, cells_str = LabelMatrix.objects.joiner(rows), LabelMatrix.objects.joiner(cols), LabelMatrix.objects.joiner \
             (cells)
         
         self.rows = rows_str
@@ -1,85 +1,201 @@
 import os
 import sys
-from string import digits, ascii_letters
 from typing import Union
 
-from django.db import models
+from django.apps import apps
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
-from time import time, strftime
 import polars as pl
 from django.db.models import QuerySet
 
-import hashlib
+import shutil
 
+from apps.cellviewer.util.columnar import columnar_path, \
+    write_columnar_file, read_columnar_file, to_columnar_dataframe
+from apps.cellviewer.util.well_index import WellThresholdIndex, \
+    well_index_path
+from apps.cellviewer.util.well_cube import WellHistogramCube, \
+    well_cube_path, load_cached
+from apps.cellviewer.util.substance_histograms import \
+    SubstanceHistograms, substance_histograms_path
+from apps.cellviewer.util.ingest import ingest_file
+from apps.cellviewer.util.pipeline import Stage, run_stages, stages_done
+from apps.cellviewer.util.background_tasks import background_task
+from apps.cellviewer.util.content_addressed import content_addressed_name, \
+    write_once
 
-# Create your models here.
-
-
-def file_dimensions(df: pl.DataFrame) -> tuple[int, tuple[list[str], list[str]]]:
-    """
-    Helper function which returns the row count, and all row names and
-    column names that appear as a sorted list, to have the dimensions
-    be calculated from that.
-    It presumes all the letters it can find are the rows.
-    All the numbers are the columns. It does not care
-    if a letter number combination is missing and ignores such things.
-    Args:
-        df:
 
-    Returns:
-
-    """
-    rows = df.height
-    name = df.columns[0]
-    tags = df[name].arr.explode().unique().to_list()
-    
-    letters = sorted(set(t.strip(digits) for t in tags))
-    numbers = sorted(set(t.strip(ascii_letters) for t in tags))
-    return rows, (letters, numbers)
+# Create your models here.
 
 
 def saved_file_path_func(instance, filename) -> str:
     """
     A function that generates the saved file for Djang's database when
     writing a file away.
+    
+    The path is derived from the hash of the content, see
+    content_addressed_name, so the same content always ends up
+    at the same path. Files saved before this keep their
+    saved_files/year/month/name_timestamp path.
+    
     Args:
-        instance: SavedFile instance
-        filename: The name of the file
+        instance: SavedFile instance, with the hash set
+        filename: The name of the file, not used
 
     Returns: the path the file is saved to
 
     """
-    return strftime(f"saved_files/%Y/%m/{filename}_{int(time())}")
+    return content_addressed_name(instance.hash)
 
 
-class SavedFileManager(models.Manager):
+class StagedFile:
+    """
+    A file that has been checked and written to disk, but of which the
+    SavedFile row has not been stored yet, see SavedFileManager.stage.
     
-    def create(self, request, file: "InMemoryUploadedFile",
-               current_users_size=None):
+    Staging does all the slow work, reading and writing the file,
+    outside of any transaction. commit then only stores the row, which
+    is done inside the short transaction of the save.
+    
+    If the save fails, discard removes the written file again, also
+    when the row was already committed, as the row is then rolled back.
+    A file that already existed, or that a SavedFile refers to,
+    is never removed.
+    
+    Files are stored by their content, so the path of an existing file
+    is shared with every upload of the same content. The upload is kept,
+    so commit can write the file again if the existing file was deleted
+    after it was staged, see SavedFile.delete.
+    """
+    
+    def __init__(self, instance: "SavedFile", is_new: bool,
+                 written: bool = False,
+                 upload: "InMemoryUploadedFile" = None):
+        """
+        Args:
+            instance: The unsaved SavedFile, or the existing one
+            is_new: If the row still has to be stored
+            written: If the file was written to disk for this save
+            upload: The uploaded file
+        """
+        self.instance = instance
+        self.is_new = is_new
+        self.written = written
+        self.upload = upload
+    
+    def commit(self) -> "SavedFile":
+        """
+        Stores the row of the file, unless an equivalent file was
+        saved since it was staged, in that case that file is used.
+        
+        The hash is unique, so when another request stores the same
+        file at the same moment, one of the inserts fails. The insert
+        is done in a savepoint, so the failed insert can be rolled back
+        and the file of the other request is used instead.
+        
+        An existing file is locked until the save is committed, so it
+        can not be deleted in between. If it was deleted since it was
+        staged, its row is stored again. In both cases the file is
+        written again when it is missing from disk, see SavedFile.delete.
+        
+        Must be called inside a transaction.
+        
+        Returns: The SavedFile
+        
+        """
+        if not self.is_new:
+            locked = SavedFile.objects.select_for_update() \
+                .filter(id=self.instance.id).first()
+            if locked is not None:
+                self.instance = locked
+                self._write_if_missing()
+                return self.instance
+            
+            # Deleted since it was staged, so it is stored again
+            self.instance.pk = None
+            self.instance.post_ingest_state = {}
+            self.is_new = True
+        
+        try:
+            with transaction.atomic():
+                self.instance.save()
+            self._write_if_missing()
+            return self.instance
+        except IntegrityError:
+            file_with_hash = SavedFile.objects.select_for_update() \
+                .filter(hash=self.instance.hash).first()
+            if file_with_hash is None:
+                raise
+        
+        self.discard()
+        self.instance, self.is_new = file_with_hash, False
+        self._write_if_missing()
+        return file_with_hash
+    
+    def _write_if_missing(self) -> None:
         """
-        Creates an instance of SavedFile. This instance does not hit the database
-        until it is stored with .save()
+        Writes the upload to the path of the file if the file is not on
+        disk, because it was deleted after the file was staged.
+        The derived files are made again by the post ingest pipeline,
+        which checks if they exist.
+        """
+        if self.upload is None or os.path.isfile(self.instance.file.path):
+            return
+        if write_once(self.upload, self.instance.file.path) and self.is_new:
+            self.written = True
+    
+    def discard(self) -> None:
+        if not self.is_new or not self.written:
+            return
+        name = self.instance.file.name
+        if SavedFile.objects.filter(file=name).exists():
+            return
+        self.instance.file.storage.delete(name)
 
-        When creating objects for SavedFile, if it's possible it might
-        need to be reverted, one should always use this method.
+
+class SavedFileManager(models.Manager):
+    
+    def stage(self, request, file: "InMemoryUploadedFile",
+              current_users_size=None) -> tuple[StagedFile, int]:
+        """
+        Checks a file and writes it to disk, without storing it in the
+        database yet. The returned StagedFile is committed to store
+        the row, see StagedFile.
 
         SavedFiles are hashed, to check if a file already exists
         in the database. If a file that's being created already
         exists, it will not be saved again and no new instance
-        will be created. Instead it silently returns the prior
+        will be created. Instead the StagedFile holds the prior
         saved SavedFile object. This is done to save space.
+        
+        The file is stored at a path derived from the hash, see
+        saved_file_path_func. If the path already exists, for example
+        because another request is saving the same file, the file is
+        not written again.
 
         It will check if saving the file to disk will exceed
         the users remaining available storage space.
         If it would exceed it an PermissionError is thrown.
+        This check is done before the file is written, so a file that
+        is too large is not written at all. Another save can still add
+        files before the rows are stored, so the storage is checked
+        again with the storage of the user locked, see
+        SavedJobManager.check_users_file_storage.
 
         It is possible to pass on the existing used size as a variable,
         if this is not done it will query this information on it's own.
         To avoid circular imports, it will import the necessary function
         for this.
 
+        The file is read through ingest_file, so the hash and the parsed
+        file are shared with the rest of the request, instead of the file
+        being read and parsed again here. If the file is not valid
+        a ValueError is raised.
+        
         Besides this it calculates the simple information about
-        the file.
+        the file. The files derived from it, such as the columnar copy,
+        are not built here but by the post ingest pipeline after the
+        save is committed, see SavedFile.run_post_ingest.
 
         Args:
             request:
@@ -87,13 +203,16 @@ class SavedFileManager(models.Manager):
             current_users_size:
 
         Returns:
-            The newly saved, or cached file.
+            The staged file.
             The current users size after saving the file.
         """
-        file_hash = hashlib.file_digest(file, 'sha256').hexdigest()
+        ingested = ingest_file(request, file)
+        
+        file_hash = ingested.hash
         file_with_hash = self.find_equivalent(file_hash)
         if file_with_hash is not None:
-            return file_with_hash, current_users_size
+            return StagedFile(file_with_hash, False, upload=file), \
+                current_users_size
         
         if current_users_size is None:
             from apps.cellviewer.models.SavedJob import SavedJob
@@ -104,17 +223,13 @@ class SavedFileManager(models.Manager):
         if new_size > (request.user.profile.storage_space_in_gb * 1000000000):
             raise PermissionError("Not enough space to write more files")
         
-        file.open()
-        df = pl.read_csv(file)
-        
-        row_count, dimension = file_dimensions(df)
+        row_count, dimension = ingested.row_count, ingested.dimension
         matrix_row_count, matrix_col_count = len(dimension[0]), len(
             dimension[1])
         dimension = f"{matrix_row_count}x{matrix_col_count}"
         
-        instance = super().create(
+        instance = self.model(
             user_id=request.user.id,
-            file=file,
             storage_space_in_b=file.size,
             row_count=row_count,
             matrix_row_count=matrix_row_count,
@@ -123,8 +238,32 @@ class SavedFileManager(models.Manager):
             
             hash=file_hash
         )
+        instance.file.name = saved_file_path_func(instance, file.name)
+        written = write_once(file, instance.file.path)
+        
+        return StagedFile(instance, True, written, file), new_size
+    
+    def create(self, request, file: "InMemoryUploadedFile",
+               current_users_size=None):
+        """
+        Stages and commits a file in one go, see stage.
+        If storing the row fails, the written file is removed.
         
-        return instance, new_size
+        Args:
+            request:
+            file:
+            current_users_size:
+
+        Returns:
+            The newly saved, or cached file.
+            The current users size after saving the file.
+        """
+        staged_file, new_size = self.stage(request, file, current_users_size)
+        try:
+            return staged_file.commit(), new_size
+        except Exception:
+            staged_file.discard()
+            raise
     
     def get_all_for_user(self, user: User | int) -> QuerySet:
         """
@@ -146,7 +285,7 @@ class SavedFileManager(models.Manager):
         by a hash made from the file content.
         It will return the SavedFile instance if one exists,
         otherwise it returns None.
-        This will reduce the time it takes to search for a file.
+        The hash is unique and indexed, so this is an index lookup.
         
         THere is a statistical chance of finding a wrong match,
         however the chance of this is so low that this function
@@ -165,6 +304,15 @@ class SavedFileManager(models.Manager):
 
 
 class SavedFile(models.Model):
+    """
+    An input file saved to disk, shared by every job that saved the
+    same file.
+    
+    Next to the file, the post ingest pipeline writes the files derived
+    from it, see POST_INGEST_STAGES. The state of each stage is kept in
+    post_ingest_state. Until a derived file exists, the methods using it
+    fall back to the original file.
+    """
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     file = models.FileField(upload_to=saved_file_path_func)
     storage_space_in_b = models.IntegerField()
@@ -174,12 +322,157 @@ class SavedFile(models.Model):
     matrix_col_count = models.IntegerField()
     dimension = models.CharField(max_length=100)
     
-    hash = models.TextField()
+    hash = models.CharField(max_length=64, unique=True)
     
     date = models.DateTimeField(auto_now_add=True)
     
+    post_ingest_state = models.JSONField(default=dict)
+    
     objects = SavedFileManager()
     
+    @property
+    def columnar_file_path(self) -> str:
+        return columnar_path(self.file.path)
+    
+    def has_columnar_file(self) -> bool:
+        return os.path.isfile(self.columnar_file_path)
+    
+    def write_columnar_file(self) -> pl.DataFrame:
+        """
+        (Re)writes the columnar copy of the file from the original
+        csv file, and returns the parsed csv file in the types of
+        the copy.
+        """
+        df = to_columnar_dataframe(pl.read_csv(self.file.path))
+        write_columnar_file(df, self.columnar_file_path)
+        return df
+    
+    @property
+    def well_index_path(self) -> str:
+        return well_index_path(self.file.path)
+    
+    def has_well_index(self) -> bool:
+        return os.path.isdir(self.well_index_path)
+    
+    def write_well_index(self, df: pl.DataFrame = None) -> None:
+        """
+        (Re)builds the WellThresholdIndex of the file. If the DataFrame
+        is not passed it is loaded. See the build_well_indexes command for
+        files that were saved before the index existed.
+        """
+        if df is None:
+            df = self.load_polars_dataframe()
+        WellThresholdIndex.from_dataframe(df).save(self.well_index_path)
+    
+    def load_well_index(self) -> WellThresholdIndex | None:
+        """
+        Loads the WellThresholdIndex of the file, or None if it has
+        not been built. The caller then falls back to the DataFrame.
+        """
+        if not self.has_well_index():
+            return None
+        return WellThresholdIndex.load(self.well_index_path)
+    
+    @property
+    def well_cube_path(self) -> str:
+        return well_cube_path(self.file.path)
+    
+    def has_well_cube(self) -> bool:
+        return os.path.isfile(self.well_cube_path)
+    
+    def write_well_cube(self, df: pl.DataFrame = None) -> None:
+        """
+        (Re)builds the WellHistogramCube of the file. If the DataFrame
+        is not passed it is loaded.
+        """
+        if df is None:
+            df = self.load_polars_dataframe()
+        WellHistogramCube.from_dataframe(df).save(self.well_cube_path)
+    
+    def load_well_cube(self) -> WellHistogramCube | None:
+        """
+        Loads the WellHistogramCube of the file, or None if it has not
+        been built. Recently used cubes are kept in memory.
+        """
+        if not self.has_well_cube():
+            return None
+        return load_cached(self.well_cube_path)
+    
+    @property
+    def substance_histograms_path(self) -> str:
+        return substance_histograms_path(self.file.path)
+    
+    def has_substance_histograms(self) -> bool:
+        return os.path.isfile(self.substance_histograms_path)
+    
+    def write_substance_histograms(self, df: pl.DataFrame = None
+                                   ) -> SubstanceHistograms:
+        """
+        (Re)counts the SubstanceHistograms of the file. If the DataFrame
+        is not passed it is loaded.
+        """
+        if df is None:
+            df = self.load_polars_dataframe()
+        histograms = SubstanceHistograms.from_dataframe(df)
+        histograms.save(self.substance_histograms_path)
+        return histograms
+    
+    def load_substance_histograms(self, df: pl.DataFrame = None
+                                  ) -> SubstanceHistograms:
+        """
+        Loads the SubstanceHistograms of the file. Files saved before
+        these existed get them counted and written the first time
+        they are loaded, from df if it is passed.
+        """
+        if not self.has_substance_histograms():
+            return self.write_substance_histograms(df)
+        return SubstanceHistograms.load(self.substance_histograms_path)
+    
+    @property
+    def post_ingest_done(self) -> bool:
+        return stages_done(POST_INGEST_STAGES, self.post_ingest_state)
+    
+    def run_post_ingest(self, force: bool = False) -> dict:
+        """
+        Runs the stages of the post ingest pipeline that are not done,
+        in order, see POST_INGEST_STAGES and run_stages.
+        The state of the stages is stored in post_ingest_state.
+        
+        Args:
+            force: Run every stage, even if it is done
+
+        Returns: The state of the stages
+
+        """
+        def save_state(state: dict) -> None:
+            SavedFile.objects.filter(id=self.id).update(
+                post_ingest_state=state)
+        
+        return run_stages(POST_INGEST_STAGES, self,
+                          self.post_ingest_state, save_state, force)
+    
+    def load_polars_dataframe(self) -> pl.DataFrame:
+        """
+        Loads the content of the file.
+        
+        It reads the columnar copy, which is a lot faster than parsing
+        the csv file, and is memory mapped so it is shared between the
+        workers. If the copy does not exist (yet), it falls back
+        to parsing the original csv file.
+        
+        The parsed csv file is cast to the types of the copy. The counts
+        are cached by the hash of the file, see WellCountsCache, so both
+        have to give the same counts. A threshold equal to a value would
+        otherwise include a cell on the Float64 value of the csv file,
+        and not on the rounded Float32 value of the copy, or the reverse.
+        
+        Returns: polars DataFrame
+        
+        """
+        if self.has_columnar_file():
+            return read_columnar_file(self.columnar_file_path)
+        return to_columnar_dataframe(pl.read_csv(self.file.path))
+    
     @classmethod
     def delete_by_file_path(cls, file_path):
         """
@@ -210,10 +503,16 @@ class SavedFile(models.Model):
         It will check if any job makes use of the File.
         If a job does it will not delete itself.
         
-        If no jobs make any use of it, the file will be
-        removed from disk, after the removal of the file from
-        disk the SavedFile will be removed from the database
-        through the normal Django method.
+        If no jobs make any use of it, the SavedFile will be removed
+        from the database through the normal Django method, and the
+        file, its columnar copy, index, cube and histograms will be
+        removed from disk.
+        
+        The path of the file is shared with every upload of the same
+        content. The row is locked and checked again inside the
+        transaction that removes it and the files, so a save of the same
+        content either uses the file before it is deleted, or waits and
+        writes the file again, see StagedFile.commit.
         
         It is important to note that this delete method must
         always be called manually after first removing
@@ -231,9 +530,101 @@ class SavedFile(models.Model):
         Returns: None
 
         """
-        if self.job_files.all().exists():
-            return
+        with transaction.atomic():
+            # Locked, so a save of the same content waits until the
+            # row and the files are gone and then writes them again,
+            # or is first and uses the file, see StagedFile.commit
+            locked = SavedFile.objects.select_for_update() \
+                .filter(id=self.id).first()
+            if locked is None or locked.job_files.all().exists():
+                return
+            
+            result = super().delete(*args, **kwargs)
             
-        self.delete_by_file_path(self.file.path)
-        return super().delete(*args, **kwargs)
-    
\ No newline at end of file
+            if self.has_columnar_file():
+                self.delete_by_file_path(self.columnar_file_path)
+            if self.has_well_index():
+                shutil.rmtree(self.well_index_path, ignore_errors=True)
+            if self.has_well_cube():
+                self.delete_by_file_path(self.well_cube_path)
+            if self.has_substance_histograms():
+                self.delete_by_file_path(self.substance_histograms_path)
+            if os.path.isfile(self.file.path):
+                self.delete_by_file_path(self.file.path)
+        return result
+    
+
+
+def _stage_dataframe(saved_file: SavedFile, context: dict) -> pl.DataFrame:
+    if "df" not in context:
+        context["df"] = saved_file.load_polars_dataframe()
+    return context["df"]
+
+
+def _write_columnar_stage(saved_file: SavedFile, context: dict) -> None:
+    context["df"] = saved_file.write_columnar_file()
+
+
+def _filtered_files_with_snapshots(saved_file: SavedFile):
+    FilteredFile = apps.get_model("cellviewer", "FilteredFile")
+    return FilteredFile.objects.filter(saved_file=saved_file) \
+        .select_related("saved_file", "snapshot")
+
+
+def _has_snapshots(saved_file: SavedFile) -> bool:
+    AnalysisSnapshot = apps.get_model("cellviewer", "AnalysisSnapshot")
+    for filtered_file in _filtered_files_with_snapshots(saved_file):
+        try:
+            if not filtered_file.snapshot.is_valid_for(filtered_file):
+                return False
+        except AnalysisSnapshot.DoesNotExist:
+            return False
+    return True
+
+
+def _write_snapshots_stage(saved_file: SavedFile, context: dict) -> None:
+    for filtered_file in _filtered_files_with_snapshots(saved_file):
+        filtered_file.get_snapshot()
+
+
+POST_INGEST_STAGES = [
+    Stage("columnar", SavedFile.has_columnar_file, _write_columnar_stage),
+    Stage("well_index", SavedFile.has_well_index,
+          lambda f, context: f.write_well_index(_stage_dataframe(f, context))),
+    Stage("well_cube", SavedFile.has_well_cube,
+          lambda f, context: f.write_well_cube(_stage_dataframe(f, context))),
+    Stage("substance_histograms", SavedFile.has_substance_histograms,
+          lambda f, context: f.write_substance_histograms(
+              _stage_dataframe(f, context))),
+    Stage("snapshots", _has_snapshots, _write_snapshots_stage),
+]
+
+
+@background_task("post_ingest")
+def post_ingest_task(task, saved_file_ids: list[int]) -> str:
+    """
+    Runs the post ingest pipeline of the files of a save, after the
+    save is committed. Files that have been deleted since are skipped.
+    
+    Args:
+        task:
+        saved_file_ids:
+
+    Returns:
+
+    """
+    failed = []
+    for i, saved_file_id in enumerate(saved_file_ids):
+        task.set_progress(i / len(saved_file_ids),
+                          f"Processing file {i + 1} of {len(saved_file_ids)}")
+        saved_file = SavedFile.objects.filter(id=saved_file_id).first()
+        if saved_file is None:
+            continue
+        saved_file.run_post_ingest()
+        if not saved_file.post_ingest_done:
+            failed.append(saved_file_id)
+    
+    if failed:
+        raise RuntimeError(f"The post ingest pipeline failed for the "
+                           f"files {', '.join(map(str, failed))}")
+    return ""
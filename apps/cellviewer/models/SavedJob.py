@@ -4,16 +4,20 @@ from django.db import models
 from django.contrib.auth.models import User
 import polars as pl
 
-from django.db.models import QuerySet
+from django.db.models import QuerySet, F, Q
+from apps.users.models import Profile
 from apps.cellviewer.models.LabelMatrix import LabelMatrix
-from apps.cellviewer.models.SavedFile import SavedFile
+from apps.cellviewer.models.SavedFile import SavedFile, StagedFile
+from apps.cellviewer.models.BackgroundTask import BackgroundTask
+from apps.cellviewer.util.ingest import ingest_file
+from apps.cellviewer.util.keyset import encode_cursor, decode_cursor, \
+    split_page
 from django.db import transaction
 from django.apps import apps
 
 
 class SavedJobManager(models.Manager):
     
-    @transaction.atomic
     def create(
             self, request, files: list["InMemoryUploadedFile"],
             files_substance_thresholds,
@@ -26,20 +30,19 @@ class SavedJobManager(models.Manager):
             The files which are stored in SavedFile
             The LabelMatrix
         
-        The create is atomic to ensure that if anything goes wrong,
-        all changes will be reverted. This however does not revert
-        the saving of files to disk using FileField.
-        It is thereby possible for an orphaned file to occur.
-        Currently nothing is robustly in place
-        to ensure these do not occur. This would require an aggresive
-        check after each create when an error occurs,
-        or a scheduled cronjob.
-        Currently the saving of the files to disk is delayed as far
-        as possible until .save() is called.
-        is called on the SavedFile objects, the chance for an orphan
-        to occur is minimalized.
-        In theory this should only be possible with an unexpected
-        crash or forced shutdown of the system.
+        The save is done in two phases.
+        First every file is checked, parsed and written to disk as a
+        StagedFile, outside of any transaction, see SavedFileManager.stage.
+        On SQLite a write transaction locks the whole database, so
+        parsing a large file inside of it would make every other save
+        wait for it.
+        Then all the rows are created in one short atomic step, to ensure
+        that if anything goes wrong, all changes will be reverted.
+        
+        If anything goes wrong in either phase, the files that were
+        written to disk for this save are removed again, so no orphaned
+        files are left behind. In theory these can still occur with an
+        unexpected crash or forced shutdown of the system.
         
         There are multiple checks and errors the create can throw.
         
@@ -52,14 +55,22 @@ class SavedJobManager(models.Manager):
         can trigger this error through intended use.
         
         SavedFile throws a PermissionError if there is not enough
-        space available to the user to write the file.
+        space available to the user to write the file. As saves can run
+        at the same time, this is checked again when the rows are
+        stored, with the storage of the user locked, see _create_rows.
         
         Checks that the thresholds are present, and are valid values.
         If it is not present, or is not possible to convert to
         floats, it will set the threshold as zero.
         
-        Currently, any creates that happen in the middle if an error is raised remain
-        There will be objects created that are "orphaned"
+        The files derived from the saved files, such as the columnar
+        copy and the AnalysisSnapshot of the thresholds, are built by
+        the post ingest pipeline, which is started as a BackgroundTask
+        once the transaction is committed. This way the save only
+        stores the files and the rows, and returns without waiting
+        for these. Until they are built the job is shown from the
+        original file, see SavedFile.run_post_ingest.
+        
         Args:
             label_matrix_name:
             request:
@@ -71,17 +82,58 @@ class SavedJobManager(models.Manager):
         Returns:
 
         """
-        to_save_files = []
+        staged_files = []
+        try:
+            self._stage_files(request, files, labels, staged_files)
+            
+            files_substance_thresholds = [
+                self._checked_thresholds(request, file, substance_thresholds)
+                for file, substance_thresholds in
+                zip(files, files_substance_thresholds)
+            ]
+            
+            with transaction.atomic():
+                return self._create_rows(
+                    request, files, staged_files, files_substance_thresholds,
+                    name, labels, label_matrix_name
+                )
+        except Exception:
+            for staged_file in staged_files:
+                staged_file.discard()
+            raise
+    
+    @staticmethod
+    def _stage_files(request, files: list["InMemoryUploadedFile"],
+                     labels: tuple[tuple[str]],
+                     staged_files: list[StagedFile]) -> None:
+        """
+        Helper function
+        
+        The first phase of create, stages every file and checks the
+        dimensions. The staged files are added to staged_files as they
+        are written, so they can be discarded if a later file fails.
+        
+        Args:
+            request:
+            files:
+            labels:
+            staged_files:
+
+        Returns:
+
+        """
         first_dimension, next_dimension = (0, 0), (0, 0)
         
         current_users_size_in_b = SavedJob.objects.get_users_used_file_storage(
             request.user)
         
         for file in files:
-            initialized_file_object, current_users_size_in_b = (
-                SavedFile.objects.create(request, file,
-                                         current_users_size_in_b)
+            staged_file, current_users_size_in_b = (
+                SavedFile.objects.stage(request, file,
+                                        current_users_size_in_b)
             )
+            staged_files.append(staged_file)
+            initialized_file_object = staged_file.instance
             
             next_dimension = (initialized_file_object.matrix_row_count,
                               initialized_file_object.matrix_col_count)
@@ -99,7 +151,58 @@ class SavedJobManager(models.Manager):
                     )
             
             first_dimension = next_dimension
-            to_save_files.append(initialized_file_object)
+    
+    @staticmethod
+    def _checked_thresholds(request, file: "InMemoryUploadedFile",
+                            substance_thresholds: list[str]) -> list:
+        """
+        Helper function
+        
+        The thresholds if they are all present and numbers,
+        otherwise a threshold of zero for every substance.
+        """
+        try:
+            if not len(substance_thresholds):
+                raise ValueError
+            [float(i) for i in substance_thresholds]
+        except ValueError:
+            substance_thresholds = [0] * len(
+                ingest_file(request, file).substances)
+        return substance_thresholds
+    
+    def _create_rows(self, request, files: list["InMemoryUploadedFile"],
+                     staged_files: list[StagedFile],
+                     files_substance_thresholds, name: str,
+                     labels: tuple[tuple[str]], label_matrix_name: str
+                     ) -> "SavedJob":
+        """
+        Helper function
+        
+        The second phase of create, stores the rows of the files, the
+        LabelMatrix, the job and the FilteredFiles.
+        Called inside of a transaction.
+        
+        The used file storage of the user is locked first, so which
+        files are new to the user and the storage added for them
+        is decided one save at a time, see lock_users_used_file_storage.
+        The storage is then checked again, as another save may have
+        added files since the files were staged. If the new files do
+        not fit a PermissionError is raised.
+        
+        Args:
+            request:
+            files:
+            staged_files:
+            files_substance_thresholds:
+            name:
+            labels:
+            label_matrix_name:
+
+        Returns:
+
+        """
+        self.lock_users_used_file_storage(request.user)
+        to_save_files = [staged_file.commit() for staged_file in staged_files]
         
         if not label_matrix_name and name:
             label_matrix_name = f"{name}_annotation"
@@ -124,20 +227,10 @@ class SavedJobManager(models.Manager):
         
         FilteredFile = apps.get_model("cellviewer", "FilteredFile")
         
+        job_files = []
         for file, file_instance, substance_thresholds in \
                 zip(files, to_save_files, files_substance_thresholds):
-            
-            try:
-                if not len(substance_thresholds):
-                    raise ValueError
-                [float(i) for i in substance_thresholds]
-            except ValueError:
-                file.open()
-                header = str(file.readline())
-                substance_thresholds = [0] * (len(header.split(",")) - 3)
-                file.close()
-            
-            file_instance.save()
+            job_files.append(file_instance)
             
             filtered_file = FilteredFile.objects.create(
                 job=saved_job,
@@ -151,6 +244,18 @@ class SavedJobManager(models.Manager):
         
         # saved_job.files.add(*to_save_files)
         
+        new_to_user = self.files_new_to_user(request.user, job_files,
+                                             exclude_job=saved_job)
+        added_size_in_b = sum(f.storage_space_in_b for f in new_to_user)
+        self.check_users_file_storage(request.user, added_size_in_b)
+        self.add_to_users_used_file_storage(request.user, added_size_in_b)
+        
+        BackgroundTask.objects.enqueue(
+            "post_ingest",
+            {"saved_file_ids": [f.id for f in to_save_files]},
+            request.user
+        )
+        
         return saved_job
     
     def get_all_jobs_for_user(self, user: User | int) -> QuerySet:
@@ -175,7 +280,108 @@ class SavedJobManager(models.Manager):
         """
         return self.all()
     
+    def filter_viewable_jobs(self, user: User | int, owner: int = None,
+                             dimension: str = None, annotation: str = None,
+                             search: str = None) -> QuerySet:
+        """
+        The viewable jobs of get_all_viewable_jobs, narrowed down by the
+        filters of the saved jobs page. Filters that are not given
+        are not applied.
+        
+        Args:
+            user: User object or user id
+            owner: The id of the user that saved the job
+            dimension: The dimension, as stored on the job
+            annotation: Part of the name of the annotation
+            search: Part of the name of the job
+
+        Returns: Queryset
+        """
+        jobs = self.get_all_viewable_jobs(user)
+        if owner is not None:
+            jobs = jobs.filter(user_id=owner)
+        if dimension:
+            jobs = jobs.filter(dimension=dimension)
+        if annotation:
+            jobs = jobs.filter(
+                label_matrix__matrix_name__icontains=annotation)
+        if search:
+            jobs = jobs.filter(name__icontains=search)
+        return jobs
+    
+    @staticmethod
+    def page_of_jobs(jobs: QuerySet, after: str = None, page_size: int = 50,
+                     oldest_first: bool = False
+                     ) -> tuple[list[dict], str | None]:
+        """
+        A page of jobs ordered by date, continuing after the cursor of
+        the previous page.
+        
+        Rather than skipping the rows of the previous pages with an
+        offset, which the database has to go through, the page starts
+        from the date and id of the last job on the previous page.
+        With the date indexes of SavedJob this reads only the rows of
+        the page, no matter how far along the list it is.
+        
+        Args:
+            jobs: Queryset of jobs, see filter_viewable_jobs
+            after: The cursor returned with the previous page
+            page_size:
+            oldest_first: Ordered by the oldest job first instead of
+                the newest
+
+        Returns: The jobs of the page as dictionaries,
+            and the cursor of the next page, None if this is the last
+
+        Raises:
+            ValueError: If after is not a cursor
+        """
+        if oldest_first:
+            jobs = jobs.order_by("date", "id")
+        else:
+            jobs = jobs.order_by("-date", "-id")
+        
+        if after:
+            date, job_id = decode_cursor(after)
+            if oldest_first:
+                jobs = jobs.filter(Q(date__gt=date) |
+                                   Q(date=date, id__gt=job_id))
+            else:
+                jobs = jobs.filter(Q(date__lt=date) |
+                                   Q(date=date, id__lt=job_id))
+        
+        jobs = jobs.values("id", "label_matrix_id", "user_id", "name",
+                           "label_matrix__matrix_name", "user__username",
+                           "date", "dimension")
+        page, has_next = split_page(list(jobs[:page_size + 1]), page_size)
+        
+        next_cursor = None
+        if has_next:
+            next_cursor = encode_cursor(page[-1]["date"], page[-1]["id"])
+        return page, next_cursor
+    
     def get_users_used_file_storage(self, user: User | int) -> int:
+        """
+        The used file storage of a user in bytes, as kept on the
+        Profile of the user, see add_to_users_used_file_storage.
+        This is a read of a single row, no matter how many jobs
+        the user has.
+        
+        Args:
+            user: User object or user id
+
+        Returns: Used file storage in bytes
+
+        """
+        if isinstance(user, User):
+            user = user.id
+        storage = Profile.objects.filter(user_id=user) \
+            .values_list("used_storage_in_b", flat=True).first()
+        if storage is None:
+            storage = 0
+        return storage
+    
+    def calculate_users_used_file_storage(self, user: User | int) -> int:
         """
         Determines an estimation of a users used file storage in bytes.
         by summing the size recorded into the database of
@@ -186,6 +392,9 @@ class SavedJobManager(models.Manager):
         However this is expected to be a small difference
         and not be significantly impactful.
         
+        This goes over all the jobs of the user, it is used to check
+        the stored usage, see the reconcile_storage_usage command.
+        
         Args:
             user: User object or user id
 
@@ -201,6 +410,115 @@ class SavedJobManager(models.Manager):
         if storage is None:
             storage = 0
         return storage
+    
+    @staticmethod
+    def lock_users_used_file_storage(user: User | int) -> None:
+        """
+        Locks the Profile of the user until the transaction ends.
+        
+        Which files are new to the user, see files_new_to_user, depends
+        on the other jobs of the user. Two saves of the same file at the
+        same time would both see it as new and both add its size. With
+        the Profile locked before the check, the second save waits
+        until the first is committed and then sees its job.
+        
+        Must be called inside a transaction, before files_new_to_user.
+        
+        Args:
+            user: User object or user id
+
+        Returns:
+
+        """
+        if isinstance(user, User):
+            user = user.id
+        list(Profile.objects.select_for_update().filter(user_id=user)
+             .values_list("id", flat=True))
+    
+    @staticmethod
+    def check_users_file_storage(user: User | int, size_in_b: int) -> None:
+        """
+        Checks if size_in_b more bytes fit in the storage space of the
+        user, reading the used storage and the storage space from the
+        Profile again.
+        
+        Only reliable when the storage is locked,
+        see lock_users_used_file_storage, otherwise another save can
+        add its files between the check and add_to_users_used_file_storage.
+        
+        Args:
+            user: User object or user id
+            size_in_b:
+
+        Returns:
+
+        Raises:
+            PermissionError: If there is not enough space
+        """
+        if isinstance(user, User):
+            user = user.id
+        if not size_in_b:
+            return
+        storage = Profile.objects.filter(user_id=user) \
+            .values_list("used_storage_in_b", "storage_space_in_gb").first()
+        if storage is None:
+            return
+        used_storage_in_b, storage_space_in_gb = storage
+        if used_storage_in_b + size_in_b > storage_space_in_gb * 1000000000:
+            raise PermissionError("Not enough space to write more files")
+    
+    @staticmethod
+    def add_to_users_used_file_storage(user: User | int, size_in_b: int
+                                       ) -> None:
+        """
+        Adds to, or with a negative size subtracts from, the used file
+        storage on the Profile of the user. This is done with an F
+        expression in the database, so saves and deletes happening at
+        the same time do not overwrite each other's change.
+        
+        Args:
+            user: User object or user id
+            size_in_b:
+
+        Returns:
+
+        """
+        if isinstance(user, User):
+            user = user.id
+        if user is None or not size_in_b:
+            return
+        Profile.objects.filter(user_id=user).update(
+            used_storage_in_b=F("used_storage_in_b") + size_in_b)
+    
+    @staticmethod
+    def files_new_to_user(user: User | int, saved_files: list[SavedFile],
+                          exclude_job: "SavedJob" = None) -> list[SavedFile]:
+        """
+        The distinct files that are not used by any job of the user,
+        besides exclude_job. Only these change the used file storage
+        of the user when a job is added or removed.
+        
+        Args:
+            user: User object or user id
+            saved_files:
+            exclude_job: A job to leave out
+
+        Returns:
+
+        """
+        if isinstance(user, User):
+            user = user.id
+        FilteredFile = apps.get_model("cellviewer", "FilteredFile")
+        used = FilteredFile.objects.filter(
+            job__user_id=user,
+            saved_file__in=saved_files
+        )
+        if exclude_job is not None:
+            used = used.exclude(job=exclude_job)
+        used = set(used.values_list("saved_file_id", flat=True))
+        
+        unique_files = {f.id: f for f in saved_files}
+        return [f for f_id, f in unique_files.items() if f_id not in used]
 
 
 class SavedJob(models.Model):
@@ -236,6 +554,18 @@ class SavedJob(models.Model):
     
     objects = SavedJobManager()
     
+    class Meta:
+        # The saved jobs page lists the jobs by date, also when filtered
+        # by user or dimension, see SavedJobManager.page_of_jobs
+        indexes = [
+            models.Index(fields=["-date", "-id"],
+                         name="savedjob_date_idx"),
+            models.Index(fields=["user", "-date", "-id"],
+                         name="savedjob_user_date_idx"),
+            models.Index(fields=["dimension", "-date", "-id"],
+                         name="savedjob_dimension_date_idx"),
+        ]
+    
     def delete(self, *args, **kwargs):
         """
         Deletes a SavedJob
@@ -251,6 +581,11 @@ class SavedJob(models.Model):
         This too fails silently if it is referenced by other
         SavedJobs.
         
+        The files that no other job of the user uses are subtracted
+        from the used file storage of the user, with the storage locked
+        in the same way as when a job is saved,
+        see SavedJobManager.lock_users_used_file_storage.
+        
         Args:
             *args:
             **kwargs:
@@ -258,13 +593,23 @@ class SavedJob(models.Model):
         Returns:
 
         """
-        for saved_file in self.files.all():
-            self.files.remove(saved_file)
-            saved_file.delete()
-        
-        self.label_matrix.delete()
-        
-        return super().delete(*args, **kwargs)
+        with transaction.atomic():
+            SavedJob.objects.lock_users_used_file_storage(self.user_id)
+            
+            saved_files = list(self.files.all())
+            freed = SavedJob.objects.files_new_to_user(
+                self.user_id, saved_files, exclude_job=self)
+            
+            for saved_file in saved_files:
+                self.files.remove(saved_file)
+                saved_file.delete()
+            
+            SavedJob.objects.add_to_users_used_file_storage(
+                self.user_id, -sum(f.storage_space_in_b for f in freed))
+            
+            self.label_matrix.delete()
+            
+            return super().delete(*args, **kwargs)
     
     def is_viewable_by(self, user: int | User):
         """
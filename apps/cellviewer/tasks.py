@@ -0,0 +1,30 @@
+"""
+The modules that define background tasks, see
+apps/cellviewer/util/background_tasks.py. Importing this module
+registers every task, which a worker started with the
+run_background_tasks command needs before it can run them.
+
+The Celery workers find this module through autodiscover_tasks,
+see core/celery.py, and run the tasks through run_background_task.
+"""
+import apps.cellviewer.views.aggregate_jobs  # noqa: F401
+import apps.cellviewer.views.index  # noqa: F401
+import apps.cellviewer.models.SavedFile  # noqa: F401
+
+try:
+    from celery import shared_task
+except ImportError:
+    shared_task = None
+
+
+if shared_task is not None:
+    @shared_task(name="cellviewer.run_background_task")
+    def run_background_task(task_id: int) -> None:
+        """
+        Runs a stored BackgroundTask in a Celery worker, used when
+        BACKGROUND_TASK_USE_CELERY is set. The status, progress and
+        result are kept on the BackgroundTask, the same as when it runs
+        in any other way, so the page polling it does not change.
+        """
+        from apps.cellviewer.models.BackgroundTask import run_task_by_id
+        run_task_by_id(task_id)
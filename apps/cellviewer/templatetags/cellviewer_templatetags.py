@@ -1,5 +1,7 @@
 
 from django import template
+from django.conf import settings
+from django.templatetags.static import static
 
 register = template.Library()
 
@@ -18,3 +20,14 @@ def at_index_i(list_like, i):
 
     """
     return list_like[i]
+
+
+@register.simple_tag
+def plotly_js_url():
+    """
+    The url of plotly.js, served from the installed plotly package.
+    See PLOTLY_STATIC_PREFIX in the settings.
+    Returns:
+
+    """
+    return static(f"{settings.PLOTLY_STATIC_PREFIX}/plotly.min.js")
@@ -1,3 +1,432 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+import polars as pl
+from django.test import TestCase, RequestFactory, SimpleTestCase, \
+    override_settings
+
+from apps.cellviewer.models.BackgroundTask import BackgroundTask
+from apps.cellviewer.models.SavedFile import SavedFile
+from apps.cellviewer.models.SavedJob import SavedJob, SavedJobManager
+from apps.cellviewer.util.background_tasks import run_task
+from apps.cellviewer.util.dataset_store import store_dataset, load_dataset, \
+    load_dataset_cube, load_dataset_metadata, reap_expired_datasets
+from apps.cellviewer.util.matrix_functions import \
+    calculate_well_counts_and_percent
+from apps.users.models import Profile
+
+# Tests that need the database, run with python manage.py test
+
+LABELS = (("B", "C"), ("02", "03"), ("a", "b", "c", "d"))
+LABEL_INPUTS = {"default-rows": "B,,,C", "default-cols": "02,,,03",
+                "row": ["", ""], "col": ["", ""], "cell": [""] * 4}
+
+
+def plate_file(seed: int = 0, name: str = "plate.csv") -> SimpleUploadedFile:
+    """A small plate of 2x2 wells, the content differs per seed."""
+    return SimpleUploadedFile(name, (
+        f"Well,Site,Cell,OCT4,SOX17\n"
+        f"B02,1,1,{seed}.5,2.9\n"
+        f"C03,1,2,3,3.4\n"
+    ).encode())
+
+
+def large_plate_file(cells: int = 100_000) -> SimpleUploadedFile:
+    """A plate of 2x2 wells with many cells."""
+    rng = np.random.default_rng(0)
+    wells = rng.choice(["B02", "B03", "C02", "C03"], size=cells)
+    values = np.round(rng.exponential(2, size=(cells, 2)), 3)
+    lines = ["Well,Site,Cell,OCT4,SOX17"] + [
+        f"{well},1,{i},{a},{b}"
+        for i, (well, (a, b)) in enumerate(zip(wells, values))]
+    return SimpleUploadedFile("large.csv", ("\n".join(lines) + "\n").encode())
+
+
+class MediaRootTestCase(TestCase):
+    """Writes the saved files to a temporary directory."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+
+        self.user = User.objects.create_user("tester", password="tester")
+
+    def request(self, user: User = None):
+        request = RequestFactory().post("/save_job")
+        request.user = user or self.user
+        return request
+
+    def save_job(self, file: SimpleUploadedFile, user: User = None
+                 ) -> SavedJob:
+        return SavedJob.objects.create(self.request(user), [file],
+                                       [["1", "2"]], "job", LABELS, "")
+
+    def set_storage_space(self, size_in_b: float) -> None:
+        self.user.profile.storage_space_in_gb = size_in_b / 1000000000
+        self.user.profile.save()
+
+    def used_storage(self, user: User = None) -> int:
+        return Profile.objects.get(user=user or self.user).used_storage_in_b
+
+
+class TestUsedFileStorage(MediaRootTestCase):
+
+    def test_save_adds_the_file(self):
+        file = plate_file()
+        self.save_job(file)
+        assert self.used_storage() == file.size
+
+    def test_file_saved_before_is_not_counted_again(self):
+        file = plate_file()
+        self.save_job(file)
+        self.save_job(plate_file())
+        assert SavedFile.objects.count() == 1
+        assert self.used_storage() == file.size
+
+    def test_file_of_other_user_is_counted(self):
+        other = User.objects.create_user("other", password="other")
+        file = plate_file()
+        self.save_job(file, other)
+        self.save_job(plate_file())
+        assert self.used_storage(other) == file.size
+        assert self.used_storage() == file.size
+
+    def test_delete_subtracts_the_file(self):
+        first, second = plate_file(0), plate_file(1)
+        job = self.save_job(first)
+        self.save_job(second)
+        job.delete()
+        assert self.used_storage() == second.size
+
+    def test_delete_keeps_a_file_used_by_another_job(self):
+        file = plate_file()
+        job = self.save_job(file)
+        self.save_job(plate_file())
+        job.delete()
+        assert self.used_storage() == file.size
+
+    def test_full_storage(self):
+        self.set_storage_space(plate_file().size * 1.5)
+        self.save_job(plate_file(0))
+        with self.assertRaises(PermissionError):
+            self.save_job(plate_file(1))
+        assert SavedJob.objects.count() == 1
+
+    def test_storage_filled_by_another_save_in_between(self):
+        """
+        Another save adding its files after the file was staged,
+        but before the rows are stored.
+        """
+        file = plate_file()
+        self.set_storage_space(file.size * 1.5)
+        checked_thresholds = SavedJobManager._checked_thresholds
+
+        def save_in_between(*args):
+            SavedJob.objects.add_to_users_used_file_storage(self.user,
+                                                            file.size)
+            return checked_thresholds(*args)
+
+        with patch.object(SavedJobManager, "_checked_thresholds",
+                          side_effect=save_in_between):
+            with self.assertRaises(PermissionError):
+                self.save_job(file)
+
+        assert SavedJob.objects.count() == 0
+        assert SavedFile.objects.count() == 0
+        assert self.used_storage() == file.size
+        assert not any(files for _, _, files in os.walk(self.media_root))
+
+    def test_reconcile_corrects_drift(self):
+        file = plate_file()
+        self.save_job(file)
+        Profile.objects.filter(user=self.user).update(used_storage_in_b=5)
+
+        call_command("reconcile_storage_usage", "--dry-run",
+                     stdout=StringIO(), stderr=StringIO())
+        assert self.used_storage() == 5
+
+        stdout = StringIO()
+        call_command("reconcile_storage_usage", stdout=stdout,
+                     stderr=StringIO())
+        assert self.used_storage() == file.size
+        assert stdout.getvalue().startswith("1 profile(s) differed")
+
+
+class TestStagedFile(MediaRootTestCase):
+
+    def stored_files(self) -> list[str]:
+        return [os.path.join(root, name)
+                for root, _, files in os.walk(self.media_root)
+                for name in files]
+
+    def test_failed_create_rows_is_discarded(self):
+        """
+        The rows are stored before the save fails, and rolled back,
+        so the written file is removed as well.
+        """
+        create_rows = SavedJobManager._create_rows
+
+        def fail_after_create_rows(*args):
+            create_rows(SavedJob.objects, *args)
+            assert SavedFile.objects.count() == 1
+            raise RuntimeError("failed after the rows were stored")
+
+        with patch.object(SavedJobManager, "_create_rows",
+                          side_effect=fail_after_create_rows):
+            with self.assertRaises(RuntimeError):
+                self.save_job(plate_file())
+
+        assert SavedFile.objects.count() == 0
+        assert SavedJob.objects.count() == 0
+        assert self.stored_files() == []
+
+    def test_discard_keeps_an_existing_file(self):
+        self.save_job(plate_file())
+        staged_file, _ = SavedFile.objects.stage(self.request(), plate_file())
+        assert not staged_file.is_new
+
+        staged_file.discard()
+        assert len(self.stored_files()) == 1
+
+    def test_commit_of_an_existing_file_does_not_write(self):
+        self.save_job(plate_file())
+        path, = self.stored_files()
+        inode = os.stat(path).st_ino
+
+        staged_file, _ = SavedFile.objects.stage(self.request(), plate_file())
+        with patch("apps.cellviewer.models.SavedFile.write_once") as write:
+            assert staged_file.commit() == SavedFile.objects.get()
+        write.assert_not_called()
+        assert self.stored_files() == [path]
+        assert os.stat(path).st_ino == inode
+
+    def test_commit_of_a_hash_saved_in_between(self):
+        """
+        Another save stores the same file after it was staged,
+        the row of that save is used and the file is kept.
+        """
+        staged_file, _ = SavedFile.objects.stage(self.request(), plate_file())
+        assert staged_file.is_new and staged_file.written
+        path, = self.stored_files()
+        inode = os.stat(path).st_ino
+
+        job = self.save_job(plate_file())
+        saved_file = staged_file.commit()
+        assert not staged_file.is_new
+        assert saved_file == job.filteredfile_set.get().saved_file
+
+        staged_file.discard()
+        assert self.stored_files() == [path]
+        assert os.stat(path).st_ino == inode
+
+
+@override_settings(BACKGROUND_TASK_WORKERS=0,
+                   BACKGROUND_TASK_USE_CELERY=False)
+class TestSaveJob(MediaRootTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def post_save_job(self, file: SimpleUploadedFile):
+        return self.client.post("/save_job", {
+            **LABEL_INPUTS, "inputData": file, "name": "saved",
+            "substance_threshold": ["1", "2"]
+        })
+
+    def test_saved_by_a_background_task(self):
+        response = self.post_save_job(plate_file())
+        task = BackgroundTask.objects.get(name="save_job")
+        assert response.status_code == 200
+        assert f"/background_tasks/{task.id}".encode() in response.content
+        assert SavedJob.objects.count() == 0
+
+        assert run_task(task)
+        task.refresh_from_db()
+        assert task.status == BackgroundTask.DONE, task.message
+        job = SavedJob.objects.get()
+        assert job.name == "saved"
+        assert f"saved_jobs/{job.id}" in task.result
+        assert os.listdir(os.path.join(self.media_root, "uploads")) == []
+
+    def test_failed_save_removes_the_upload(self):
+        self.set_storage_space(1)
+        self.post_save_job(plate_file())
+        task = BackgroundTask.objects.get(name="save_job")
+
+        run_task(task)
+        task.refresh_from_db()
+        assert task.status == BackgroundTask.FAILED
+        assert "Not enough space" in task.message
+        assert SavedJob.objects.count() == 0
+        assert os.listdir(os.path.join(self.media_root, "uploads")) == []
+
+    def test_invalid_file_is_not_saved(self):
+        response = self.post_save_job(SimpleUploadedFile(
+            "plate.csv", b"Well,Site,Cell,OCT4\nB02,1,x,2\n"))
+        assert response.status_code == 200
+        assert not BackgroundTask.objects.exists()
+
+
+class TestStartBackgroundTask(TestCase):
+
+    @override_settings(BACKGROUND_TASK_WORKERS=0,
+                       BACKGROUND_TASK_USE_CELERY=True)
+    def test_sent_to_celery(self):
+        with patch("apps.cellviewer.tasks.run_background_task") as celery:
+            with self.captureOnCommitCallbacks(execute=True):
+                task = BackgroundTask.objects.enqueue("post_ingest", {}, None)
+        celery.delay.assert_called_once_with(task.id)
+
+    @override_settings(BACKGROUND_TASK_WORKERS=0,
+                       BACKGROUND_TASK_USE_CELERY=False)
+    def test_waits_for_the_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            BackgroundTask.objects.enqueue("post_ingest", {}, None)
+        assert BackgroundTask.objects.get().status == BackgroundTask.PENDING
+
+
+class TestLoadPolarsDataframe(MediaRootTestCase):
+
+    def test_csv_same_as_columnar_copy(self):
+        """
+        Both are cached under the hash of the file, so a threshold just
+        above a value, which the Float32 copy rounds up to the value,
+        has to give the same counts.
+        """
+        self.save_job(plate_file())
+        saved_file = SavedFile.objects.get()
+        assert not saved_file.has_columnar_file()
+        csv_df = saved_file.load_polars_dataframe()
+        saved_file.write_columnar_file()
+        df = saved_file.load_polars_dataframe()
+
+        assert csv_df.equals(df)
+        assert csv_df.dtypes == df.dtypes
+        for thresholds in [[0, 0], [3.0000001, 0], [0, 3.4000001]]:
+            assert calculate_well_counts_and_percent(csv_df, thresholds)[1] \
+                .equals(calculate_well_counts_and_percent(df, thresholds)[1])
+
+
+class TestDatasetStore(SimpleTestCase):
+
+    def setUp(self):
+        self.store_directory = tempfile.mkdtemp()
+        store_settings = override_settings(
+            DATASET_STORE_DIR=self.store_directory, DATASET_STORE_TTL=60)
+        store_settings.enable()
+        self.addCleanup(store_settings.disable)
+        self.addCleanup(shutil.rmtree, self.store_directory, True)
+
+        self.df = pl.read_csv(plate_file().read())
+
+    def stored_files(self) -> list[str]:
+        return sorted(name for _, _, files in os.walk(self.store_directory)
+                      for name in files)
+
+    def test_load_by_owner(self):
+        token = store_dataset(self.df, 1)
+        assert load_dataset(token, 1).equals(self.df)
+        assert load_dataset_metadata(token, 1) == {
+            "substances": ["OCT4", "SOX17"], "amount_of_sites": 1}
+        assert load_dataset_cube(token, 1) is not None
+
+    def test_load_by_other_user(self):
+        token = store_dataset(self.df, 1)
+        with self.assertRaises(FileNotFoundError):
+            load_dataset(token, 2)
+        with self.assertRaises(FileNotFoundError):
+            load_dataset_metadata(token, 2)
+        with self.assertRaises(FileNotFoundError):
+            load_dataset_cube(token, 2)
+
+    def test_malformed_token(self):
+        store_dataset(self.df, 1)
+        for token in ["", "short", "../1/" + "a" * 32, "a" * 31 + "."]:
+            with self.assertRaises(ValueError):
+                load_dataset(token, 1)
+
+    def test_reap_removes_the_files_of_a_dataset_together(self):
+        expired = store_dataset(self.df, 1)
+        used = store_dataset(self.df, 1)
+        assert len(self.stored_files()) == 6
+
+        long_ago = time.time() - 120
+        for name in self.stored_files():
+            os.utime(os.path.join(self.store_directory, "1", name),
+                     (long_ago, long_ago))
+        # Only the cube is read by a preview, which keeps the whole
+        # dataset in use
+        load_dataset_cube(used, 1)
+
+        assert reap_expired_datasets() == 1
+        assert all(name.startswith(used) for name in self.stored_files())
+        assert len(self.stored_files()) == 3
+        with self.assertRaises(FileNotFoundError):
+            load_dataset_metadata(expired, 1)
+        assert load_dataset(used, 1).equals(self.df)
+
+
+class TestPlotlyJsFinder(TestCase):
+
+    def test_only_plotly_js(self):
+        prefix = settings.PLOTLY_STATIC_PREFIX
+        path = finders.find(f"{prefix}/plotly.min.js")
+        assert path and path.endswith("plotly.min.js")
+        assert not finders.find(f"{prefix}/datasets/iris.csv.gz")
+
+        listed = [path for finder in finders.get_finders()
+                  for path, storage in finder.list([])
+                  if getattr(storage, "prefix", None) == prefix]
+        assert listed == ["plotly.min.js"]
+
+
+class TestPageSize(MediaRootTestCase):
+    """
+    The figures are sent as JSON with binned data, and plotly.js is
+    loaded once from the static files, so the size of the pages does
+    not grow with the amount of cells.
+    """
+    MAX_PAGE_SIZE = 200_000
+    MAX_UPDATE_SIZE = 50_000
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.job = self.save_job(large_plate_file())
+
+    def assert_no_plotly_js(self, content: bytes):
+        assert b"* plotly.js v" not in content
+
+    def test_display_job(self):
+        response = self.client.get(f"/saved_jobs/{self.job.id}/")
+        assert response.status_code == 200
+        assert len(response.content) < self.MAX_PAGE_SIZE, \
+            len(response.content)
+        self.assert_no_plotly_js(response.content)
+        assert b"plotly.min.js" in response.content
+
+    def test_update_filtered_plots(self):
+        for preview in ["", "1"]:
+            response = self.client.post("/update_filtered_plots", {
+                "job_id": str(self.job.id), "preview": preview,
+                "substance_threshold": ["2", "2"],
+            })
+            assert response.status_code == 200
+            assert len(response.content) < self.MAX_UPDATE_SIZE, \
+                len(response.content)
+            self.assert_no_plotly_js(response.content)
+            assert b"Plotly.newPlot" in response.content
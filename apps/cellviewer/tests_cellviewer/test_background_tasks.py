@@ -0,0 +1,99 @@
+import threading
+from unittest import TestCase
+
+from apps.cellviewer.util.background_tasks import background_task, \
+    run_task, submit, TASKS
+
+
+class FakeTask:
+    """Has the methods of a BackgroundTask that run_task uses."""
+
+    def __init__(self, name, arguments=None, pending=True):
+        self.id = 1
+        self.name = name
+        self.arguments = arguments or {}
+        self.status = "pending" if pending else "running"
+        self.result = None
+        self.message = ""
+
+    def claim(self):
+        if self.status != "pending":
+            return False
+        self.status = "running"
+        return True
+
+    def finish(self, result):
+        self.status, self.result = "done", result
+
+    def fail(self, message):
+        self.status, self.message = "failed", message
+
+
+class TestRunTask(TestCase):
+    def test_result_is_stored(self):
+        task = FakeTask("add", {"a": 1, "b": 2})
+        tasks = {"add": lambda task, a, b: a + b}
+        assert run_task(task, tasks)
+        assert task.status == "done"
+        assert task.result == 3
+
+    def test_task_is_passed_to_function(self):
+        task = FakeTask("self")
+        run_task(task, {"self": lambda task: task.status})
+        assert task.result == "running"
+
+    def test_exception_fails_task(self):
+        def fail(task):
+            raise ValueError("broken plate")
+
+        task = FakeTask("fail")
+        assert run_task(task, {"fail": fail})
+        assert task.status == "failed"
+        assert task.message == "broken plate"
+
+    def test_unknown_task_fails(self):
+        task = FakeTask("missing")
+        run_task(task, {})
+        assert task.status == "failed"
+
+    def test_claimed_task_is_not_run(self):
+        calls = []
+        task = FakeTask("count", pending=False)
+        assert not run_task(task, {"count": lambda task: calls.append(1)})
+        assert calls == []
+        assert task.status == "running"
+
+
+class TestBackgroundTask(TestCase):
+    def tearDown(self):
+        TASKS.pop("test_registered", None)
+
+    def test_registers_function(self):
+        @background_task("test_registered")
+        def registered(task):
+            return "ok"
+
+        assert TASKS["test_registered"] is registered
+        task = FakeTask("test_registered")
+        run_task(task)
+        assert task.result == "ok"
+
+    def test_name_can_not_be_reused(self):
+        background_task("test_registered")(lambda task: 1)
+        with self.assertRaises(ValueError):
+            background_task("test_registered")(lambda task: 2)
+
+
+class TestSubmit(TestCase):
+    def test_runs_in_other_thread(self):
+        done = threading.Event()
+        threads = []
+
+        def work(value):
+            threads.append((threading.get_ident(), value))
+            done.set()
+
+        submit(work, 5, max_workers=1)
+        assert done.wait(5)
+        assert threads[0][0] != threading.get_ident()
+        assert threads[0][1] == 5
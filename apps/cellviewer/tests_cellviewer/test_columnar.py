@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import polars as pl
+
+from apps.cellviewer.util.columnar import write_columnar_file, \
+    read_columnar_file, to_columnar_dataframe
+from apps.cellviewer.util.matrix_functions import \
+    calculate_well_counts_and_percent
+
+CSV = (
+    "Well,Site,Cell,OCT4,SOX17\n"
+    "B02,1,1,0.1,2.9\n"
+    "B02,1,2,3.5,0.3\n"
+    "C03,2,1,0.3,\n"
+    "C03,2,2,1.7,3.4\n"
+)
+
+
+class TestColumnar(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.csv_path = os.path.join(self.directory, "plate.csv")
+        with open(self.csv_path, "w") as f:
+            f.write(CSV)
+        self.path = os.path.join(self.directory, "plate.csv.arrow")
+
+    def test_types(self):
+        df = to_columnar_dataframe(pl.read_csv(self.csv_path))
+        assert df.dtypes == [pl.Categorical, pl.Int32, pl.Int32,
+                             pl.Float32, pl.Float32], df.dtypes
+
+    def test_round_trip(self):
+        expected = to_columnar_dataframe(pl.read_csv(self.csv_path))
+        write_columnar_file(pl.read_csv(self.csv_path), self.path)
+
+        result = read_columnar_file(self.path)
+        assert result.equals(expected)
+        assert result.dtypes == expected.dtypes
+        assert result["SOX17"].null_count() == 1
+        assert sorted(os.listdir(self.directory)) == ["plate.csv",
+                                                      "plate.csv.arrow"]
+
+    def test_memory_mapped_same_as_csv(self):
+        """
+        The memory mapped copy gives the same counts as the parsed
+        csv file cast to its types, including the thresholds equal
+        to a value, which is rounded in the Float32 column.
+        """
+        write_columnar_file(pl.read_csv(self.csv_path), self.path)
+        df = read_columnar_file(self.path)
+        csv_df = to_columnar_dataframe(pl.read_csv(self.csv_path))
+
+        for thresholds in [[0, 0], [0.1, 0], [0.3, 0.3], [1.7, 2.9]]:
+            result = calculate_well_counts_and_percent(df, thresholds)
+            expected = calculate_well_counts_and_percent(csv_df, thresholds)
+            for matrix, expected_matrix in zip(result, expected):
+                assert matrix.equals(expected_matrix), thresholds
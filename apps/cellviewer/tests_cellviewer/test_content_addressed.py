@@ -0,0 +1,103 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from apps.cellviewer.util.content_addressed import content_addressed_name, \
+    write_once
+
+
+class TestContentAddressedName(TestCase):
+    def test_name_from_hash(self):
+        file_hash = hashlib.sha256(b"Well,Site,Cell\n").hexdigest()
+        name = content_addressed_name(file_hash)
+        assert name == f"saved_files/{file_hash[:2]}/{file_hash[2:4]}/" \
+                       f"{file_hash}.csv"
+
+    def test_not_a_hash(self):
+        for file_hash in ["", "../../etc/passwd", "A" * 64, "a" * 63]:
+            with self.assertRaises(ValueError):
+                content_addressed_name(file_hash)
+
+
+class TestWriteOnce(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "ab", "cd", "file.csv")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_writes_content(self):
+        content = b"Well,Site,Cell\nB02,1,1\n" * 1000
+        assert write_once(SimpleUploadedFile("a.csv", content), self.path)
+        with open(self.path, "rb") as f:
+            assert f.read() == content
+        assert os.listdir(os.path.dirname(self.path)) == ["file.csv"]
+
+    def test_existing_file_is_not_written_again(self):
+        write_once(SimpleUploadedFile("a.csv", b"first"), self.path)
+        modified = os.path.getmtime(self.path)
+        assert not write_once(SimpleUploadedFile("b.csv", b"first"),
+                              self.path)
+        assert os.path.getmtime(self.path) == modified
+
+    def test_reads_from_start(self):
+        upload = SimpleUploadedFile("a.csv", b"content")
+        upload.read()
+        write_once(upload, self.path)
+        with open(self.path, "rb") as f:
+            assert f.read() == b"content"
+
+    def test_waits_for_the_claim_of_another_write(self):
+        """
+        Another request claimed the path, so the content is not
+        written a second time.
+        """
+        os.makedirs(os.path.dirname(self.path))
+        claim_path = f"{self.path}.claim"
+        open(claim_path, "wb").close()
+        upload = SimpleUploadedFile("a.csv", b"content")
+        results = []
+
+        with patch.object(upload, "chunks") as chunks:
+            writer = threading.Thread(
+                target=lambda: results.append(write_once(upload, self.path)))
+            writer.start()
+            time.sleep(0.2)
+            assert writer.is_alive()
+
+            with open(claim_path, "wb") as f:
+                f.write(b"content")
+            os.replace(claim_path, self.path)
+            writer.join(5)
+
+        assert results == [False]
+        chunks.assert_not_called()
+        assert os.listdir(os.path.dirname(self.path)) == ["file.csv"]
+
+    def test_claim_left_behind_is_removed(self):
+        os.makedirs(os.path.dirname(self.path))
+        claim_path = f"{self.path}.claim"
+        open(claim_path, "wb").close()
+        long_ago = time.time() - 120
+        os.utime(claim_path, (long_ago, long_ago))
+
+        assert write_once(SimpleUploadedFile("a.csv", b"content"), self.path)
+        with open(self.path, "rb") as f:
+            assert f.read() == b"content"
+        assert os.listdir(os.path.dirname(self.path)) == ["file.csv"]
+
+    def test_failed_write_releases_the_claim(self):
+        upload = SimpleUploadedFile("a.csv", b"content")
+        with patch.object(upload, "chunks", side_effect=OSError("disk")):
+            with self.assertRaises(OSError):
+                write_once(upload, self.path)
+        assert os.listdir(os.path.dirname(self.path)) == []
+
+        assert write_once(upload, self.path)
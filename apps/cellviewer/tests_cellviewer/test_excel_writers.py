@@ -0,0 +1,33 @@
+import io
+from unittest import TestCase
+
+from openpyxl import load_workbook
+
+from apps.cellviewer.tests_cellviewer.test_well_index import random_plate
+from apps.cellviewer.util.excel_writers import \
+    write_individual_analysis_to_bytes, INDIVIDUAL_MATRIX_EXPLANATIONS
+from apps.cellviewer.util.matrix_functions import \
+    calculate_well_counts_and_percent
+
+
+class TestExcelWriters(TestCase):
+
+    def test_individual_analysis(self):
+        df = random_plate(2)
+        matrices = calculate_well_counts_and_percent(df, [1, 2])
+
+        content = write_individual_analysis_to_bytes(
+            file_name="plate.csv",
+            experiment_name="plate",
+            amount_of_sites=df["Site"].max(),
+            substance_names=df.columns[3:],
+            substance_thresholds=[1, 2],
+            matrix_explanations=INDIVIDUAL_MATRIX_EXPLANATIONS,
+            matrices=list(matrices)
+        )
+
+        sheet = load_workbook(io.BytesIO(content))["Sheet1"]
+        values = [cell.value for row in sheet.iter_rows() for cell in row]
+        assert "plate.csv" in values
+        for explanation in INDIVIDUAL_MATRIX_EXPLANATIONS:
+            assert explanation in values
@@ -0,0 +1,90 @@
+from unittest import TestCase
+
+from apps.cellviewer.util.file_validation import CellFileValidator
+
+VALID_FILE = (b"Well,Site,Cell,OCT4,SOX17\n"
+              b"B02,1,1,2.7,2.9\n"
+              b"B02,1,2,3,3.4\n"
+              b"C12,2,1,0.5,10.\n")
+
+
+def validate(content: bytes, chunk_size: int = None,
+             max_reported_lines: int = 10) -> CellFileValidator:
+    validator = CellFileValidator(max_reported_lines)
+    chunk_size = chunk_size or max(len(content), 1)
+    for i in range(0, len(content), chunk_size):
+        validator.feed(content[i:i + chunk_size])
+    validator.finish()
+    return validator
+
+
+class TestCellFileValidator(TestCase):
+
+    def test_valid_file(self):
+        validator = validate(VALID_FILE)
+        assert validator.is_valid, validator.error_text
+        assert validator.line_count == 3
+
+    def test_every_chunk_size_gives_the_same_result(self):
+        """
+        Lines and line endings that are split over two chunks,
+        including a \\r\\n split between the \\r and the \\n, should not
+        make a difference.
+        """
+        for content in [VALID_FILE, VALID_FILE.replace(b"\n", b"\r\n"),
+                        VALID_FILE.replace(b"\n", b"\r")]:
+            for chunk_size in range(1, 20):
+                validator = validate(content, chunk_size)
+                assert validator.is_valid, \
+                    f"chunk size {chunk_size}: {validator.error_text}"
+                assert validator.line_count == 3
+
+    def test_last_line_without_line_ending(self):
+        assert validate(VALID_FILE.rstrip(b"\n")).is_valid
+
+    def test_wrong_header(self):
+        validator = validate(b"Site,Well,Cell,OCT4\nB02,1,1,2\n")
+        assert not validator.is_valid
+        assert validator.header_error
+
+    def test_only_header(self):
+        validator = validate(b"Well,Site,Cell,OCT4\n")
+        assert not validator.is_valid
+        assert validator.error_text == "The file does not contain any cells"
+
+    def test_reports_wrong_line_numbers(self):
+        """
+        The header is line 1, so the first cell is line 2.
+        """
+        content = (b"Well,Site,Cell,OCT4\n"
+                   b"B02,1,1,2\n"
+                   b"B02,1,x,2\n"
+                   b"\n"
+                   b"B02,1,1,-2\n"
+                   b"B02,1,1,2,3\n"
+                   b"B02,1,1,2\n")
+        for chunk_size in [None, 3]:
+            validator = validate(content, chunk_size)
+            assert not validator.is_valid
+            assert validator.invalid_lines == [3, 4, 5, 6], \
+                validator.invalid_lines
+
+    def test_empty_last_line_is_wrong(self):
+        validator = validate(VALID_FILE + b"\r")
+        assert validator.invalid_lines == [5]
+
+    def test_only_first_lines_are_reported(self):
+        content = b"Well,Site,Cell,OCT4\n" + b"B02,1,1,a\n" * 50
+        validator = validate(content, 7, max_reported_lines=3)
+        assert validator.invalid_line_count == 50
+        assert validator.invalid_lines == [2, 3, 4]
+        assert "and more" in validator.error_text
+
+    def test_unicode_digits_are_wrong(self):
+        validator = validate("Well,Site,Cell,OCT4\nB02,1,1,٣\n"
+                             .encode("utf-8"))
+        assert validator.invalid_lines == [2]
+
+    def test_invalid_utf8_is_wrong(self):
+        validator = validate(b"Well,Site,Cell,OCT4\nB02,1,1,\xff\n")
+        assert validator.invalid_lines == [2]
@@ -0,0 +1,26 @@
+from unittest import TestCase
+
+from apps.cellviewer.util.fingerprint import label_matrix_fingerprint
+
+
+class TestLabelMatrixFingerprint(TestCase):
+    def setUp(self):
+        self.matrix = ["Annotation", 2, 3, "A,,,B", "1,,,2,,,3",
+                       ",,,".join(str(i) for i in range(6))]
+
+    def test_same_matrix_same_fingerprint(self):
+        assert label_matrix_fingerprint(*self.matrix) == \
+            label_matrix_fingerprint(*list(self.matrix))
+        assert len(label_matrix_fingerprint(*self.matrix)) == 64
+
+    def test_every_value_changes_fingerprint(self):
+        fingerprint = label_matrix_fingerprint(*self.matrix)
+        for i, changed in enumerate(["Other", 3, 4, "A,,,C", "1,,,2,,,4",
+                                     "x"]):
+            matrix = list(self.matrix)
+            matrix[i] = changed
+            assert label_matrix_fingerprint(*matrix) != fingerprint
+
+    def test_values_can_not_shift(self):
+        assert label_matrix_fingerprint("a,,,", 1, 1, "b", "c", "d") != \
+            label_matrix_fingerprint("a", 1, 1, ",,,b", "c", "d")
@@ -0,0 +1,45 @@
+import hashlib
+from types import SimpleNamespace
+from unittest import TestCase
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from apps.cellviewer.util.ingest import ingest_file
+
+CONTENT = (b"Well,Site,Cell,OCT4,SOX17\n"
+           b"B02,1,1,2.7,2.9\n"
+           b"C03,1,2,3,3.4\n")
+
+
+class TestIngest(TestCase):
+
+    def test_hash_and_metadata_from_one_read(self):
+        request = SimpleNamespace()
+        file = SimpleUploadedFile("plate.csv", CONTENT)
+
+        ingested = ingest_file(request, file)
+
+        assert ingested.is_valid
+        assert ingested.hash == hashlib.sha256(CONTENT).hexdigest()
+        assert ingested.row_count == 2
+        assert ingested.substances == ["OCT4", "SOX17"]
+        assert ingested.dimension == (["B", "C"], ["02", "03"])
+        assert ingested.df.shape == (2, 5)
+
+    def test_reused_within_a_request(self):
+        request = SimpleNamespace()
+        file = SimpleUploadedFile("plate.csv", CONTENT)
+
+        first = ingest_file(request, file)
+        assert ingest_file(request, file) is first
+        assert first.df is first.df, "The file should only be parsed once"
+
+        assert ingest_file(SimpleNamespace(), file) is not first
+
+    def test_invalid_file_is_not_parsed(self):
+        file = SimpleUploadedFile("plate.csv", CONTENT + b"B02,x,1,1,1\n")
+        ingested = ingest_file(SimpleNamespace(), file)
+
+        assert not ingested.is_valid
+        with self.assertRaises(ValueError):
+            ingested.df
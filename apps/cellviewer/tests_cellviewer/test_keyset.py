@@ -0,0 +1,30 @@
+from datetime import datetime, timezone
+from unittest import TestCase
+
+from apps.cellviewer.util.keyset import encode_cursor, decode_cursor, \
+    split_page
+
+
+class TestCursor(TestCase):
+    def test_round_trip(self):
+        date = datetime(2024, 12, 3, 10, 38, 5, 123456, tzinfo=timezone.utc)
+        assert decode_cursor(encode_cursor(date, 42)) == (date, 42)
+
+    def test_naive_date(self):
+        date = datetime(2024, 12, 3, 10, 38)
+        assert decode_cursor(encode_cursor(date, 7)) == (date, 7)
+
+    def test_not_a_cursor(self):
+        for cursor in ["", "42", "yesterday_42", "2024-12-03T10:38:00_",
+                       "2024-12-03T10:38:00_x"]:
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+
+class TestSplitPage(TestCase):
+    def test_next_page(self):
+        assert split_page([1, 2, 3, 4], 3) == ([1, 2, 3], True)
+
+    def test_last_page(self):
+        assert split_page([1, 2, 3], 3) == ([1, 2, 3], False)
+        assert split_page([], 3) == ([], False)
@@ -1,8 +1,38 @@
 from unittest import TestCase
+from unittest.mock import patch
 import pandas as pd
 from apps.cellviewer.util.matrix_functions import *
 
 
+def pivot_well_counts_and_percent(df, substance_thresholds):
+    """
+    The previous calculate_well_counts_and_percent, which filtered the
+    DataFrame and pivoted the counts of both DataFrames separately.
+    The aggregation that replaced it should give the same matrices.
+    """
+    def pivot_well_count_matrix(df):
+        well_counts = df.group_by("Well").agg(
+            pl.len().alias("count")).to_pandas()
+        well_counts["row"] = [well[0] for well in well_counts["Well"]]
+        well_counts["cols"] = [well[1:] for well in well_counts["Well"]]
+        matrix_well_counts = well_counts.pivot(index="row", columns="cols",
+                                               values="count")
+        matrix_well_counts.fillna(0, inplace=True)
+        return matrix_well_counts
+    
+    df_filtered = df
+    if any(i != 0 for i in substance_thresholds):
+        df_filtered = df.filter(reduce(lambda a, b: a & b, [
+            pl.col(df.columns[i + 3]) >= val
+            for i, val in enumerate(substance_thresholds)]))
+    well_count_matrix = pivot_well_count_matrix(df)
+    filtered = pivot_well_count_matrix(df_filtered).reindex(
+        index=well_count_matrix.index, columns=well_count_matrix.columns,
+        fill_value=0)
+    percent = (100 * filtered / well_count_matrix).fillna(0)
+    return well_count_matrix, filtered, percent
+
+
 class TestMatrixFunctions(TestCase):
     
     def test_filtered_polars_dataframe_two_values(self):
@@ -249,6 +279,44 @@ class TestMatrixFunctions(TestCase):
             check_dtype=False
         )
     
+    def test_calculate_well_counts_and_percent_same_as_pivot(self):
+        """
+        Compares the aggregation to the pivot it replaced, on a plate
+        missing well combinations (B10, C03, C10 and D02), with a well
+        whose cells are all filtered out (C02 holds only zeros).
+        """
+        rng = np.random.default_rng(0)
+        wells = rng.choice(["B02", "B03", "C02", "D03", "D10"], size=400)
+        values = np.round(rng.exponential(2, size=(400, 2)), 1)
+        values[wells == "C02"] = 0
+        df = pl.DataFrame({
+            "Well": wells,
+            "Site": np.ones(400, dtype=np.int64),
+            "Cell": np.arange(400),
+            "OCT4": values[:, 0],
+            "SOX17": values[:, 1],
+        })
+        
+        for thresholds in [[0, 0], [1.0, 0], [1.0, 2.5], [0.1], [50, 50]]:
+            result = calculate_well_counts_and_percent(df, thresholds)
+            expected = pivot_well_counts_and_percent(df, thresholds)
+            for matrix, expected_matrix in zip(result, expected):
+                pd.testing.assert_frame_equal(matrix, expected_matrix,
+                                              check_dtype=False)
+                assert matrix.index.to_list() == ["B", "C", "D"]
+                assert matrix.columns.to_list() == ["02", "03", "10"]
+                assert (matrix.index.name, matrix.columns.name) == \
+                    ("row", "cols")
+            
+            assert (result[1].loc["C", "02"], result[2].loc["C", "02"]) == \
+                ((0, 0) if any(thresholds) else (result[0].loc["C", "02"],
+                                                 100))
+            assert (result[0].loc["C", "03"], result[2].loc["C", "03"]) == \
+                (0, 0)
+            assert result[0].dtypes.to_list() == [np.int64] * 3
+            assert result[1].dtypes.to_list() == [np.int64] * 3
+            assert result[2].dtypes.to_list() == [np.float64] * 3
+    
     def test_calculate_mean_across_each_well_positive_values(self):
         """
         Also tests that rename axis is preserved through the
@@ -386,3 +454,73 @@ class TestMatrixFunctions(TestCase):
             [matrix_a, matrix_b], matrix_mean)
         
         pd.testing.assert_frame_equal(result, expected_result)
+    
+    def test_calculate_threshold_sweep_same_as_individual(self):
+        """
+        Every set of thresholds of a sweep should give the same result
+        as calculating it on its own, including the inclusive
+        thresholds on Float32 columns and a set of only zeros.
+        """
+        df = pl.DataFrame({
+            "Well": ["B02", "B02", "B02", "C03", "C03", "B03"],
+            "Site": [1, 1, 1, 1, 1, 1],
+            "Cell": [1, 2, 3, 4, 5, 6],
+            "OCT4": [2.7, 3.5, 2.3, 2.3, 0.5, 1.0],
+            "SOX17": [2.9, 3.4, 2.7, 2.0, 4.0, 0.0]
+        }).with_columns(pl.col("OCT4").cast(pl.Float32))
+        vectors = [[0, 0], [2.3, 0], [2.3, 2.7], [0, 2.0], [3.5, 3.5],
+                   [2.3], [10, 0]]
+        
+        well_count_matrix, filtered_counts, percentages = \
+            calculate_threshold_sweep(df, vectors)
+        
+        for i, vector in enumerate(vectors):
+            expected = calculate_well_counts_and_percent(df, vector)
+            pd.testing.assert_frame_equal(well_count_matrix, expected[0],
+                                          check_dtype=False)
+            assert (filtered_counts[i] == expected[1].to_numpy()).all(), \
+                f"Different counts for {vector}"
+            assert (abs(percentages[i] - expected[2].to_numpy())
+                    < 1e-9).all(), f"Different percentages for {vector}"
+    
+    def test_calculate_threshold_sweep_a_well_at_a_time(self):
+        """
+        With only room for the counts of a single well, the wells are
+        counted one at a time, which should give the same result.
+        """
+        rng = np.random.default_rng(0)
+        df = pl.DataFrame({
+            "Well": rng.choice(["B02", "B03", "C02", "D10"], size=500),
+            "Site": np.ones(500, dtype=np.int64),
+            "Cell": np.arange(500),
+            "OCT4": np.round(rng.exponential(2, size=500), 1),
+            "SOX17": np.round(rng.exponential(2, size=500), 1),
+        })
+        vectors = [[0, 0], [1.0, 0.5], [0.5, 2.0], [3.1, 0.1], [2.0]]
+        
+        expected = calculate_threshold_sweep(df, vectors)
+        # 5 different thresholds of OCT4 and 4 of SOX17
+        with patch("apps.cellviewer.util.matrix_functions."
+                   "SWEEP_MAX_ENTRIES", 6 * 5):
+            result = calculate_threshold_sweep(df, vectors)
+        
+        pd.testing.assert_frame_equal(result[0], expected[0])
+        assert (result[1] == expected[1]).all()
+        assert (result[2] == expected[2]).all()
+    
+    def test_calculate_threshold_sweep_too_many_combinations(self):
+        df = pl.DataFrame({
+            "Well": ["B02"], "Site": [1], "Cell": [1],
+            "OCT4": [1.0], "SOX17": [1.0]
+        })
+        vectors = [[i, i] for i in range(1, 4)]
+        with patch("apps.cellviewer.util.matrix_functions."
+                   "SWEEP_MAX_ENTRIES", 4 * 4 - 1):
+            with self.assertRaises(ValueError):
+                calculate_threshold_sweep(df, vectors)
+    
+    def test_threshold_grid(self):
+        result = threshold_grid([(0, 1, 0.5), (2, 2.5, 0.5)])
+        
+        assert result == [[0, 2], [0, 2.5], [0.5, 2], [0.5, 2.5],
+                          [1, 2], [1, 2.5]], f"Unexpected grid {result}"
@@ -0,0 +1,47 @@
+import threading
+import time
+from unittest import TestCase
+
+from apps.cellviewer.util.parallel import map_in_threads
+
+
+class TestMapInThreads(TestCase):
+    def test_results_in_order_of_items(self):
+        def slow_square(x):
+            time.sleep(0.01 * (5 - x))
+            return x * x
+
+        assert map_in_threads(slow_square, range(5), 4) == [0, 1, 4, 9, 16]
+
+    def test_one_worker_runs_in_current_thread(self):
+        caller = threading.get_ident()
+        threads = map_in_threads(lambda _: threading.get_ident(), range(3), 1)
+        assert threads == [caller] * 3
+
+    def test_runs_at_most_max_workers_at_once(self):
+        lock = threading.Lock()
+        running = [0]
+        most = [0]
+
+        def work(_):
+            with lock:
+                running[0] += 1
+                most[0] = max(most[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+
+        map_in_threads(work, range(8), 3)
+        assert 1 < most[0] <= 3
+
+    def test_exception_is_raised(self):
+        def fail(x):
+            if x == 2:
+                raise ValueError("bad item")
+            return x
+
+        with self.assertRaises(ValueError):
+            map_in_threads(fail, range(4), 2)
+
+    def test_no_items(self):
+        assert map_in_threads(lambda x: x, [], 4) == []
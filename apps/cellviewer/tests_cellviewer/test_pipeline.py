@@ -0,0 +1,87 @@
+from unittest import TestCase
+
+from apps.cellviewer.util.pipeline import Stage, run_stages, stages_done
+
+
+class Target:
+    def __init__(self, done=()):
+        self.done = set(done)
+        self.runs = []
+
+
+def writing_stage(name, fail=False):
+    def run(target, context):
+        target.runs.append(name)
+        if fail:
+            raise OSError(f"could not write {name}")
+        context[name] = len(target.runs)
+        target.done.add(name)
+
+    return Stage(name, lambda target: name in target.done, run)
+
+
+class TestRunStages(TestCase):
+    def setUp(self):
+        self.saved = []
+
+    def save_state(self, state):
+        self.saved.append({name: dict(value) for name, value in state.items()})
+
+    def test_runs_stages_in_order(self):
+        stages = [writing_stage("a"), writing_stage("b"), writing_stage("c")]
+        target = Target()
+        state = run_stages(stages, target, {}, self.save_state)
+        assert target.runs == ["a", "b", "c"]
+        assert stages_done(stages, state)
+        assert self.saved[-1] == state
+
+    def test_skips_stages_that_are_done(self):
+        stages = [writing_stage("a"), writing_stage("b")]
+        target = Target(done=["a"])
+        state = run_stages(stages, target, {}, self.save_state)
+        assert target.runs == ["b"]
+        assert state["a"]["status"] == "done"
+
+    def test_running_again_does_nothing(self):
+        stages = [writing_stage("a"), writing_stage("b")]
+        target = Target()
+        state = run_stages(stages, target, {}, self.save_state)
+        saves = len(self.saved)
+        run_stages(stages, target, state, self.save_state)
+        assert target.runs == ["a", "b"]
+        assert len(self.saved) == saves
+
+    def test_force_runs_every_stage(self):
+        stages = [writing_stage("a"), writing_stage("b")]
+        target = Target(done=["a", "b"])
+        run_stages(stages, target, {}, self.save_state, force=True)
+        assert target.runs == ["a", "b"]
+
+    def test_failure_stops_later_stages(self):
+        stages = [writing_stage("a"), writing_stage("b", fail=True),
+                  writing_stage("c")]
+        target = Target()
+        state = run_stages(stages, target, {}, self.save_state)
+        assert target.runs == ["a", "b"]
+        assert state["a"]["status"] == "done"
+        assert state["b"]["status"] == "failed"
+        assert state["b"]["error"] == "could not write b"
+        assert state["c"]["status"] == "pending"
+        assert not stages_done(stages, state)
+
+    def test_failed_stage_runs_again(self):
+        failing = [writing_stage("a"), writing_stage("b", fail=True)]
+        target = Target()
+        state = run_stages(failing, target, {}, self.save_state)
+        fixed = [writing_stage("a"), writing_stage("b")]
+        state = run_stages(fixed, target, state, self.save_state)
+        assert target.runs == ["a", "b", "b"]
+        assert stages_done(fixed, state)
+
+    def test_context_is_shared(self):
+        seen = []
+        stages = [writing_stage("a"),
+                  Stage("b", lambda target: False,
+                        lambda target, context: seen.append(context["a"]))]
+        run_stages(stages, Target(), {}, self.save_state)
+        assert seen == [1]
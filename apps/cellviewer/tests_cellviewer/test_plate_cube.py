@@ -0,0 +1,64 @@
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from apps.cellviewer.util.plate_cube import PlateCube
+
+
+def random_matrices(plates, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        pd.DataFrame(rng.random((3, 4)) * 100,
+                     index=pd.Index(["B", "C", "D"], name="row"),
+                     columns=pd.Index(["02", "03", "04", "05"], name="cols"))
+        for _ in range(plates)
+    ]
+
+
+class TestPlateCube(TestCase):
+
+    def test_statistics_per_well(self):
+        matrices = random_matrices(40)
+        cube = PlateCube.from_matrices(matrices)
+        stacked = np.stack([m.to_numpy() for m in matrices])
+
+        for result, expected in [
+            (cube.mean(), stacked.mean(axis=0)),
+            (cube.median(), np.median(stacked, axis=0)),
+            (cube.quantile(0.9), np.quantile(stacked, 0.9, axis=0)),
+            (cube.min(), stacked.min(axis=0)),
+            (cube.max(), stacked.max(axis=0)),
+            (cube.count(), np.full((3, 4), 40)),
+            # 30 or more plates is the population standard deviation
+            (cube.std(), stacked.std(axis=0)),
+            (cube.std(ddof=1), stacked.std(axis=0, ddof=1)),
+        ]:
+            np.testing.assert_allclose(result.to_numpy(), expected)
+            pd.testing.assert_index_equal(result.index, matrices[0].index)
+            pd.testing.assert_index_equal(result.columns,
+                                          matrices[0].columns)
+
+    def test_sample_standard_deviation_below_30_plates(self):
+        matrices = random_matrices(5)
+        stacked = np.stack([m.to_numpy() for m in matrices])
+        np.testing.assert_allclose(
+            PlateCube.from_matrices(matrices).std().to_numpy(),
+            stacked.std(axis=0, ddof=1))
+
+    def test_matched_on_names(self):
+        first, second = random_matrices(2)
+        shuffled = second.iloc[::-1, ::-1]
+        cube = PlateCube.from_matrices([first, shuffled])
+        pd.testing.assert_frame_equal(cube.plate(1), second)
+
+    def test_missing_well(self):
+        first, second = random_matrices(2)
+        cube = PlateCube.from_matrices([first, second.drop(index="C")])
+        assert cube.mean().loc["C"].isna().all()
+        assert cube.count().loc["C"].tolist() == [1, 1, 1, 1]
+        assert cube.count().loc["B"].tolist() == [2, 2, 2, 2]
+
+    def test_no_plates(self):
+        with self.assertRaises(ValueError):
+            PlateCube.from_matrices([])
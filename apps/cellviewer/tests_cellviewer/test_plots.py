@@ -0,0 +1,37 @@
+from unittest import TestCase
+
+from apps.cellviewer.tests_cellviewer.test_well_index import random_plate
+from apps.cellviewer.util.matrix_functions import \
+    calculate_well_counts_and_percent
+from apps.cellviewer.util.plots import create_hist, figure_to_html, \
+    generate_heatmap_with_label
+
+# The most a single figure of the page is allowed to add to a response.
+# plotly.js alone is a few MB.
+MAX_FIGURE_SIZE = 100_000
+
+
+class TestFigurePayload(TestCase):
+
+    def setUp(self):
+        self.df = random_plate(2, cells=200_000)
+
+    def test_histogram_size(self):
+        hist, _ = create_hist(self.df, "S0")
+        html = figure_to_html(hist)
+        assert len(html) < MAX_FIGURE_SIZE, len(html)
+        assert "Plotly.newPlot" in html
+
+    def test_heatmap_size(self):
+        matrices = calculate_well_counts_and_percent(self.df, [1, 1])
+        rows, cols = list(matrices[0].index), list(matrices[0].columns)
+        labels = [rows, cols, [f"{r}_{c}" for r in rows for c in cols]]
+        for matrix in matrices:
+            html = figure_to_html(
+                generate_heatmap_with_label(labels, matrix, "Count"))
+            assert len(html) < MAX_FIGURE_SIZE, len(html)
+
+    def test_plotly_js_is_not_included(self):
+        hist, _ = create_hist(self.df, "S0")
+        assert "* plotly.js v" in hist.to_html()
+        assert "* plotly.js v" not in figure_to_html(hist)
@@ -0,0 +1,76 @@
+from unittest import TestCase
+
+import pandas as pd
+from django.core.cache.backends.locmem import LocMemCache
+
+from apps.cellviewer.tests_cellviewer.test_well_index import random_plate
+from apps.cellviewer.util.matrix_functions import \
+    calculate_well_counts_and_percent
+from apps.cellviewer.util.result_cache import WellCountsCache
+
+
+class TestWellCountsCache(TestCase):
+
+    def setUp(self):
+        self.df = random_plate(2)
+        self.calculations = 0
+
+    def calculate(self, substance_thresholds):
+        def calculate():
+            self.calculations += 1
+            return calculate_well_counts_and_percent(self.df,
+                                                     substance_thresholds)
+        return calculate
+
+    def new_cache(self, local_limit=4, shared=None):
+        if shared is None:
+            shared = LocMemCache("test_result_cache", {})
+            shared.clear()
+        return WellCountsCache(local_limit, shared)
+
+    def test_same_result_as_calculated(self):
+        cache = self.new_cache()
+        expected = calculate_well_counts_and_percent(self.df, [1, 2])
+        for _ in range(2):
+            result = cache.get_or_calculate("hash", [1, 2],
+                                            self.calculate([1, 2]))
+            for expected_matrix, result_matrix in zip(expected, result):
+                pd.testing.assert_frame_equal(expected_matrix, result_matrix)
+        assert self.calculations == 1
+
+    def test_thresholds_and_files_are_separate(self):
+        cache = self.new_cache()
+        cache.get_or_calculate("hash", [1, 2], self.calculate([1, 2]))
+        cache.get_or_calculate("hash", [1.0, 2.0], self.calculate([1, 2]))
+        cache.get_or_calculate("hash", [2, 2], self.calculate([2, 2]))
+        cache.get_or_calculate("other", [1, 2], self.calculate([1, 2]))
+        assert self.calculations == 3
+
+    def test_shared_tier(self):
+        shared = LocMemCache("test_result_cache_shared", {})
+        shared.clear()
+        first, second = self.new_cache(shared=shared), \
+            self.new_cache(shared=shared)
+
+        first.get_or_calculate("hash", [1, 2], self.calculate([1, 2]))
+        second.get_or_calculate("hash", [1, 2], self.calculate([1, 2]))
+        second.get_or_calculate("hash", [1, 2], self.calculate([1, 2]))
+
+        assert self.calculations == 1
+        stats = second.stats()
+        assert (stats["local_hits"], stats["shared_hits"], stats["misses"]) \
+               == (1, 1, 0), stats
+
+    def test_local_tier_is_bounded(self):
+        cache = self.new_cache(local_limit=2)
+        for threshold in range(5):
+            cache.get_or_calculate("hash", [threshold],
+                                   self.calculate([threshold]))
+        assert cache.stats()["local_entries"] == 2
+
+    def test_changing_a_result_does_not_change_the_cache(self):
+        cache = self.new_cache()
+        result = cache.get_or_calculate("hash", [1], self.calculate([1]))
+        result[0].iloc[0, 0] = -1
+        again = cache.get_or_calculate("hash", [1], self.calculate([1]))
+        assert again[0].iloc[0, 0] != -1
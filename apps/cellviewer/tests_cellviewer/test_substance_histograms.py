@@ -0,0 +1,48 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import polars as pl
+
+from apps.cellviewer.tests_cellviewer.test_well_index import random_plate
+from apps.cellviewer.util.plots import create_hist
+from apps.cellviewer.util.substance_histograms import histogram_bins, \
+    SubstanceHistograms, HISTOGRAM_BINS
+
+
+class TestSubstanceHistograms(TestCase):
+
+    def test_same_bins_as_numpy(self):
+        df = random_plate(2)
+        for substance in df.columns[3:]:
+            values = df[substance].cast(pl.Float64).to_numpy()
+            expected, _ = np.histogram(values, HISTOGRAM_BINS,
+                                       range=(0, values.max()))
+            counts, max_value = histogram_bins(df[substance])
+            assert max_value == df[substance].max()
+            np.testing.assert_array_equal(counts, expected)
+
+    def test_all_zero(self):
+        counts, max_value = histogram_bins(pl.Series([0.0, 0.0, 0.0]), 4)
+        assert max_value == 0
+        assert counts.tolist() == [3, 0, 0, 0]
+
+    def test_save_and_load(self):
+        df = random_plate(3)
+        histograms = SubstanceHistograms.from_dataframe(df)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "plate.csv.hist.npz")
+            histograms.save(path)
+            loaded = SubstanceHistograms.load(path)
+        assert loaded.substances == df.columns[3:]
+        for substance in df.columns[3:]:
+            counts, max_value = loaded[substance]
+            expected_counts, expected_max = histogram_bins(df[substance])
+            np.testing.assert_array_equal(counts, expected_counts)
+            assert max_value == expected_max
+
+    def test_figure_size_does_not_depend_on_the_cells(self):
+        small = create_hist(random_plate(1, cells=1000), "S0")[0].to_json()
+        large = create_hist(random_plate(1, cells=100000), "S0")[0].to_json()
+        assert len(large) < 2 * len(small)
@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from apps.cellviewer.util.matrix_functions import threshold_grid_size
+from apps.cellviewer.util.threshold_sweep import parse_sweep_thresholds, \
+    MAX_SWEEP_THRESHOLDS
+
+
+class Query(dict):
+    """Stands in for request.GET"""
+
+    def getlist(self, key):
+        return self.get(key, [])
+
+
+class TestParseSweepThresholds(TestCase):
+    def test_ranges(self):
+        vectors = parse_sweep_thresholds(
+            Query(range=["0:1:0.5", "2:2.5:0.5"]))
+        assert vectors == [[0, 2], [0, 2.5], [0.5, 2], [0.5, 2.5],
+                           [1, 2], [1, 2.5]]
+
+    def test_thresholds(self):
+        vectors = parse_sweep_thresholds(Query(thresholds=["1;2", "1.5;"]))
+        assert vectors == [[1, 2], [1.5, 0]]
+
+    def test_too_many_in_total(self):
+        # Every range on its own is within the limit, together they
+        # are 10^16 sets of thresholds, which are never created
+        query = Query(range=["0:9998:1"] * 4)
+        assert threshold_grid_size([(0, 9998, 1)]) < MAX_SWEEP_THRESHOLDS
+        with self.assertRaises(ValueError):
+            parse_sweep_thresholds(query)
+
+    def test_too_many_in_one_range(self):
+        with self.assertRaises(ValueError):
+            parse_sweep_thresholds(Query(range=["0:10000:0.5"]))
+
+    def test_too_many_thresholds(self):
+        query = Query(thresholds=["1;2"] * (MAX_SWEEP_THRESHOLDS + 1))
+        with self.assertRaises(ValueError):
+            parse_sweep_thresholds(query)
+
+    def test_invalid_ranges(self):
+        for substance_range in ["0:1", "1:0:0.5", "0:1:0", "0:inf:1",
+                                "0:nan:1", "0:1e308:1e-308"]:
+            with self.assertRaises(ValueError, msg=substance_range):
+                parse_sweep_thresholds(Query(range=[substance_range]))
+
+    def test_nothing(self):
+        with self.assertRaises(ValueError):
+            parse_sweep_thresholds(Query())
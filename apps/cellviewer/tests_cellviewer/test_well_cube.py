@@ -0,0 +1,106 @@
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from apps.cellviewer.tests_cellviewer.test_well_index import random_plate
+from apps.cellviewer.util.matrix_functions import \
+    calculate_well_counts_and_percent
+from apps.cellviewer.util import well_cube
+from apps.cellviewer.util.well_cube import WellHistogramCube, load_cached
+
+
+class TestWellHistogramCube(TestCase):
+
+    def assert_same_as_dataframe(self, df, cube, substance_thresholds):
+        expected = calculate_well_counts_and_percent(df, substance_thresholds)
+        result = cube.well_counts_and_percent(substance_thresholds)
+        for expected_matrix, result_matrix in zip(expected, result):
+            pd.testing.assert_frame_equal(expected_matrix, result_matrix,
+                                          check_dtype=False)
+
+    def test_exact_on_bin_edges(self):
+        df = random_plate(2)
+        cube = WellHistogramCube.from_dataframe(df)
+        for i, j in [(0, 3), (5, 5), (1, 0), (12, 40)]:
+            thresholds = [float(cube.edges[0][i]), float(cube.edges[1][j])]
+            self.assert_same_as_dataframe(df, cube, thresholds)
+
+    def test_no_thresholds_is_total(self):
+        df = random_plate(3)
+        cube = WellHistogramCube.from_dataframe(df)
+        self.assert_same_as_dataframe(df, cube, [0, 0, 0])
+
+    def test_less_thresholds_than_substances(self):
+        df = random_plate(3)
+        cube = WellHistogramCube.from_dataframe(df)
+        self.assert_same_as_dataframe(df, cube, [float(cube.edges[0][2])])
+
+    def test_rounds_down_between_edges(self):
+        df = random_plate(1)
+        cube = WellHistogramCube.from_dataframe(df)
+        between = (cube.edges[0][3] + cube.edges[0][4]) / 2
+
+        np.testing.assert_array_equal(
+            cube.positive_counts([between]),
+            cube.positive_counts([float(cube.edges[0][3])]))
+
+    def test_size_stays_within_budget(self):
+        for well_count, substance_count in [(384, 1), (384, 2), (1536, 2),
+                                            (1536, 4)]:
+            bins = WellHistogramCube.bins_for(well_count, substance_count)
+            self.assertLessEqual(well_count * (bins + 1) ** substance_count,
+                                 WellHistogramCube.MAX_ENTRIES)
+
+    def test_save_and_load(self):
+        df = random_plate(2)
+        cube = WellHistogramCube.from_dataframe(df)
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/file.csv.cube.npz"
+            cube.save(path)
+            loaded = WellHistogramCube.load(path)
+
+        np.testing.assert_array_equal(loaded.cube, cube.cube)
+        np.testing.assert_array_equal(loaded.wells, cube.wells)
+        self.assertEqual(len(loaded.edges), 2)
+
+
+class TestLoadCached(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.limit = well_cube.LOADED_CUBES_MAX_BYTES
+        well_cube._loaded_cubes.clear()
+
+    def tearDown(self):
+        self.directory.cleanup()
+        well_cube.LOADED_CUBES_MAX_BYTES = self.limit
+        well_cube._loaded_cubes.clear()
+
+    def save_cubes(self, amount):
+        paths = []
+        for i in range(amount):
+            path = f"{self.directory.name}/{i}.csv.cube.npz"
+            WellHistogramCube.from_dataframe(random_plate(2, seed=i)).save(path)
+            paths.append(path)
+        return paths
+
+    def test_cached(self):
+        path, = self.save_cubes(1)
+        assert load_cached(path) is load_cached(path)
+
+    def test_limited_by_bytes(self):
+        paths = self.save_cubes(3)
+        size = WellHistogramCube.load(paths[0]).nbytes
+        well_cube.LOADED_CUBES_MAX_BYTES = int(size * 2.5)
+
+        for path in paths:
+            load_cached(path)
+        loaded = [key[0] for key in well_cube._loaded_cubes]
+        assert loaded == paths[1:]
+
+    def test_keeps_a_cube_over_the_limit(self):
+        path, = self.save_cubes(1)
+        well_cube.LOADED_CUBES_MAX_BYTES = 1
+        load_cached(path)
+        assert len(well_cube._loaded_cubes) == 1
@@ -0,0 +1,105 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from apps.cellviewer.util.matrix_functions import \
+    calculate_well_counts_and_percent, well_counts_to_matrix
+from apps.cellviewer.util.well_index import WellThresholdIndex
+
+
+def random_plate(substance_count, cells=6000, seed=0):
+    """
+    A small random plate, with one well far larger than the others
+    so the merge sort tree has multiple levels.
+    """
+    rng = np.random.default_rng(seed)
+    wells = rng.choice(["B02", "B03", "C02", "C03", "D10"], size=cells,
+                       p=[0.6, 0.1, 0.1, 0.1, 0.1])
+    data = {
+        "Well": wells,
+        "Site": rng.integers(1, 10, size=cells),
+        "Cell": np.arange(cells),
+    }
+    for i in range(substance_count):
+        # rounded, so many values are exactly equal to a threshold
+        data[f"S{i}"] = np.round(rng.exponential(2, size=cells), 1)
+    return pl.DataFrame(data)
+
+
+class TestWellThresholdIndex(TestCase):
+
+    def assert_same_as_dataframe(self, df, index, substance_thresholds):
+        expected = calculate_well_counts_and_percent(df, substance_thresholds)
+        result = index.well_counts_and_percent(substance_thresholds)
+        for expected_matrix, result_matrix in zip(expected, result):
+            pd.testing.assert_frame_equal(expected_matrix, result_matrix,
+                                          check_dtype=False)
+
+    def test_one_substance(self):
+        df = random_plate(1)
+        index = WellThresholdIndex.from_dataframe(df)
+        for threshold in [0, 0.1, 1.5, 2.0, 7.3, 100]:
+            self.assert_same_as_dataframe(df, index, [threshold])
+
+    def test_two_substances(self):
+        df = random_plate(2)
+        index = WellThresholdIndex.from_dataframe(df)
+        self.assertGreater(len(index.levels), 2)
+        for thresholds in [[0, 0], [0, 1.2], [1.2, 0], [2.0, 2.0],
+                           [0.5, 3.3], [9.1, 0.2], [100, 100]]:
+            self.assert_same_as_dataframe(df, index, thresholds)
+
+    def test_three_substances(self):
+        df = random_plate(3)
+        index = WellThresholdIndex.from_dataframe(df)
+        for thresholds in [[0, 0, 0], [1.0, 1.0, 1.0], [0, 0, 2.5],
+                           [0.3, 2.0]]:
+            self.assert_same_as_dataframe(df, index, thresholds)
+
+    def test_threshold_sweep(self):
+        df = random_plate(2)
+        index = WellThresholdIndex.from_dataframe(df)
+        vectors = [[0, 0], [0, 1.2], [2.0, 2.0], [0.5, 3.3], [1.1]]
+        well_count_matrix, filtered_counts, percentages = \
+            index.threshold_sweep(vectors)
+        for i, vector in enumerate(vectors):
+            expected = calculate_well_counts_and_percent(df, vector)
+            pd.testing.assert_frame_equal(well_count_matrix, expected[0],
+                                          check_dtype=False)
+            assert (filtered_counts[i] == expected[1].to_numpy()).all()
+            assert np.allclose(percentages[i], expected[2].to_numpy())
+
+    def test_save_and_load(self):
+        df = random_plate(2)
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/file.csv.index"
+            WellThresholdIndex.from_dataframe(df).save(path)
+            index = WellThresholdIndex.load(path)
+
+            self.assertEqual(index.substances, ["S0", "S1"])
+            self.assertEqual(index.amount_of_sites, df["Site"].max())
+            self.assert_same_as_dataframe(df, index, [1.1, 2.2])
+
+    def test_save_replaces_existing_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/file.csv.index"
+            WellThresholdIndex.from_dataframe(random_plate(2)).save(path)
+            df = random_plate(3)
+            WellThresholdIndex.from_dataframe(df).save(path)
+            index = WellThresholdIndex.load(path)
+
+            self.assertEqual(index.substances, ["S0", "S1", "S2"])
+            self.assertEqual(os.listdir(directory), ["file.csv.index"])
+
+    def test_well_counts_to_matrix_format(self):
+        result = well_counts_to_matrix(["B02", "C03"], [4, 2])
+
+        self.assertEqual(result.index.name, "row")
+        self.assertEqual(result.columns.name, "cols")
+        self.assertEqual(result.loc["B", "02"], 4)
+        self.assertEqual(result.loc["B", "03"], 0)
+        self.assertEqual(result.loc["C", "03"], 2)
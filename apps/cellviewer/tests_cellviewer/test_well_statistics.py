@@ -0,0 +1,64 @@
+import pickle
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from apps.cellviewer.tests_cellviewer.test_plate_cube import random_matrices
+from apps.cellviewer.util.plate_cube import PlateCube
+from apps.cellviewer.util.well_statistics import RunningWellStatistics, \
+    well_statistics_key
+
+
+def statistics_of(matrices) -> RunningWellStatistics:
+    statistics = RunningWellStatistics()
+    for matrix in matrices:
+        statistics.add(matrix)
+    return statistics
+
+
+class TestRunningWellStatistics(TestCase):
+
+    def assert_same_as_cube(self, statistics, matrices):
+        cube = PlateCube.from_matrices(matrices)
+        pd.testing.assert_frame_equal(statistics.mean(), cube.mean())
+        pd.testing.assert_frame_equal(statistics.std(), cube.std())
+
+    def test_same_as_plate_cube(self):
+        for plates in [2, 5, 40]:
+            matrices = random_matrices(plates)
+            self.assert_same_as_cube(statistics_of(matrices), matrices)
+
+    def test_add_one_more(self):
+        matrices = random_matrices(6)
+        statistics = pickle.loads(pickle.dumps(statistics_of(matrices[:5])))
+        statistics.add(matrices[5])
+        self.assert_same_as_cube(statistics, matrices)
+
+    def test_merge(self):
+        matrices = random_matrices(9)
+        statistics = statistics_of(matrices[:4])
+        statistics.merge(statistics_of(matrices[4:]))
+        self.assert_same_as_cube(statistics, matrices)
+
+        empty = RunningWellStatistics()
+        empty.merge(statistics)
+        self.assert_same_as_cube(empty, matrices)
+
+    def test_matched_on_names(self):
+        first, second = random_matrices(2)
+        statistics = statistics_of([first, second.iloc[::-1, ::-1]])
+        self.assert_same_as_cube(statistics, [first, second])
+
+    def test_missing_well(self):
+        first, second = random_matrices(2)
+        statistics = statistics_of([first, second.drop(index="C")])
+        assert statistics.mean().loc["C"].isna().all()
+        assert not statistics.mean().loc["B"].isna().any()
+
+    def test_key_does_not_depend_on_order(self):
+        plates = [("a", "1;2"), ("b", "1;2"), ("a", "2;2")]
+        assert well_statistics_key(plates) == \
+               well_statistics_key(plates[::-1])
+        assert well_statistics_key(plates) != \
+               well_statistics_key(plates[:2])
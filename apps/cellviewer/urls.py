@@ -2,7 +2,8 @@ from django.urls import path
 
 import apps.cellviewer.util.index_helpers
 from apps.cellviewer.views import index, saved_jobs, annotations, \
-    aggregate_jobs, plot_insert_context
+    aggregate_jobs, plot_insert_context, threshold_sweep, excel_export, \
+    cache_stats, background_tasks
 
 app_name = "cellviewer"
 
@@ -14,11 +15,20 @@ urlpatterns = [
          apps.cellviewer.util.index_helpers.stored_label_matrix_as_html),
     path("save_job", index.save_job),
     path("saved_jobs", saved_jobs.saved_jobs, name="saved_jobs"),
+    path("saved_jobs/page", saved_jobs.saved_jobs_page,
+         name="saved_jobs_page"),
     path("saved_jobs/<int:job_id>/", saved_jobs.display_job),
+    path("saved_jobs/<int:job_id>/threshold_sweep",
+         threshold_sweep.threshold_sweep, name="threshold_sweep"),
     path("delete_job/<int:job_id>/", saved_jobs.delete_job),
     path("annotations", annotations.saved_annotations_page),
     path("annotation/<int:annotation_id>", annotations.annotation_page, name="annotation_page"),
     path("annotation/<int:annotation_id>/edit", annotations.edit_annotation, name='edit_annotation'),
     path("aggregate_jobs", aggregate_jobs.aggregate_jobs, name="aggregate_jobs"),
-    path("update_filtered_plots", plot_insert_context.update_filtered_plots, name="update_filtered_plots")
+    path("download_comparison", aggregate_jobs.download_comparison,
+         name="download_comparison"),
+    path("update_filtered_plots", plot_insert_context.update_filtered_plots, name="update_filtered_plots"),
+    path("download_analysis", excel_export.download_analysis, name="download_analysis"),
+    path("result_cache_stats", cache_stats.result_cache_stats, name="result_cache_stats"),
+    path("background_tasks/<int:task_id>", background_tasks.background_task, name="background_task")
 ]
\ No newline at end of file
@@ -0,0 +1,89 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+TASKS: dict[str, Callable] = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def background_task(name: str) -> Callable:
+    """
+    Registers a function as a background task under a name, so a
+    BackgroundTask with that name runs it.
+
+    The function is called with the task as first argument, which it
+    can use to report its progress, and the arguments of the task as
+    keyword arguments. These have to be JSON, as they are stored in
+    the database. What it returns is stored as the result of the task,
+    for example the HTML that is shown when the task is done.
+
+    Args:
+        name: The name the task is started with
+
+    Returns:
+
+    """
+    def register(function: Callable) -> Callable:
+        if name in TASKS and TASKS[name] is not function:
+            raise ValueError(f"A background task named {name} already exists")
+        TASKS[name] = function
+        return function
+    return register
+
+
+def run_task(task, tasks: dict[str, Callable] = None) -> bool:
+    """
+    Runs a task if it can still be claimed, and stores its result,
+    or the error if it fails.
+
+    Claiming the task first makes sure a task is only run once, when
+    more than one worker picks up the same pending task.
+
+    Args:
+        task: A BackgroundTask, or anything with the same methods
+        tasks: The registered functions, TASKS if None
+
+    Returns: If the task was run by this call
+
+    """
+    if tasks is None:
+        tasks = TASKS
+    if not task.claim():
+        return False
+
+    try:
+        function = tasks[task.name]
+        result = function(task, **task.arguments)
+    except Exception as e:
+        logger.exception("Background task %s (%s) failed", task.id, task.name)
+        task.fail(str(e) or type(e).__name__)
+    else:
+        task.finish(result)
+    return True
+
+
+def submit(function: Callable, *args, max_workers: int) -> None:
+    """
+    Calls the function in the thread pool of the background tasks of
+    this process. The pool is made the first time it is used.
+
+    Args:
+        function:
+        *args:
+        max_workers: The size of the pool
+
+    Returns:
+
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix="cellviewer-task")
+    _executor.submit(function, *args)
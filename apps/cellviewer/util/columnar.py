@@ -0,0 +1,94 @@
+import os
+import uuid
+
+import polars as pl
+
+COLUMNAR_EXTENSION = ".arrow"
+
+
+def columnar_path(file_path: str) -> str:
+    """
+    The path of the columnar copy belonging to a saved csv file.
+    The copy is stored next to the original file.
+    """
+    return f"{file_path}{COLUMNAR_EXTENSION}"
+
+
+def to_columnar_dataframe(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Converts a parsed input file to the compact types used by the
+    columnar copy.
+
+    The Well is categorical as there are only a few hundred
+    different wells, Site and Cell are integers and the substances
+    are stored as 32 bit floats, halving their size.
+
+    Comparing a Float32 column with a threshold casts the threshold
+    to Float32 as well, so the inclusive filtering on the thresholds
+    behaves the same as on the original values.
+
+    Args:
+        df:
+
+    Returns:
+
+    """
+    return df.with_columns(
+        pl.col("Well").cast(pl.String).cast(pl.Categorical),
+        pl.col("Site").cast(pl.Int32),
+        pl.col("Cell").cast(pl.Int32),
+        *(pl.col(substance).cast(pl.Float32) for substance in df.columns[3:])
+    )
+
+
+def write_columnar_file(df: pl.DataFrame, path: str) -> None:
+    """
+    Writes the columnar copy of an input file in the Arrow IPC
+    format.
+
+    It is first written to a temporary file which is then moved in
+    place, this way a half written file can never be read. The
+    temporary file has a unique name, so two writers of the same file,
+    an upload and the run_post_ingest command for example, each move
+    their own complete file in place.
+    
+    The file is deliberately not compressed. Only an uncompressed
+    file can be memory mapped, see read_columnar_file.
+
+    Args:
+        df: The parsed input file
+        path: The path to write to, see columnar_path
+
+    Returns: None
+
+    """
+    temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        to_columnar_dataframe(df).write_ipc(temporary_path,
+                                            compression="uncompressed")
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def read_columnar_file(path: str) -> pl.DataFrame:
+    """
+    Reads the columnar copy by memory mapping it.
+    
+    The DataFrame refers directly to the pages of the file instead of
+    copying the data onto the heap of the process. All gunicorn
+    workers reading the same file share the one copy in the page cache
+    of the operating system, instead of each having their own copy of
+    the data for every request.
+    
+    Files written compressed, before this was the case, are read normally
+    by polars. Rewrite these with the build_columnar_files --force command.
+    
+    Args:
+        path:
+
+    Returns:
+
+    """
+    return pl.read_ipc(path, memory_map=True)
@@ -0,0 +1,111 @@
+import os
+import time
+from typing import BinaryIO
+
+from django.core.files import File
+
+CONTENT_ADDRESSED_DIRECTORY = "saved_files"
+CONTENT_ADDRESSED_EXTENSION = ".csv"
+CLAIM_EXTENSION = ".claim"
+CLAIM_TIMEOUT = 60
+CLAIM_POLL_INTERVAL = 0.05
+
+
+def content_addressed_name(file_hash: str) -> str:
+    """
+    The name a file is stored under, derived from the sha256 hash of
+    its content. The first two pairs of characters of the hash are used
+    as directories, so no single directory gets too many files.
+
+    Args:
+        file_hash: The hex sha256 hash of the content
+
+    Returns: The name relative to the media root
+
+    """
+    if len(file_hash) != 64 or \
+            any(c not in "0123456789abcdef" for c in file_hash):
+        raise ValueError("Not a sha256 hash")
+    return "/".join((CONTENT_ADDRESSED_DIRECTORY, file_hash[:2],
+                     file_hash[2:4], file_hash + CONTENT_ADDRESSED_EXTENSION))
+
+
+def write_once(file: File, path: str) -> bool:
+    """
+    Writes the content of a file to a content addressed path, unless a
+    file already exists there. As the path is derived from the content,
+    an existing file already has the same content.
+
+    The path is claimed first, by creating its claim file exclusively,
+    see _claim. The content is written to the claim file, which is then
+    moved in place, so the path only ever holds the complete content.
+    When two requests write the same content at the same time, only
+    the one holding the claim writes it. The other waits for the claim
+    to be released, and then finds the file in place.
+
+    Args:
+        file: The uploaded file
+        path: The content addressed path, see content_addressed_name
+
+    Returns: If the file was written
+
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    claim_path = f"{path}{CLAIM_EXTENSION}"
+
+    while not os.path.exists(path):
+        destination = _claim(claim_path)
+        if destination is None:
+            _wait_for_claim(claim_path)
+            continue
+
+        moved = False
+        try:
+            with destination:
+                # Written and released by another request, since the
+                # path was checked
+                if os.path.exists(path):
+                    return False
+                for chunk in file.chunks():
+                    destination.write(chunk)
+            os.replace(claim_path, path)
+            moved = True
+        finally:
+            if not moved:
+                os.remove(claim_path)
+        return True
+    return False
+
+
+def _claim(claim_path: str) -> BinaryIO | None:
+    """
+    Creates the claim file, None if it already exists, as another
+    request is writing the same content.
+    """
+    try:
+        return os.fdopen(os.open(claim_path,
+                                 os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                                 0o644), "wb")
+    except FileExistsError:
+        return None
+
+
+def _wait_for_claim(claim_path: str) -> None:
+    """
+    Waits until the claim file is gone. A claim file that has not been
+    written to for CLAIM_TIMEOUT seconds was left behind by a process
+    that stopped while writing, it is removed so the content can be
+    claimed again.
+    """
+    while True:
+        try:
+            modified = os.path.getmtime(claim_path)
+        except FileNotFoundError:
+            return
+        if modified < time.time() - CLAIM_TIMEOUT:
+            try:
+                os.remove(claim_path)
+            except FileNotFoundError:
+                pass
+            return
+        time.sleep(CLAIM_POLL_INTERVAL)
@@ -0,0 +1,217 @@
+import json
+import os
+import re
+import secrets
+import time
+from pathlib import Path
+
+import polars as pl
+from django.conf import settings
+
+from apps.cellviewer.util.well_cube import WellHistogramCube, \
+    WELL_CUBE_EXTENSION, load_cached
+
+DATASET_TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_-]{32,64}$")
+DATASET_EXTENSION = ".arrow"
+DATASET_METADATA_EXTENSION = ".meta.json"
+
+
+def _dataset_directory(user_id: int) -> Path:
+    return Path(settings.DATASET_STORE_DIR) / str(int(user_id))
+
+
+def _dataset_path(token: str, user_id: int,
+                  extension: str = DATASET_EXTENSION) -> Path:
+    """
+    Translates a token to the path of the dataset.
+
+    The token is received from the user, so it is validated
+    before it is used to build a path. Datasets are stored per user,
+    so a token on its own does not give access to another
+    user's data.
+
+    Args:
+        token:
+        user_id:
+
+    Returns:
+
+    """
+    if not token or not DATASET_TOKEN_PATTERN.fullmatch(token):
+        raise ValueError("Invalid dataset token")
+    return _dataset_directory(user_id) / f"{token}{extension}"
+
+
+def store_dataset(df: pl.DataFrame, user_id: int) -> str:
+    """
+    Stores a parsed, not yet saved, dataset server side as an Arrow
+    IPC file, and returns the token that refers to it.
+
+    This allows the dashboard of an unsaved file to be updated
+    without the browser sending the full file again for every
+    change of the thresholds.
+
+    The file is written to a temporary name first and then moved
+    in place, so a request can never read a half written dataset.
+
+    Next to the dataset its WellHistogramCube is stored, which is
+    used for the previews while moving a slider, together with the
+    substances and the amount of sites, so a preview does not have
+    to read the dataset itself, see load_dataset_metadata.
+
+    As there is no clear moment where a user stops using an
+    unsaved dataset, storing a new dataset also removes the datasets
+    that have expired.
+
+    Args:
+        df: The parsed file
+        user_id: The id of the user the dataset belongs to
+
+    Returns: The token of the dataset
+
+    """
+    reap_expired_datasets()
+
+    token = secrets.token_urlsafe(32)
+    path = _dataset_path(token, user_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    temporary_path = path.with_suffix(".tmp")
+    df.write_ipc(temporary_path)
+    os.replace(temporary_path, path)
+
+    WellHistogramCube.from_dataframe(df).save(
+        str(_dataset_path(token, user_id, WELL_CUBE_EXTENSION)))
+
+    metadata_path = _dataset_path(token, user_id, DATASET_METADATA_EXTENSION)
+    temporary_path = metadata_path.with_suffix(".tmp")
+    with open(temporary_path, "w") as f:
+        json.dump({"substances": df.columns[3:],
+                   "amount_of_sites": int(df["Site"].max())}, f)
+    os.replace(temporary_path, metadata_path)
+
+    return token
+
+
+def load_dataset(token: str, user_id: int) -> pl.DataFrame:
+    """
+    Loads a dataset stored through store_dataset.
+
+    Every time a dataset is used its expiry is extended,
+    so a dataset that is actively being looked at does not expire.
+
+    If the token is malformed a ValueError is raised, if the dataset
+    does not exist (anymore) a FileNotFoundError is raised.
+
+    Args:
+        token:
+        user_id:
+
+    Returns: The polars DataFrame of the dataset
+
+    """
+    path = _dataset_path(token, user_id)
+    if not path.is_file():
+        raise FileNotFoundError("The dataset has expired or does not exist")
+
+    os.utime(path)
+    return pl.read_ipc(path)
+
+
+def load_dataset_cube(token: str, user_id: int) -> WellHistogramCube:
+    """
+    Loads the WellHistogramCube of a dataset stored through
+    store_dataset. Raises the same errors as load_dataset.
+
+    Args:
+        token:
+        user_id:
+
+    Returns:
+
+    """
+    path = _dataset_path(token, user_id, WELL_CUBE_EXTENSION)
+    if not path.is_file():
+        raise FileNotFoundError("The dataset has expired or does not exist")
+
+    os.utime(path)
+    return load_cached(str(path))
+
+
+def load_dataset_metadata(token: str, user_id: int) -> dict:
+    """
+    Loads the substances and the amount of sites of a dataset stored
+    through store_dataset. Raises the same errors as load_dataset,
+    also for datasets stored before the metadata was.
+
+    The expiry of the dataset itself is extended too, as previews
+    only use the metadata and the cube while the dataset is still
+    being looked at.
+
+    Args:
+        token:
+        user_id:
+
+    Returns: A dictionary with the substances and amount_of_sites
+
+    """
+    dataset_path = _dataset_path(token, user_id)
+    path = _dataset_path(token, user_id, DATASET_METADATA_EXTENSION)
+    if not dataset_path.is_file() or not path.is_file():
+        raise FileNotFoundError("The dataset has expired or does not exist")
+
+    os.utime(dataset_path)
+    os.utime(path)
+    with open(path) as f:
+        return json.load(f)
+
+
+def reap_expired_datasets(ttl: int | float = None) -> int:
+    """
+    Removes all stored datasets that have not been used for longer
+    than the ttl in seconds. If no ttl is passed it uses the
+    DATASET_STORE_TTL setting.
+
+    A dataset consists of multiple files, and each load only
+    touches the files it reads, so a dataset is used as long as any
+    of its files is. The files of an expired dataset are removed
+    together, so a dataset is never left without its cube or metadata.
+
+    Files that disappear while this runs, for example through
+    another worker doing the same, are ignored.
+
+    Args:
+        ttl: The time to live in seconds
+
+    Returns: The amount of removed datasets
+
+    """
+    if ttl is None:
+        ttl = settings.DATASET_STORE_TTL
+
+    store_directory = Path(settings.DATASET_STORE_DIR)
+    if not store_directory.is_dir():
+        return 0
+
+    # The token does not contain a dot, so everything before the first
+    # dot is the dataset a file belongs to.
+    datasets = {}
+    last_used = {}
+    for path in store_directory.glob("*/*"):
+        try:
+            modified = path.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        dataset = path.parent / path.name.split(".")[0]
+        datasets.setdefault(dataset, []).append(path)
+        last_used[dataset] = max(last_used.get(dataset, 0), modified)
+
+    expire_before = time.time() - ttl
+    removed = 0
+    for dataset, paths in datasets.items():
+        if last_used[dataset] >= expire_before:
+            continue
+        for path in paths:
+            path.unlink(missing_ok=True)
+        removed += 1
+    return removed
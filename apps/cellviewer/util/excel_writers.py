@@ -64,14 +64,21 @@ def write_matrices(writer, sheet, current_row, matrix_explanations, matrices):
     return current_row
 
 
-def write_individual_analysis_to_binary(
+INDIVIDUAL_MATRIX_EXPLANATIONS = [
+    "Well counts per well",
+    "Well counts filtered on the substance thresholds",
+    "Double positives above the thresholds"
+]
+
+
+def write_individual_analysis_to_bytes(
         file_name: str = None, experiment_name: str = None,
         amount_of_sites: int = None,
         substance_names: list[str] = None,
         substance_thresholds: list[float] = None,
         matrix_explanations: list[str] = None,
         matrices: list[pd.DataFrame] = None
-):
+) -> bytes:
     """
     Writes the content of an excell file
     using openpyxl as the engine, through
@@ -84,9 +91,6 @@ def write_individual_analysis_to_binary(
     It's possible to write in multiple sheets but that
     is currently not done.
     
-    It dumps the content into latin1 format.
-    This is so JavaScript can natively work with it.
-    
     Args:
         file_name:
         experiment_name:
@@ -96,7 +100,7 @@ def write_individual_analysis_to_binary(
         matrix_explanations:
         matrices:
 
-    Returns:
+    Returns: The content of the xlsx file
 
     """
     output = io.BytesIO()
@@ -122,9 +126,7 @@ def write_individual_analysis_to_binary(
         current_row = write_matrices(writer, sheet, current_row,
                                      matrix_explanations, matrices)
     
-    excel_data = output.getvalue()
-    excel_data = excel_data.decode("latin1")
-    return excel_data
+    return output.getvalue()
 
 
 def write_comparison_analysis_to_binary(
@@ -139,7 +141,8 @@ def write_comparison_analysis_to_binary(
 ):
     
     """
-    Writes out the
+    Writes out the comparison of multiple experiments, the metadata and
+    matrices of each experiment followed by the aggregated matrices.
     
     Args:
         file_names:
@@ -151,7 +154,7 @@ def write_comparison_analysis_to_binary(
         matrix_explanations:
         matrices:
 
-    Returns:
+    Returns: The content of the xlsx file
 
     """
     
@@ -184,6 +187,4 @@ def write_comparison_analysis_to_binary(
         current_row = write_matrices(writer, sheet, current_row,
                                      matrix_explanations, matrices)
     
-    excel_data = output.getvalue()
-    excel_data = excel_data.decode("latin1")
-    return excel_data
+    return output.getvalue()
@@ -0,0 +1,197 @@
+import polars as pl
+
+REQUIRED_HEADER = ["Well", "Site", "Cell"]
+VALIDATION_CHUNK_SIZE = 1024 * 1024
+
+
+def line_pattern(substance_count: int) -> str:
+    """
+    The pattern every line after the header has to match.
+
+    A well is a capital letter followed by at most 3 digits, the site and
+    cell are whole numbers, and every substance is a positive number with
+    an optional decimal part.
+    Only [0-9] is accepted as a digit, not any unicode digit.
+
+    Args:
+        substance_count: The amount of columns after Well,Site,Cell
+
+    Returns: A regex pattern
+
+    """
+    return (fr"^[A-Z][0-9]{{0,3}},[0-9]+,[0-9]+"
+            fr"(,[0-9]+\.?[0-9]*){{{substance_count}}}$")
+
+
+class CellFileValidator:
+    """
+    Checks the format of an input file, while it is being read
+    in chunks.
+
+    The file is never held in memory as a whole. Every chunk that is fed
+    is split into complete lines, and the part of a line that continues
+    in the next chunk is kept until that chunk arrives. The lines are
+    matched against the pattern as one batch through polars, which
+    uses a regex engine that does not backtrack, so the time is linear
+    in the size of the file.
+
+    The first line is the header, which has to start with
+    Well,Site,Cell. Every other line has to match line_pattern,
+    lines end with \\n, \\r\\n or \\r and there can be no empty lines,
+    except that the last line may or may not end with a line ending.
+
+    Instead of only telling that there is a mistake somewhere, the line
+    numbers of the first max_reported_lines wrong lines are kept.
+
+    Example:
+        validator = CellFileValidator()
+        for chunk in file.chunks():
+            validator.feed(chunk)
+        validator.finish()
+        if not validator.is_valid:
+            print(validator.error_title, validator.error_text)
+    """
+
+    def __init__(self, max_reported_lines: int = 10):
+        self.max_reported_lines = max_reported_lines
+
+        self.header = None
+        self.header_error = False
+        self.pattern = None
+
+        self.line_count = 0
+        self.invalid_line_count = 0
+        self.invalid_lines: list[int] = []
+
+        self._remainder = b""
+        self._finished = False
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Validates the complete lines in the chunk, and keeps the
+        incomplete last line for the next chunk.
+        """
+        if self.header_error:
+            return
+        data = self._remainder + chunk
+
+        if self.header is None:
+            end = self._line_end(data)
+            # a \r at the very end might be the first half of \r\n
+            if end is None or end == len(data) - 1 and data.endswith(b"\r"):
+                self._remainder = data
+                return
+            self._read_header(data[:end])
+            if self.header_error:
+                return
+            data = self._skip_line_ending(data[end:])
+
+        cut = max(data.rfind(b"\n"), data.rfind(b"\r"))
+        # a \r at the very end might be the first half of \r\n
+        if cut == len(data) - 1 and data.endswith(b"\r"):
+            cut = max(data.rfind(b"\n", 0, cut), data.rfind(b"\r", 0, cut))
+        if cut == -1:
+            self._remainder = data
+            return
+
+        self._validate_lines(data[:cut + 1].splitlines())
+        self._remainder = data[cut + 1:]
+
+    def finish(self) -> None:
+        """
+        Validates the last line, which does not need to end with a line
+        ending. Must be called after the last chunk was fed.
+        """
+        if self._finished:
+            return
+        self._finished = True
+        if self.header_error:
+            return
+
+        if self.header is None:
+            if self._remainder:
+                self._read_header(self._remainder)
+            else:
+                self.header_error = True
+            return
+
+        # Only the last line is left, possibly still with its \r.
+        # If it is nothing but the \r, it is an empty line.
+        if self._remainder:
+            self._validate_lines([self._remainder.rstrip(b"\r")])
+        self._remainder = b""
+
+    @property
+    def is_valid(self) -> bool:
+        return (self._finished and not self.header_error
+                and self.invalid_line_count == 0 and self.line_count > 0)
+
+    @property
+    def error_title(self) -> str:
+        if self.header_error:
+            return "Wrong file header"
+        return "Wrong file format"
+
+    @property
+    def error_text(self) -> str:
+        """
+        A message for the user explaining what is wrong with the file.
+        """
+        if self.header_error:
+            return "The file header does not start with Well,Site,Cell"
+        if self.line_count == 0:
+            return "The file does not contain any cells"
+        if self.invalid_line_count == 0:
+            return ""
+
+        lines = ", ".join(str(i) for i in self.invalid_lines)
+        text = (f"{self.invalid_line_count} line(s) do not match the "
+                f"expected format, see line {lines}")
+        if self.invalid_line_count > len(self.invalid_lines):
+            text += " and more"
+        return text
+
+    @staticmethod
+    def _line_end(data: bytes) -> int | None:
+        positions = [i for i in (data.find(b"\n"), data.find(b"\r"))
+                     if i != -1]
+        return min(positions) if positions else None
+
+    @staticmethod
+    def _skip_line_ending(data: bytes) -> bytes:
+        if data.startswith(b"\r\n"):
+            return data[2:]
+        return data[1:]
+
+    def _read_header(self, line: bytes) -> None:
+        self.header = line.decode("utf-8", errors="replace").strip() \
+            .split(",")
+        if self.header[:3] != REQUIRED_HEADER:
+            self.header_error = True
+            return
+        self.pattern = line_pattern(len(self.header) - 3)
+
+    def _validate_lines(self, lines: list[bytes]) -> None:
+        """
+        Matches a batch of lines against the pattern, and keeps the
+        line numbers of the wrong lines. The header is line 1.
+        """
+        if not lines:
+            return
+        try:
+            batch = pl.Series(lines, dtype=pl.Binary).cast(pl.String)
+        except pl.exceptions.ComputeError:
+            # Not valid utf-8, the replacement characters make the
+            # wrong lines not match
+            batch = pl.Series(
+                [line.decode("utf-8", errors="replace") for line in lines],
+                dtype=pl.String)
+        invalid = (~batch.str.contains(self.pattern)).arg_true()
+
+        if len(invalid):
+            self.invalid_line_count += len(invalid)
+            room = self.max_reported_lines - len(self.invalid_lines)
+            if room > 0:
+                self.invalid_lines.extend(
+                    int(i) + self.line_count + 2 for i in invalid[:room])
+        self.line_count += len(lines)
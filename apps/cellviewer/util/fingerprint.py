@@ -0,0 +1,30 @@
+import hashlib
+import json
+
+
+def label_matrix_fingerprint(matrix_name: str, row_count: int,
+                             col_count: int, rows: str, cols: str,
+                             cells: str) -> str:
+    """
+    A sha256 digest of everything that makes two LabelMatrices
+    equivalent, see LabelMatrixManager.find_equivalent.
+
+    The values are encoded as a JSON list, so the boundaries between
+    the values can not shift, a name ending in ",,," for example does
+    not give the same fingerprint as moving those characters into
+    the rows.
+
+    Args:
+        matrix_name:
+        row_count:
+        col_count:
+        rows: The joined row names, see LabelMatrixManager.joiner
+        cols: The joined column names
+        cells: The joined cell names
+
+    Returns: The hex digest
+
+    """
+    content = json.dumps([matrix_name, int(row_count), int(col_count),
+                          rows, cols, cells], ensure_ascii=False)
+    return hashlib.sha256(content.encode()).hexdigest()
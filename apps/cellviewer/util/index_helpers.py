@@ -5,6 +5,7 @@ from django.http import HttpResponse
 from apps.cellviewer.components.label_matrix_input_fields import \
     LabelMatrixInputFieldsComponent
 from apps.cellviewer.models.LabelMatrix import LabelMatrix
+from apps.cellviewer.util.dataset_store import load_dataset
 
 
 def load_and_save_processing(request):
@@ -29,12 +30,68 @@ def load_and_save_processing(request):
     
     file_name = files[0].name
     if not name:
-        name_without_extension, _ = os.path.splitext(file_name)
-        name = name_without_extension + "_experiment"
+        name = default_experiment_name(file_name)
     
     return files, name, labels, file_name
 
 
+def load_stored_dataset_processing(request):
+    """
+    Helper function
+    
+    The counterpart of load_and_save_processing, for requests that
+    refer to a dataset that is kept server side by its token,
+    instead of sending the file itself again.
+    
+    The dataset and file name are not part of the labels input,
+    these are sent along as hidden inputs in the dashboard.
+    
+    If the dataset has expired a FileNotFoundError is raised.
+    Args:
+        request:
+
+    Returns: The DataFrame, The job/experiment name, the labels, the file name
+
+    """
+    df = load_dataset(request.POST.get("dataset_token"), request.user.id)
+    name, labels, file_name = load_stored_dataset_names(request)
+    return df, name, labels, file_name
+
+
+def load_stored_dataset_names(request):
+    """
+    Helper function
+    
+    The part of load_stored_dataset_processing that only reads the
+    request, for when the dataset itself is not needed, like for a
+    preview from the WellHistogramCube.
+    
+    Args:
+        request:
+
+    Returns: The job/experiment name, the labels, the file name
+
+    """
+    file_name = request.POST.get("file_name")
+    name = request.POST.get("name")
+    
+    _, labels = load_labels_from_request(request)
+    
+    if not name:
+        name = default_experiment_name(file_name)
+    
+    return name, labels, file_name
+
+
+def default_experiment_name(file_name: str) -> str:
+    """
+    The experiment name used if the user did not input one,
+    based on the name of the file.
+    """
+    name_without_extension, _ = os.path.splitext(file_name or "")
+    return name_without_extension + "_experiment"
+
+
 def load_labels_from_request(request):
     """
     Helper function
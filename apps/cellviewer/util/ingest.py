@@ -0,0 +1,140 @@
+import hashlib
+from functools import cached_property
+from string import digits, ascii_letters
+
+import polars as pl
+from django.core.files.uploadedfile import UploadedFile
+
+from apps.cellviewer.util.file_validation import CellFileValidator, \
+    VALIDATION_CHUNK_SIZE
+
+
+def file_dimensions(df: pl.DataFrame) -> tuple[int, tuple[list[str], list[str]]]:
+    """
+    Helper function which returns the row count, and all row names and
+    column names that appear as a sorted list, to have the dimensions
+    be calculated from that.
+    It presumes all the letters it can find are the rows.
+    All the numbers are the columns. It does not care
+    if a letter number combination is missing and ignores such things.
+    Args:
+        df:
+
+    Returns:
+
+    """
+    rows = df.height
+    name = df.columns[0]
+    tags = df[name].arr.explode().unique().to_list()
+    
+    letters = sorted(set(t.strip(digits) for t in tags))
+    numbers = sorted(set(t.strip(ascii_letters) for t in tags))
+    return rows, (letters, numbers)
+
+
+class IngestedFile:
+    """
+    An uploaded input file, read once, with everything the later
+    steps need to know about it.
+
+    Reading the file computes the sha256 hash and validates the format
+    in the same pass over the chunks. When the upload was handled by
+    the IngestingUploadHandler this was already done during the upload,
+    and the file is not read at all. The file is only parsed into a
+    DataFrame when that is first needed, and only once. The row count
+    and substances come from the validation, so they do not need the
+    parsed file.
+
+    Use ingest_file to get the IngestedFile of an upload, which keeps
+    it on the request so every step handling that request reuses it.
+    """
+
+    def __init__(self, file: UploadedFile):
+        self.file = file
+
+        # Already done while the file was uploaded,
+        # see IngestingUploadHandler
+        if hasattr(file, "sha256") and hasattr(file, "validator"):
+            self.hash = file.sha256
+            self.validator = file.validator
+            return
+
+        self.validator = CellFileValidator()
+        file_hash = hashlib.sha256()
+        for chunk in file.chunks(VALIDATION_CHUNK_SIZE):
+            file_hash.update(chunk)
+            self.validator.feed(chunk)
+        self.validator.finish()
+        file.seek(0)
+
+        self.hash = file_hash.hexdigest()
+
+    @property
+    def is_valid(self) -> bool:
+        return self.validator.is_valid
+
+    @property
+    def row_count(self) -> int:
+        return self.validator.line_count
+
+    @property
+    def header(self) -> list[str]:
+        return self.validator.header
+
+    @property
+    def substances(self) -> list[str]:
+        return self.validator.header[3:]
+
+    @cached_property
+    def df(self) -> pl.DataFrame:
+        """
+        The parsed file. Raises a ValueError if the file is not valid.
+        """
+        if not self.is_valid:
+            raise ValueError(self.validator.error_text)
+        # An upload written to disk is read by polars directly from
+        # the path, instead of through python
+        if hasattr(self.file, "temporary_file_path"):
+            return pl.read_csv(self.file.temporary_file_path())
+        self.file.seek(0)
+        df = pl.read_csv(self.file)
+        self.file.seek(0)
+        return df
+
+    @cached_property
+    def dimension(self) -> tuple[list[str], list[str]]:
+        """
+        The sorted row letters and column numbers of the plate,
+        see file_dimensions.
+        """
+        _, dimension = file_dimensions(self.df)
+        return dimension
+
+
+def ingest_file(request, file: UploadedFile) -> IngestedFile:
+    """
+    Gets the IngestedFile of an uploaded file. The first time it is
+    asked for within a request the file is read, after that it is
+    reused from the request.
+
+    Args:
+        request:
+        file: One of the files in request.FILES
+
+    Returns:
+
+    """
+    if not hasattr(request, "_ingested_files"):
+        request._ingested_files = {}
+    if file not in request._ingested_files:
+        request._ingested_files[file] = IngestedFile(file)
+    return request._ingested_files[file]
+
+
+def ingest_request_files(request, field: str = "inputData"
+                         ) -> list[IngestedFile]:
+    """
+    The IngestedFile of every file uploaded in the field.
+    """
+    return [ingest_file(request, file)
+            for file in request.FILES.getlist(field, [])]
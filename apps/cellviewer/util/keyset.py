@@ -0,0 +1,55 @@
+from datetime import datetime
+
+CURSOR_SEPARATOR = "_"
+
+
+def encode_cursor(date: datetime, row_id: int) -> str:
+    """
+    The position after a row in a list ordered by date and id,
+    to continue the list from, see decode_cursor.
+
+    The id is included as the date alone does not have to be unique,
+    together they point to exactly one row.
+
+    Args:
+        date:
+        row_id:
+
+    Returns: The cursor as text, to put in a url
+
+    """
+    return f"{date.isoformat()}{CURSOR_SEPARATOR}{int(row_id)}"
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    Reads a cursor made by encode_cursor.
+
+    Args:
+        cursor:
+
+    Returns: The date and the id of the row
+
+    Raises:
+        ValueError: If the cursor was not made by encode_cursor
+
+    """
+    date, separator, row_id = cursor.rpartition(CURSOR_SEPARATOR)
+    if not separator:
+        raise ValueError("Not a cursor")
+    return datetime.fromisoformat(date), int(row_id)
+
+
+def split_page(rows: list, page_size: int) -> tuple[list, bool]:
+    """
+    A page is queried with one row more than the page size, if that
+    row is there there is a next page. This avoids counting all rows.
+
+    Args:
+        rows: At most page_size + 1 rows
+        page_size:
+
+    Returns: The rows of the page, and if there is a next page
+
+    """
+    return rows[:page_size], len(rows) > page_size
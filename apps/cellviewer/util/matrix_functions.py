@@ -1,7 +1,36 @@
+import math
+import numpy as np
 import pandas as pd
 import polars as pl
 from functools import reduce
 
+from apps.cellviewer.util.plate_cube import PlateCube
+
+
+def threshold_condition(
+        df: pl.DataFrame, substance_thresholds: list[float]
+) -> pl.Expr | None:
+    """
+    The polars expression that is true for the cells at or above all of
+    the thresholds, see filtered_polars_dataframe.
+    If all thresholds are zero there is no filtering, and None is
+    returned.
+    
+    Args:
+        df:
+        substance_thresholds:
+
+    Returns:
+
+    """
+    if not any(i != 0 for i in substance_thresholds):
+        return None
+    conditions = []
+    for i, val in enumerate(substance_thresholds):
+        col_name = df.columns[i + 3]
+        conditions.append(pl.col(col_name) >= val)
+    return reduce(lambda a, b: a & b, conditions)
+
 
 def filtered_polars_dataframe(
         df: pl.DataFrame, substance_thresholds: list[float]
@@ -24,16 +53,83 @@ def filtered_polars_dataframe(
     Returns:
 
     """
-    if any(i != 0 for i in substance_thresholds):
-        conditions = []
-        for i, val in enumerate(substance_thresholds):
-            col_name = df.columns[i + 3]
-            conditions.append(pl.col(col_name) >= val)
-        combined_conditions = reduce(lambda a, b: a & b, conditions)
+    combined_conditions = threshold_condition(df, substance_thresholds)
+    if combined_conditions is not None:
         df = df.filter(combined_conditions)
     return df
 
 
+def plate_positions(wells: list[str]
+                    ) -> tuple[list[str], list[str], np.ndarray, np.ndarray]:
+    """
+    Splits well names into their row letter and column number, and
+    finds the position of every well in the plate.
+    
+    Only the different well names are parsed, which are a few hundred,
+    never the millions of cells.
+    
+    The rows and columns are sorted, and only the rows and columns
+    that appear in the wells are part of the plate.
+    
+    Args:
+        wells: The well names, for example ["B02", "C03"]
+
+    Returns: The row names, the column names, and for every well
+        its row index and column index.
+
+    """
+    rows = [well[0] for well in wells]
+    cols = [well[1:] for well in wells]
+    row_names = sorted(set(rows))
+    col_names = sorted(set(cols))
+    
+    row_position = {row: i for i, row in enumerate(row_names)}
+    col_position = {col: i for i, col in enumerate(col_names)}
+    row_index = np.array([row_position[row] for row in rows], dtype=np.intp)
+    col_index = np.array([col_position[col] for col in cols], dtype=np.intp)
+    return row_names, col_names, row_index, col_index
+
+
+def plate_to_matrix(plate: np.ndarray, row_names: list[str],
+                    col_names: list[str]) -> pd.DataFrame:
+    """
+    Wraps a plate array in the pandas matrix format that is used by the
+    heatmaps and the excel writers, see calculate_well_count_matrix.
+    """
+    return pd.DataFrame(plate, index=pd.Index(row_names, name="row"),
+                        columns=pd.Index(col_names, name="cols"))
+
+
+def count_cells_per_well(df: pl.DataFrame,
+                         substance_thresholds: list[float] = ()
+                         ) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """
+    Counts per well both the total amount of cells, and the amount of
+    cells at or above the thresholds.
+    
+    This is a single aggregation, the positive cells are counted by
+    summing the condition, instead of filtering the DataFrame and
+    counting it a second time.
+    
+    Args:
+        df:
+        substance_thresholds:
+
+    Returns: The well names, the total counts, the positive counts
+
+    """
+    condition = threshold_condition(df, substance_thresholds)
+    positive = pl.len() if condition is None else condition.sum()
+    
+    well_counts = df.group_by("Well").agg(
+        pl.len().alias("total"),
+        positive.alias("positive"),
+    )
+    return (well_counts["Well"].cast(pl.String).to_list(),
+            well_counts["total"].to_numpy().astype(np.int64),
+            well_counts["positive"].to_numpy().astype(np.int64))
+
+
 def calculate_well_count_matrix(df: pl.DataFrame) -> pd.DataFrame:
     """
     Calculates the well count matrix.
@@ -67,15 +163,33 @@ def calculate_well_count_matrix(df: pl.DataFrame) -> pd.DataFrame:
     Returns:
 
     """
-    well_counts = df.group_by("Well").count().to_pandas()
-    
-    well_counts["row"] = [well[0] for well in well_counts["Well"]]
-    well_counts["cols"] = [well[1:] for well in well_counts["Well"]]
-    matrix_well_counts = well_counts.pivot(index="row", columns="cols",
-                                           values="count")
-    matrix_well_counts.fillna(0, inplace=True)
+    wells, counts, _ = count_cells_per_well(df)
+    return well_counts_to_matrix(wells, counts)
+
+
+def well_counts_to_matrix(wells, counts) -> pd.DataFrame:
+    """
+    Places counts that are already known per well in the same matrix
+    format as calculate_well_count_matrix.
+
+    The wells and counts are matched on their position, so the first
+    count belongs to the first well.
+
+    This is used when the counts are not calculated from a polars
+    DataFrame, but for example from the WellThresholdIndex.
+
+    Args:
+        wells: The well names, for example ["B02", "C03"]
+        counts: The count for each of the wells
+
+    Returns:
+
+    """
+    row_names, col_names, row_index, col_index = plate_positions(list(wells))
+    plate = np.zeros((len(row_names), len(col_names)), dtype=np.int64)
+    plate[row_index, col_index] = counts
     
-    return matrix_well_counts
+    return plate_to_matrix(plate, row_names, col_names)
 
 
 def calculate_well_count_percent(well_count_matrix, filtered_well_count_matrix):
@@ -106,16 +220,13 @@ def calculate_well_counts_and_percent(df, substance_thresholds):
     percentage all from a singular function call, wrapping together
     multiple functions from this file.
     
-    A note is that, it's possible in some cases for the filtering
-    to filter out for example all Wells with the letter B,
-    In that case calculating the well count would not have
-    wells with the letter B appear at all.
-    The original well count matrix is used to adjust for this,
-    so no Well combinations can be missed in the output.
-    
-    This could be made into a separate function,
-    however it's not intended to do anything without this combined
-    function, so that might not be necessary.
+    The total and the positive cells are counted in one aggregation,
+    see count_cells_per_well, and placed straight into numpy plate arrays.
+    As the positive cells are counted within the same groups as the
+    total, a well of which every cell is filtered out is still part
+    of the output, with a count of zero.
+    The plates are only wrapped in pandas at the end, as that is the
+    format the heatmaps and the excel writers expect.
     
     Args:
         df:
@@ -124,21 +235,296 @@ def calculate_well_counts_and_percent(df, substance_thresholds):
     Returns:
 
     """
-    df_filtered = filtered_polars_dataframe(
-        df, substance_thresholds
-    )
+    wells, totals, positives = count_cells_per_well(df, substance_thresholds)
+    row_names, col_names, row_index, col_index = plate_positions(wells)
+    
+    total_plate = np.zeros((len(row_names), len(col_names)), dtype=np.int64)
+    total_plate[row_index, col_index] = totals
+    positive_plate = np.zeros_like(total_plate)
+    positive_plate[row_index, col_index] = positives
+    
+    return plates_to_well_counts_and_percent(total_plate, positive_plate,
+                                             row_names, col_names)
+
+
+def plates_to_well_counts_and_percent(total_plate: np.ndarray,
+                                      positive_plate: np.ndarray,
+                                      row_names: list[str],
+                                      col_names: list[str]
+                                      ) -> tuple[pd.DataFrame, pd.DataFrame,
+                                                 pd.DataFrame]:
+    """
+    Calculates the double positive percentages of the plate arrays of
+    the total and positive counts, and wraps all three in the format
+    of calculate_well_counts_and_percent.
+    
+    Args:
+        total_plate: The total count per well as a rows x cols array
+        positive_plate: The positive count per well, in the same shape
+        row_names:
+        col_names:
+
+    Returns:
+
+    """
+    percent_plate = np.zeros(total_plate.shape, dtype=np.float64)
+    np.divide(100 * positive_plate, total_plate, out=percent_plate,
+              where=total_plate > 0)
     
-    well_count_matrix = calculate_well_count_matrix(df)
+    return (plate_to_matrix(total_plate, row_names, col_names),
+            plate_to_matrix(positive_plate, row_names, col_names),
+            plate_to_matrix(percent_plate, row_names, col_names))
+
+
+# The most counts a sweep holds in memory at once, 40MB of int64.
+# The counts of one well have to fit in this, more wells are counted
+# at once when they fit, see count_threshold_sweep.
+SWEEP_MAX_ENTRIES = 5_000_000
+
+
+def calculate_threshold_sweep(df: pl.DataFrame,
+                              threshold_vectors: list[list[float]]
+                              ) -> tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    """
+    Calculates the filtered well counts and double positive percentages
+    for many sets of thresholds at once, instead of filtering the
+    file once per set of thresholds.
+
+    The cells are grouped per well and counted with
+    count_threshold_sweep. The thresholds are compared in the precision
+    of the column, the same as polars does.
     
-    filtered_well_count_matrix = calculate_well_count_matrix(
-        df_filtered
-    ).reindex(index=well_count_matrix.index, columns=well_count_matrix.columns, fill_value=0)
+    WellThresholdIndex.threshold_sweep does the same from the index of
+    a saved file, which already holds the cells grouped per well.
+
+    Args:
+        df:
+        threshold_vectors: A list of sets of thresholds,
+            for example [[1, 2], [1, 2.5]]
+
+    Returns:
+        The well count matrix, as calculate_well_count_matrix.
+        The filtered counts and the percentages, both as a numpy array
+        in the shape (sets of thresholds, rows, cols), with the rows and
+        cols in the order of the well count matrix.
+    """
+    substance_count = max((len(v) for v in threshold_vectors), default=0)
+    if substance_count > len(df.columns) - 3:
+        raise IndexError("More thresholds than substances")
+
+    wells = df["Well"].cast(pl.String).cast(pl.Categorical)
+    well_names = wells.cat.get_categories().to_list()
+    well_codes = wells.to_physical().to_numpy().astype(np.int64)
+    
+    order = np.argsort(well_codes, kind="stable")
+    offsets = np.zeros(len(well_names) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(well_codes,
+                                        minlength=len(well_names)))
+    
+    values = []
+    for j in range(substance_count):
+        column = df[df.columns[j + 3]]
+        dtype = np.float32 if column.dtype == pl.Float32 else np.float64
+        values.append(column.cast(pl.Float64).fill_nan(None)
+                      .fill_null(float("-inf")).to_numpy()
+                      .astype(dtype)[order])
+    
+    filtered_per_well = count_threshold_sweep(values, offsets,
+                                              threshold_vectors)
+    return threshold_sweep_plates(well_names, np.diff(offsets),
+                                  filtered_per_well)
+
+
+def count_threshold_sweep(values, offsets: np.ndarray,
+                          threshold_vectors: list[list[float]]
+                          ) -> np.ndarray:
+    """
+    Counts per well the cells at or above every set of thresholds.
+
+    For every substance, every cell is ranked against the sorted
+    thresholds of that substance that appear in the sweep. The cells
+    of a well are then counted per combination of ranks, and a
+    cumulative sum over the ranks gives for each combination of
+    thresholds the amount of cells at or above all of them. Each set
+    of thresholds is then a lookup.
+    
+    The combinations of ranks of a single well take
+    prod(thresholds per substance + 1) counts. As many wells as fit in
+    SWEEP_MAX_ENTRIES are counted at a time, so the memory used does
+    not grow with the amount of wells. If a single well does not fit,
+    a ValueError is raised.
+
+    The thresholds behave the same as in filtered_polars_dataframe,
+    they are inclusive, apply to the first n substances, and a set of
+    only zeros does not filter at all. Missing values have to be -inf.
+
+    Args:
+        values: Per substance the values of the cells, grouped per well.
+            The thresholds are compared in the dtype of these.
+        offsets: The start of each well in values, with the end
+            of the last well appended
+        threshold_vectors: A list of sets of thresholds
+
+    Returns: The counts in the shape (sets of thresholds, wells)
+
+    """
+    substance_count = max((len(v) for v in threshold_vectors), default=0)
+    if substance_count > len(values):
+        raise IndexError("More thresholds than substances")
+    
+    # per substance the sorted thresholds, every threshold is found
+    # back through its position in there
+    sorted_thresholds = []
+    for j in range(substance_count):
+        sorted_thresholds.append(np.unique(np.array(
+            [v[j] for v in threshold_vectors if len(v) > j],
+            dtype=values[j].dtype)))
+    
+    cube_shape = tuple(len(t) + 1 for t in sorted_thresholds)
+    cube_size = math.prod(cube_shape)
+    if cube_size > SWEEP_MAX_ENTRIES:
+        raise ValueError("Too many combinations of thresholds")
+    
+    # The position of every set of thresholds in the counts of a well,
+    # a set of only zeros is the total at position 0
+    positions = np.zeros((len(threshold_vectors), substance_count),
+                         dtype=np.int64)
+    for i, vector in enumerate(threshold_vectors):
+        if any(t != 0 for t in vector):
+            for j, threshold in enumerate(vector):
+                thresholds = sorted_thresholds[j]
+                positions[i, j] = int(np.searchsorted(
+                    thresholds, thresholds.dtype.type(threshold))) + 1
+    flat_positions = np.zeros(len(threshold_vectors), dtype=np.int64)
+    if substance_count:
+        flat_positions = np.ravel_multi_index(tuple(positions.T), cube_shape)
+    
+    well_count = len(offsets) - 1
+    wells_at_once = max(1, SWEEP_MAX_ENTRIES // cube_size)
+    filtered_per_well = np.empty((len(threshold_vectors), well_count),
+                                 dtype=np.int64)
+    for first in range(0, well_count, wells_at_once):
+        last = min(first + wells_at_once, well_count)
+        start, end = offsets[first], offsets[last]
+        
+        flat_index = np.repeat(np.arange(last - first, dtype=np.int64),
+                               np.diff(offsets[first:last + 1]))
+        for j, thresholds in enumerate(sorted_thresholds):
+            rank = np.searchsorted(thresholds, values[j][start:end],
+                                   side="right")
+            flat_index = flat_index * cube_shape[j] + rank
+        
+        counts = np.bincount(flat_index,
+                             minlength=(last - first) * cube_size) \
+            .reshape((last - first,) + cube_shape)
+        del flat_index
+        # In place, so no copy of the counts is made per substance
+        for axis in range(1, counts.ndim):
+            reversed_counts = np.flip(counts, axis)
+            np.cumsum(reversed_counts, axis=axis, out=reversed_counts)
+        
+        filtered_per_well[:, first:last] = \
+            counts.reshape(last - first, cube_size)[:, flat_positions].T
+    return filtered_per_well
+
+
+def threshold_sweep_plates(well_names: list[str], totals: np.ndarray,
+                           filtered_per_well: np.ndarray
+                           ) -> tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    """
+    Places the counts of count_threshold_sweep on the plate, in the
+    format calculate_threshold_sweep returns.
+
+    Args:
+        well_names:
+        totals: The total count of each well
+        filtered_per_well: The counts in the shape
+            (sets of thresholds, wells)
+
+    Returns: See calculate_threshold_sweep
+
+    """
+    row_names, col_names, row_index, col_index = plate_positions(
+        list(well_names))
+    plate_shape = (len(row_names), len(col_names))
+    
+    total_plate = np.zeros(plate_shape, dtype=np.int64)
+    total_plate[row_index, col_index] = totals
+    filtered_counts = np.zeros((len(filtered_per_well),) + plate_shape,
+                               dtype=np.int64)
+    filtered_counts[:, row_index, col_index] = filtered_per_well
+    
+    percentages = np.zeros(filtered_counts.shape, dtype=np.float64)
+    np.divide(100 * filtered_counts, total_plate, out=percentages,
+              where=total_plate > 0)
+    
+    well_count_matrix = plate_to_matrix(total_plate, row_names, col_names)
+    return well_count_matrix, filtered_counts, percentages
+
+
+def threshold_range_size(start: float, stop: float, step: float) -> int:
+    """
+    The amount of thresholds in a range of threshold_grid.
+    
+    A ValueError is raised for a range that is empty, has no step,
+    or is not finite.
     
-    well_count_matrix_percent = calculate_well_count_percent(
-        well_count_matrix, filtered_well_count_matrix)
+    Args:
+        start:
+        stop: Inclusive
+        step:
+
+    Returns:
+
+    """
+    if not all(math.isfinite(i) for i in (start, stop, step)) \
+            or step <= 0 or stop < start:
+        raise ValueError("Invalid threshold range")
+    amount = (stop - start) / step + 1e-9
+    if not math.isfinite(amount):
+        raise ValueError("Invalid threshold range")
+    return int(math.floor(amount)) + 1
+
+
+def threshold_grid_size(ranges: list[tuple[float, float, float]]) -> int:
+    """
+    The amount of sets of thresholds threshold_grid gives for the
+    ranges, without creating them. This is the product of the sizes
+    of the ranges, so it is checked before creating the grid.
     
-    return (well_count_matrix, filtered_well_count_matrix,
-            well_count_matrix_percent)
+    Args:
+        ranges: See threshold_grid
+
+    Returns:
+
+    """
+    return math.prod(threshold_range_size(*r) for r in ranges)
+
+
+def threshold_grid(ranges: list[tuple[float, float, float]]
+                   ) -> list[list[float]]:
+    """
+    Creates every combination of thresholds from a range per substance,
+    to be used with calculate_threshold_sweep.
+
+    Example:
+        [(0, 1, 0.5), (2, 2, 1)] gives [[0, 2], [0.5, 2], [1, 2]]
+
+    Args:
+        ranges: Per substance the start, the inclusive stop and the step
+            of the thresholds
+
+    Returns: A list of sets of thresholds, the last substance
+        changes the fastest
+
+    """
+    axes = []
+    for start, stop, step in ranges:
+        amount = threshold_range_size(start, stop, step)
+        axes.append(np.round(start + step * np.arange(amount), 10))
+
+    grid = np.meshgrid(*axes, indexing="ij")
+    return np.stack([g.ravel() for g in grid], axis=1).tolist()
 
 
 def calculate_mean_across_each_well(dfs: list[pd.DataFrame]) -> pd.DataFrame:
@@ -166,19 +552,15 @@ def calculate_mean_across_each_well(dfs: list[pd.DataFrame]) -> pd.DataFrame:
     A   25  45
     B   25  45
     
+    The calculation is done by a PlateCube, use it directly to
+    calculate more than one statistic of the same matrices.
+    
     Args:
         dfs: A list of pandas Dataframes
 
     Returns: A pandas Dataframe
     """
-    mean_matrix = pd.DataFrame(0, index=dfs[0].index,
-                               columns=dfs[0].columns)
-    
-    for df in dfs:
-        mean_matrix += df
-    
-    mean_matrix /= len(dfs)
-    return mean_matrix
+    return PlateCube.from_matrices(dfs).mean()
     
 
 def calculate_standard_deviation_across_each_well(
@@ -196,20 +578,13 @@ def calculate_standard_deviation_across_each_well(
     if the size is smaller than 30, it will use the formula with
     n - 1
     
+    The calculation is done by a PlateCube, see PlateCube.std.
+    
     Args:
         dfs:
+        mean_df: The mean of each well, see calculate_mean_across_each_well
 
     Returns:
 
     """
-    std_matrix = pd.DataFrame(0, index=dfs[0].index,
-                              columns=dfs[0].columns)
-    
-    for df in dfs:
-        std_matrix += (df - mean_df) ** 2
-    
-    n = len(dfs)
-    if n < 30:
-        n = n - 1
-    std_matrix = (std_matrix / n) ** 0.5
-    return std_matrix
+    return PlateCube.from_matrices(dfs).std(mean_df)
@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def map_in_threads(function: Callable[[T], R], items: Iterable[T],
+                   max_workers: int) -> list[R]:
+    """
+    Calls the function on every item in a pool of at most max_workers
+    threads, and returns the results in the order of the items.
+
+    Threads are used instead of processes, as the heavy work on a file,
+    reading it and counting the cells with polars and numpy, releases
+    the GIL, and the items, such as model instances, do not need to be
+    sent to another process.
+
+    With max_workers 1, or a single item, the function is called in
+    the current thread. An exception in one of the calls is raised
+    again here.
+
+    Args:
+        function:
+        items:
+        max_workers: The most threads used at the same time
+
+    Returns:
+
+    """
+    items = list(items)
+    workers = min(max_workers, len(items))
+    if workers <= 1:
+        return [function(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=workers,
+                            thread_name_prefix="cellviewer") as pool:
+        return list(pool.map(function, items))
@@ -0,0 +1,100 @@
+import logging
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Stage:
+    """
+    A step of a pipeline.
+
+    is_done checks the result of the stage itself, for example if the
+    file it writes exists, instead of trusting the recorded state.
+    This makes running a pipeline again safe: stages that are done are
+    skipped and a stage that was interrupted is run again.
+
+    run receives the target and a dict shared by the stages of one
+    run, so a stage can pass on something expensive to load, such as
+    the parsed file.
+    """
+
+    def __init__(self, name: str, is_done: Callable[[Any], bool],
+                 run: Callable[[Any, dict], None]):
+        """
+        Args:
+            name: The name the state of the stage is recorded under
+            is_done: If the stage is done for the target
+            run: Runs the stage on the target, with the shared dict
+        """
+        self.name = name
+        self.is_done = is_done
+        self.run = run
+
+
+def run_stages(stages: list[Stage], target, state: dict,
+               save_state: Callable[[dict], None], force: bool = False
+               ) -> dict:
+    """
+    Runs the stages in order on the target, skipping the ones that are
+    already done, and records the state of each stage.
+
+    The state of a stage is a dict with the status, one of pending,
+    running, done or failed, the time it was last changed and for a
+    failed stage the error. It is saved with save_state every time
+    it changes.
+
+    When a stage fails, the stages after it are not run, as they may
+    depend on it. They are left pending, and the pipeline can be run
+    again later.
+
+    Args:
+        stages:
+        target: What the stages run on, for example a SavedFile
+        state: The recorded state, changed in place
+        save_state: Stores the state
+        force: Run every stage, even if it is done
+
+    Returns: The state
+
+    """
+    def record(name: str, status: str, error: str = None) -> None:
+        state[name] = {"status": status,
+                       "date": datetime.now(timezone.utc).isoformat()}
+        if error is not None:
+            state[name]["error"] = error
+        save_state(state)
+
+    context = {}
+    for i, stage in enumerate(stages):
+        if not force and stage.is_done(target):
+            if state.get(stage.name, {}).get("status") != DONE:
+                record(stage.name, DONE)
+            continue
+
+        record(stage.name, RUNNING)
+        try:
+            stage.run(target, context)
+        except Exception as e:
+            logger.exception("Stage %s failed", stage.name)
+            record(stage.name, FAILED, str(e) or type(e).__name__)
+            for later in stages[i + 1:]:
+                if state.get(later.name, {}).get("status") != DONE:
+                    state[later.name] = {"status": PENDING}
+            save_state(state)
+            break
+        record(stage.name, DONE)
+    return state
+
+
+def stages_done(stages: list[Stage], state: dict) -> bool:
+    """
+    If every stage is recorded as done in the state.
+    """
+    return all(state.get(stage.name, {}).get("status") == DONE
+               for stage in stages)
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+
+class PlateCube:
+    """
+    Many plates of the same dimension stacked in one numpy array, in the
+    shape (plates, rows, cols), with the row and col names of the plates.
+
+    Statistics across the plates, such as the mean of each well, are
+    then a single numpy reduction over the first axis, instead of
+    adding up pandas DataFrames one at a time.
+
+    The results are returned as a matrix in the same format as the
+    plates, see calculate_well_count_matrix.
+
+    A well that is missing from a plate is NaN for that plate. As with
+    adding up the DataFrames, any statistic of that well is NaN then,
+    except for count, which counts the plates that do have the well.
+    """
+
+    def __init__(self, values: np.ndarray, row_names: pd.Index,
+                 col_names: pd.Index, plate_names: list[str] = None):
+        """
+        Args:
+            values: The values in the shape (plates, rows, cols)
+            row_names:
+            col_names:
+            plate_names: A name for each plate, for example the job name
+        """
+        self.values = values
+        self.row_names = row_names
+        self.col_names = col_names
+        self.plate_names = plate_names
+
+    @classmethod
+    def from_matrices(cls, matrices: list[pd.DataFrame],
+                      plate_names: list[str] = None) -> "PlateCube":
+        """
+        Stacks the matrices. The wells are matched on their row and
+        col names, using the names of the first matrix.
+
+        Args:
+            matrices:
+            plate_names:
+
+        Returns:
+
+        """
+        if len(matrices) == 0:
+            raise ValueError("A PlateCube needs at least one plate")
+        row_names, col_names = matrices[0].index, matrices[0].columns
+
+        values = np.empty((len(matrices), len(row_names), len(col_names)),
+                          dtype=np.float64)
+        for i, matrix in enumerate(matrices):
+            if not (matrix.index.equals(row_names) and
+                    matrix.columns.equals(col_names)):
+                matrix = matrix.reindex(index=row_names, columns=col_names)
+            values[i] = matrix.to_numpy(dtype=np.float64)
+        return cls(values, row_names, col_names, plate_names)
+
+    def __len__(self) -> int:
+        return self.values.shape[0]
+
+    def to_matrix(self, plate: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(plate, index=self.row_names,
+                            columns=self.col_names)
+
+    def plate(self, i: int) -> pd.DataFrame:
+        return self.to_matrix(self.values[i])
+
+    def count(self) -> pd.DataFrame:
+        """
+        The amount of plates that have a value for each well.
+        """
+        return self.to_matrix(
+            np.count_nonzero(~np.isnan(self.values), axis=0))
+
+    def mean(self) -> pd.DataFrame:
+        return self.to_matrix(self.values.mean(axis=0))
+
+    def std(self, mean: pd.DataFrame = None, ddof: int = None
+            ) -> pd.DataFrame:
+        """
+        The standard deviation of each well.
+
+        By default, with less than 30 plates the sample standard
+        deviation is used, dividing by n - 1, and with 30 or more the
+        population standard deviation, dividing by n.
+
+        Args:
+            mean: The mean of each well, calculated if None
+            ddof: Divide by n - ddof instead of the default
+
+        Returns:
+
+        """
+        n = len(self)
+        if ddof is None:
+            ddof = 1 if n < 30 else 0
+
+        mean = self.values.mean(axis=0) if mean is None \
+            else mean.reindex(index=self.row_names,
+                              columns=self.col_names).to_numpy(np.float64)
+        squared = ((self.values - mean) ** 2).sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.to_matrix((squared / (n - ddof)) ** 0.5)
+
+    def median(self) -> pd.DataFrame:
+        return self.to_matrix(np.median(self.values, axis=0))
+
+    def quantile(self, q: float) -> pd.DataFrame:
+        """
+        Args:
+            q: The quantile, between 0 and 1
+
+        Returns:
+
+        """
+        return self.to_matrix(np.quantile(self.values, q, axis=0))
+
+    def min(self) -> pd.DataFrame:
+        return self.to_matrix(self.values.min(axis=0))
+
+    def max(self) -> pd.DataFrame:
+        return self.to_matrix(self.values.max(axis=0))
@@ -2,23 +2,72 @@ from pathlib import Path
 from io import StringIO
 
 import numpy as np
-import plotly.express as px
 from plotly import graph_objects as go
 
+from apps.cellviewer.util.substance_histograms import histogram_bins
 
-def create_hist(df, selected_column):
+
+def figure_to_html(figure: go.Figure) -> str:
+    """
+    The html to place a figure in a page, a div with the script that
+    draws the figure in it.
+    
+    plotly.js itself is not included, it is loaded once on every page,
+    see templates/includes/head.html. Including it would add a few MB
+    to every figure.
+    
+    Args:
+        figure:
+
+    Returns:
+
+    """
+    return figure.to_html(full_html=False, include_plotlyjs=False)
+
+
+def create_hist(df, selected_column, bins: tuple[np.ndarray, float] = None):
     """
     Creates a histogram, from 0 to the max value that appears in
     the data.
+    
+    The values are counted in HISTOGRAM_BINS bins on the server, and
+    drawn as a bar per bin. This way the figure only contains the
+    counts of the bins, and not the value of every cell, which
+    for large files would make the page tens of MB.
+    
+    Args:
+        df: The DataFrame, only used if the bins are not passed
+        selected_column: The substance
+        bins: The result of histogram_bins for the substance,
+            for example from the SubstanceHistograms of a SavedFile.
+            Counted from df if None.
+
+    Returns:
+        The figure, and the max value
     """
-    max_value = df[selected_column].max()
-    hist = px.histogram(df,
-                        range_x=[0, max_value],
-                        x=selected_column,
-                        title=f'Histogram of {selected_column}',
-                        nbins=400)
+    if bins is None:
+        bins = histogram_bins(df[selected_column])
+    counts, max_value = bins
+    
+    bin_width = (max_value or 1) / len(counts)
+    left_edges = np.arange(len(counts)) * bin_width
+    
+    hist = go.Figure(data=go.Bar(
+        x=left_edges + bin_width / 2,
+        y=counts,
+        width=bin_width,
+        customdata=np.column_stack([left_edges, left_edges + bin_width]),
+        hovertemplate="%{customdata[0]:.4g} - %{customdata[1]:.4g}"
+                      "<br>count: %{y}<extra></extra>",
+        marker_line_width=0,
+    ))
     
     hist.update_layout(
+        title=f'Histogram of {selected_column}',
+        xaxis_title=selected_column,
+        yaxis_title="count",
+        xaxis_range=[0, max_value],
+        bargap=0,
         margin=dict(
             t=30,  # top margin
             b=10,  # bottom margin
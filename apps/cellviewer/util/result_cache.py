@@ -0,0 +1,153 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from django.core.cache import caches
+
+from apps.cellviewer.util.matrix_functions import \
+    plates_to_well_counts_and_percent
+
+RESULT_CACHE_ALIAS = "analysis_results"
+LOCAL_RESULTS_LIMIT = 256
+
+WellCounts = tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
+
+
+class WellCountsCache:
+    """
+    Remembers the well counts, filtered well counts and percentages of
+    a file for a set of thresholds, the result of
+    calculate_well_counts_and_percent.
+
+    The same file with the same thresholds is calculated every time a
+    saved job, or an aggregation containing it, is opened. The result
+    only depends on the content of the file and the thresholds, so it
+    is stored under the hash of the file and the thresholds.
+
+    There are two tiers. The most recently used results are kept in
+    memory in this process, up to local_limit. Behind that is a Django
+    cache, by default the RESULT_CACHE_ALIAS cache, which is shared
+    between the workers and kept when the server restarts.
+
+    A result is stored compactly, as the row and col names with the
+    total and positive counts as int32 arrays. The percentages are
+    calculated again when a result is used.
+
+    The hit and miss counters are per process, see stats.
+    """
+
+    def __init__(self, local_limit: int = LOCAL_RESULTS_LIMIT,
+                 shared=None, timeout: int | None = None):
+        """
+        Args:
+            local_limit: The amount of results kept in memory
+            shared: The Django cache behind the local tier,
+                the RESULT_CACHE_ALIAS cache if None
+            timeout: The timeout in the shared cache in seconds,
+                the default of that cache if None
+        """
+        self.local_limit = local_limit
+        self._shared = shared
+        self.timeout = timeout
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        if self._shared is None:
+            self._shared = caches[RESULT_CACHE_ALIAS]
+        return self._shared
+
+    @staticmethod
+    def key(file_hash: str, substance_thresholds: list[float]) -> str:
+        thresholds = ";".join(repr(float(i)) for i in substance_thresholds)
+        digest = hashlib.sha256(
+            f"{file_hash}:{thresholds}".encode()).hexdigest()
+        return f"well_counts:{digest}"
+
+    def get_or_calculate(self, file_hash: str,
+                         substance_thresholds: list[float],
+                         calculate: Callable[[], WellCounts]) -> WellCounts:
+        """
+        Returns the cached result, or calculates and stores it if it
+        is not in either tier.
+
+        Every call returns new DataFrames, so a caller changing them
+        does not change the cached result.
+
+        Args:
+            file_hash: The hash of the file, see SavedFile.hash
+            substance_thresholds:
+            calculate: Calculates the result if it is not cached,
+                called without arguments
+
+        Returns: The well counts, filtered well counts and percentages
+
+        """
+        key = self.key(file_hash, substance_thresholds)
+
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is not None:
+                self.local.move_to_end(key)
+                self.local_hits += 1
+        if entry is not None:
+            return expand_well_counts(entry)
+
+        entry = self.shared.get(key)
+        if entry is not None:
+            with self.lock:
+                self.shared_hits += 1
+        else:
+            entry = compact_well_counts(calculate())
+            self.shared.set(key, entry, self.timeout)
+            with self.lock:
+                self.misses += 1
+
+        self._remember(key, entry)
+        return expand_well_counts(entry)
+
+    def _remember(self, key: str, entry: tuple) -> None:
+        with self.lock:
+            self.local[key] = entry
+            self.local.move_to_end(key)
+            while len(self.local) > self.local_limit:
+                self.local.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            requests = self.local_hits + self.shared_hits + self.misses
+            return {
+                "local_hits": self.local_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.local_hits + self.shared_hits) / requests
+                if requests else None,
+                "local_entries": len(self.local),
+                "local_limit": self.local_limit,
+            }
+
+
+def compact_well_counts(well_counts: WellCounts) -> tuple:
+    well_count_matrix, filtered_well_count_matrix, _ = well_counts
+    return (list(well_count_matrix.index),
+            list(well_count_matrix.columns),
+            well_count_matrix.to_numpy().astype(np.int32),
+            filtered_well_count_matrix.to_numpy().astype(np.int32))
+
+
+def expand_well_counts(entry: tuple) -> WellCounts:
+    row_names, col_names, total_plate, positive_plate = entry
+    return plates_to_well_counts_and_percent(
+        total_plate.astype(np.int64), positive_plate.astype(np.int64),
+        row_names, col_names)
+
+
+well_counts_cache = WellCountsCache()
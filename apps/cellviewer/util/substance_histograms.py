@@ -0,0 +1,108 @@
+import os
+import uuid
+
+import numpy as np
+import polars as pl
+
+SUBSTANCE_HISTOGRAMS_EXTENSION = ".hist.npz"
+HISTOGRAM_BINS = 400
+
+
+def substance_histograms_path(file_path: str) -> str:
+    """
+    The path of the substance histograms belonging to a file.
+    They are stored next to the original file.
+    """
+    return f"{file_path}{SUBSTANCE_HISTOGRAMS_EXTENSION}"
+
+
+def histogram_bins(values: pl.Series, bins: int = HISTOGRAM_BINS
+                   ) -> tuple[np.ndarray, float]:
+    """
+    Counts the values in bins evenly spaced from 0 to the highest value.
+    A value on the edge between two bins is counted in the upper bin,
+    except for the highest value, which is counted in the last bin.
+    If the highest value is 0, every value is counted in the first bin.
+
+    Args:
+        values: The values of a single substance
+        bins:
+
+    Returns:
+        The amount of values in every bin.
+        The highest value, which is the right edge of the last bin.
+    """
+    max_value = values.max()
+    if max_value is None or max_value <= 0:
+        counts = np.zeros(bins, dtype=np.int64)
+        counts[0] = len(values)
+        return counts, max_value or 0
+
+    edges = np.linspace(0, max_value, bins + 1)
+    bin_index = np.searchsorted(edges, values.cast(pl.Float64).to_numpy(),
+                                side="right") - 1
+    counts = np.bincount(np.clip(bin_index, 0, bins - 1), minlength=bins)
+    return counts.astype(np.int64), max_value
+
+
+class SubstanceHistograms:
+    """
+    The binned value distribution of every substance of a file.
+
+    Drawing a histogram from the bin counts, instead of from the cell
+    values, keeps the figure at the size of the amount of bins,
+    no matter how many cells there are. Saved files keep these next to
+    the file, so they are only counted once.
+    """
+
+    def __init__(self, substances: list[str], counts: np.ndarray,
+                 max_values: np.ndarray):
+        """
+        Args:
+            substances: The substance names
+            counts: The bin counts in the shape (substances, bins)
+            max_values: The highest value of every substance
+        """
+        self.substances = list(substances)
+        self.counts = counts
+        self.max_values = max_values
+
+    @classmethod
+    def from_dataframe(cls, df: pl.DataFrame, bins: int = HISTOGRAM_BINS
+                       ) -> "SubstanceHistograms":
+        substances = df.columns[3:]
+        counts = np.zeros((len(substances), bins), dtype=np.int64)
+        max_values = np.zeros(len(substances), dtype=np.float64)
+        for i, substance in enumerate(substances):
+            counts[i], max_values[i] = histogram_bins(df[substance], bins)
+        return cls(substances, counts, max_values)
+
+    def save(self, path: str) -> None:
+        """
+        Writes the histograms as an npz file, through a temporary
+        file with a unique name which is moved in place, so writers of
+        the same histograms each move their own complete file in place.
+        """
+        temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temporary_path, "wb") as f:
+                np.savez(f, substances=np.array(self.substances, dtype=str),
+                         counts=self.counts, max_values=self.max_values)
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    @classmethod
+    def load(cls, path: str) -> "SubstanceHistograms":
+        with np.load(path) as data:
+            return cls(data["substances"].tolist(), data["counts"],
+                       data["max_values"])
+
+    def __getitem__(self, substance: str) -> tuple[np.ndarray, float]:
+        """
+        The bin counts and highest value of a substance,
+        in the same form as histogram_bins.
+        """
+        i = self.substances.index(substance)
+        return self.counts[i], float(self.max_values[i])
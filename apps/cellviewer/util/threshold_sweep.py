@@ -0,0 +1,47 @@
+from apps.cellviewer.util.matrix_functions import threshold_grid, \
+    threshold_grid_size
+
+MAX_SWEEP_THRESHOLDS = 10_000
+
+
+def parse_sweep_thresholds(query) -> list[list[float]]:
+    """
+    Reads the sets of thresholds of a sweep from the query parameters.
+
+    It is either a list of sets of thresholds, each in the same format
+    as the stored substance thresholds:
+        ?thresholds=1;2&thresholds=1.5;2
+    or a range per substance, as start:stop:step with an inclusive stop,
+    of which every combination is used:
+        ?range=0:5:0.5&range=1:2:0.25
+
+    A ValueError is raised on invalid input.
+
+    Args:
+        query: request.GET
+
+    Returns: A list of sets of thresholds
+
+    """
+    if query.getlist("range"):
+        ranges = []
+        for substance_range in query.getlist("range"):
+            parts = substance_range.split(":")
+            if len(parts) != 3:
+                raise ValueError("A range is written as start:stop:step")
+            ranges.append(tuple(float(i) for i in parts))
+        # The size is checked before the grid is created, the grid of
+        # a few long ranges does not fit in memory
+        if threshold_grid_size(ranges) > MAX_SWEEP_THRESHOLDS:
+            raise ValueError("Too many thresholds in the sweep")
+        vectors = threshold_grid(ranges)
+    else:
+        vectors = query.getlist("thresholds")
+        if len(vectors) > MAX_SWEEP_THRESHOLDS:
+            raise ValueError("Too many thresholds in the sweep")
+        vectors = [[float(i) if i else 0 for i in vector.split(";")]
+                   for vector in vectors]
+
+    if len(vectors) == 0:
+        raise ValueError("No thresholds were given")
+    return vectors
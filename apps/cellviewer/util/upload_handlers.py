@@ -0,0 +1,49 @@
+import hashlib
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+from apps.cellviewer.util.file_validation import CellFileValidator
+
+INGEST_UPLOAD_FIELDS = ("inputData",)
+
+
+class IngestingUploadHandler(TemporaryFileUploadHandler):
+    """
+    Handles the upload of input files while the request body is still
+    coming in.
+
+    Every chunk that is received is added to the sha256 hash, fed to the
+    CellFileValidator, and written to a temporary file on disk instead
+    of being kept in memory. When the upload has finished the hash and
+    the validation result are already known, and are attached to the
+    uploaded file. ingest_file then uses them instead of reading the file
+    again.
+
+    Only the fields in INGEST_UPLOAD_FIELDS are handled, any other
+    file is passed on to the next upload handler in
+    FILE_UPLOAD_HANDLERS, so this handler must be placed first.
+    """
+
+    def new_file(self, field_name, *args, **kwargs):
+        self.ingesting = field_name in INGEST_UPLOAD_FIELDS
+        if not self.ingesting:
+            return
+        super().new_file(field_name, *args, **kwargs)
+        self.sha256 = hashlib.sha256()
+        self.validator = CellFileValidator()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.ingesting:
+            return raw_data
+        self.sha256.update(raw_data)
+        self.validator.feed(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if not self.ingesting:
+            return None
+        self.validator.finish()
+        file = super().file_complete(file_size)
+        file.sha256 = self.sha256.hexdigest()
+        file.validator = self.validator
+        return file
@@ -0,0 +1,113 @@
+import os
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.uploadedfile import UploadedFile
+
+SPOOL_DIRECTORY = "uploads"
+SPOOLED_NAME_LENGTH = 32
+
+
+def _spool_directory() -> Path:
+    return Path(settings.MEDIA_ROOT) / SPOOL_DIRECTORY
+
+
+def _spooled_path(spooled_name: str) -> Path:
+    """
+    The path of a spooled upload. The name is stored in the arguments
+    of a task, so it is checked before it is used to build a path.
+    """
+    if len(spooled_name) != SPOOLED_NAME_LENGTH or \
+            any(c not in "0123456789abcdef" for c in spooled_name):
+        raise ValueError("Not a spooled upload")
+    return _spool_directory() / spooled_name
+
+
+def spool_upload(file: UploadedFile) -> str:
+    """
+    Keeps an uploaded file after the request that uploaded it has
+    ended, so a background task can save it, see save_job.
+
+    An upload written to a temporary file is moved, which on the same
+    disk does not copy anything. Other uploads are written in chunks.
+
+    As a task that never ran leaves its upload behind, spooling an
+    upload also removes the uploads older than BACKGROUND_TASK_TIMEOUT,
+    the tasks these belong to have failed by then.
+
+    Args:
+        file: One of the files in request.FILES
+
+    Returns: The name to open the upload with, see open_spooled_upload
+
+    """
+    reap_spooled_uploads()
+
+    spooled_name = uuid.uuid4().hex
+    path = _spooled_path(spooled_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    if hasattr(file, "temporary_file_path"):
+        file_move_safe(file.temporary_file_path(), str(path))
+    else:
+        with open(path, "wb") as destination:
+            for chunk in file.chunks():
+                destination.write(chunk)
+    return spooled_name
+
+
+def open_spooled_upload(spooled_name: str, file_name: str) -> File:
+    """
+    Opens a spooled upload, to be used in place of the uploaded file.
+    The file has the name it was uploaded with, and can be read by
+    polars from its path, in the same way as a temporary upload.
+
+    Args:
+        spooled_name: See spool_upload
+        file_name: The name the file was uploaded with
+
+    Returns:
+
+    """
+    path = _spooled_path(spooled_name)
+    file = File(open(path, "rb"), name=file_name)
+    file.temporary_file_path = lambda: str(path)
+    return file
+
+
+def remove_spooled_upload(spooled_name: str) -> None:
+    _spooled_path(spooled_name).unlink(missing_ok=True)
+
+
+def reap_spooled_uploads(ttl: int | float = None) -> int:
+    """
+    Removes the spooled uploads older than the ttl in seconds,
+    BACKGROUND_TASK_TIMEOUT if no ttl is passed.
+
+    Args:
+        ttl: The time to live in seconds
+
+    Returns: The amount of removed uploads
+
+    """
+    if ttl is None:
+        ttl = settings.BACKGROUND_TASK_TIMEOUT
+
+    spool_directory = _spool_directory()
+    if not spool_directory.is_dir():
+        return 0
+
+    expire_before = time.time() - ttl
+    removed = 0
+    for path in spool_directory.iterdir():
+        try:
+            if path.stat().st_mtime < expire_before:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
@@ -0,0 +1,211 @@
+import os
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from apps.cellviewer.util.matrix_functions import well_counts_to_matrix, \
+    calculate_well_count_percent
+from apps.cellviewer.util.well_index import sorted_well_codes
+
+WELL_CUBE_EXTENSION = ".cube.npz"
+
+
+def well_cube_path(file_path: str) -> str:
+    """
+    The path of the well histogram cube belonging to a file.
+    The cube is stored next to the original file.
+    """
+    return f"{file_path}{WELL_CUBE_EXTENSION}"
+
+
+class WellHistogramCube:
+    """
+    A per well cumulative histogram over all substances at once.
+
+    Every substance is divided into bins, with the bin edges evenly spaced
+    from 0 to the highest value of that substance. For every well the
+    cube holds, for each combination of bin edges, the amount of cells
+    that are at or above all of those edges.
+    Looking up the filtered well counts for a set of thresholds is then
+    a single lookup per well, independent of the amount of cells.
+
+    It is only exact when the thresholds are on the bin edges, any
+    other threshold is rounded down to the edge below it. It is meant
+    to quickly preview the heatmaps while moving a slider, the exact
+    counts come from the WellThresholdIndex or the DataFrame.
+
+    The amount of bins is chosen so the cube never has more than
+    MAX_ENTRIES counts, so with more substances or more wells there
+    are less bins per substance. This keeps every cube at most a few
+    MB, small enough to keep the cubes of all recently used jobs in
+    memory, see load_cached.
+    """
+
+    MAX_BINS = 400
+    MAX_ENTRIES = 1_000_000
+
+    def __init__(self, wells: np.ndarray, edges: list[np.ndarray],
+                 cube: np.ndarray):
+        """
+        Args:
+            wells: The well names, sorted
+            edges: The bin edges of each substance, starting at 0
+            cube: The cumulative counts in the shape
+                (wells, bins + 1, bins + 1, ...). Index 0 along an axis
+                holds all cells, index i the cells at or above edge i - 1.
+        """
+        self.wells = wells
+        self.edges = edges
+        self.cube = cube
+
+    @classmethod
+    def bins_for(cls, well_count: int, substance_count: int) -> int:
+        per_axis = (cls.MAX_ENTRIES / max(well_count, 1)) ** (
+            1 / max(substance_count, 1))
+        return int(max(1, min(cls.MAX_BINS, np.floor(per_axis) - 1)))
+
+    @classmethod
+    def from_dataframe(cls, df: pl.DataFrame) -> "WellHistogramCube":
+        substances = df.columns[3:]
+
+        wells, well_codes = sorted_well_codes(df)
+
+        bins = cls.bins_for(len(wells), len(substances))
+        axis_size = bins + 1
+
+        flat_index = well_codes.astype(np.int64)
+        edges = []
+        for substance in substances:
+            values = df[substance].cast(pl.Float32).fill_nan(None) \
+                .fill_null(float("-inf")).to_numpy()
+            substance_edges = np.linspace(
+                0, max(float(values.max(initial=0)), 0), bins,
+                dtype=np.float32)
+            # the amount of edges at or below the value, 0 is below them all
+            bin_index = np.searchsorted(substance_edges, values, side="right")
+            flat_index = flat_index * axis_size + bin_index
+            edges.append(substance_edges)
+
+        shape = (len(wells),) + (axis_size,) * len(substances)
+        cube = np.bincount(flat_index, minlength=int(np.prod(shape))) \
+            .reshape(shape)
+        for axis in range(1, cube.ndim):
+            cube = np.flip(np.cumsum(np.flip(cube, axis), axis=axis), axis)
+
+        return cls(wells, edges, cube.astype(np.int32))
+
+    def save(self, path: str) -> None:
+        """
+        Writes the cube as an uncompressed npz file, through a temporary
+        file with a unique name which is moved in place, so writers of
+        the same cube each move their own complete file in place.
+        """
+        temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temporary_path, "wb") as f:
+                np.savez(f, wells=self.wells.astype(str), cube=self.cube,
+                         **{f"edges_{i}": e for i, e in enumerate(self.edges)})
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The memory the arrays of the cube take, see load_cached.
+        """
+        return self.wells.nbytes + self.cube.nbytes \
+            + sum(e.nbytes for e in self.edges)
+
+    @classmethod
+    def load(cls, path: str) -> "WellHistogramCube":
+        with np.load(path) as data:
+            edges = [data[f"edges_{i}"] for i in range(data["cube"].ndim - 1)]
+            return cls(data["wells"], edges, data["cube"])
+
+    def positive_counts(self, substance_thresholds: list[float]) -> np.ndarray:
+        """
+        Looks up per well the cells with all substances at or above their
+        threshold, with the thresholds rounded down to a bin edge.
+
+        Args:
+            substance_thresholds:
+
+        Returns: The counts in the order of self.wells
+
+        """
+        if len(substance_thresholds) > len(self.edges):
+            raise IndexError("More thresholds than substances")
+        if not any(t != 0 for t in substance_thresholds):
+            return self.total_counts()
+
+        position = [slice(None)]
+        for substance_edges, threshold in zip(self.edges,
+                                              substance_thresholds):
+            position.append(int(np.searchsorted(
+                substance_edges, np.float32(threshold), side="right")))
+        position += [0] * (len(self.edges) + 1 - len(position))
+        return self.cube[tuple(position)]
+
+    def total_counts(self) -> np.ndarray:
+        return self.cube[(slice(None),) + (0,) * len(self.edges)]
+
+    def well_counts_and_percent(self, substance_thresholds: list[float]) \
+            -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """
+        The cube equivalent of calculate_well_counts_and_percent,
+        returning the matrices in the same format.
+        """
+        well_count_matrix = well_counts_to_matrix(self.wells,
+                                                  self.total_counts())
+        filtered_well_count_matrix = well_counts_to_matrix(
+            self.wells, self.positive_counts(substance_thresholds))
+        well_count_matrix_percent = calculate_well_count_percent(
+            well_count_matrix, filtered_well_count_matrix)
+
+        return (well_count_matrix, filtered_well_count_matrix,
+                well_count_matrix_percent)
+
+
+_loaded_cubes: OrderedDict = OrderedDict()
+# The cubes are kept per process, so every gunicorn worker
+# can hold this much.
+LOADED_CUBES_MAX_BYTES = 64 * 2 ** 20
+
+
+def load_cached(path: str) -> WellHistogramCube:
+    """
+    Loads a cube, keeping the most recently used cubes of this process
+    in memory. A preview is requested many times per second while a
+    slider moves, so the cube should not be read from disk every time.
+
+    The least recently used cubes are dropped once the cubes together
+    take more than LOADED_CUBES_MAX_BYTES. A cube can take a few MB,
+    so the amount of cubes alone says little about the memory used.
+
+    The modification time is part of the key, so a rebuilt cube
+    is loaded again.
+
+    Args:
+        path:
+
+    Returns:
+
+    """
+    key = (path, os.stat(path).st_mtime_ns)
+    if key in _loaded_cubes:
+        _loaded_cubes.move_to_end(key)
+        return _loaded_cubes[key]
+
+    cube = WellHistogramCube.load(path)
+    _loaded_cubes[key] = cube
+    loaded_bytes = sum(c.nbytes for c in _loaded_cubes.values())
+    # The cube just loaded is kept, even if it is over the limit alone
+    while loaded_bytes > LOADED_CUBES_MAX_BYTES and len(_loaded_cubes) > 1:
+        _, dropped = _loaded_cubes.popitem(last=False)
+        loaded_bytes -= dropped.nbytes
+    return cube
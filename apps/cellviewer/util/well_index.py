@@ -0,0 +1,344 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from apps.cellviewer.util.matrix_functions import well_counts_to_matrix, \
+    calculate_well_count_percent, count_threshold_sweep, \
+    threshold_sweep_plates
+
+WELL_INDEX_EXTENSION = ".index"
+
+
+def well_index_path(file_path: str) -> str:
+    """
+    The path of the well index directory belonging to a file.
+    The index is stored next to the original file.
+    """
+    return f"{file_path}{WELL_INDEX_EXTENSION}"
+
+
+def sorted_well_codes(df: pl.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Numbers the wells of a file in sorted order, the same order in which
+    calculate_well_count_matrix places them.
+
+    Converting millions of well names to numpy strings is slow, so only
+    the few hundred different names are sorted, through a categorical.
+
+    Args:
+        df:
+
+    Returns: The sorted well names, and for every cell the number
+        of its well
+
+    """
+    well_column = df["Well"].cast(pl.String).cast(pl.Categorical)
+    categories = well_column.cat.get_categories().to_numpy().astype(str)
+    category_order = np.argsort(categories)
+    category_rank = np.empty_like(category_order)
+    category_rank[category_order] = np.arange(len(categories))
+    return (categories[category_order],
+            category_rank[well_column.to_physical().to_numpy()])
+
+
+class WellThresholdIndex:
+    """
+    A precomputed index of a file, which counts the cells above the
+    substance thresholds per well without scanning all cells.
+
+    The cells are grouped per well, and within a well sorted on the
+    first substance. The amount of cells with the first substance above
+    a threshold is then found through a binary search.
+
+    For the second substance a merge sort tree is kept. Level 0 holds the
+    second substance values sorted within blocks of LEAF_SIZE cells,
+    every next level within blocks twice as large.
+    The cells above the first threshold are a suffix of the well,
+    which is covered by O(log n) of these sorted blocks, each
+    counted through a binary search. Together this is a dominance count,
+    costing O(wells * log(cells)^2) instead of a scan over all cells.
+
+    A third or further substance is not part of the tree, for those the
+    cells above the first threshold are checked directly. This is still
+    a lot less than the full file with any meaningful first threshold.
+
+    Everything is stored as separate .npy files in a directory, which
+    are memory mapped when loaded. A query only reads the few pages it
+    needs from disk.
+
+    The thresholds behave the same as filtered_polars_dataframe,
+    they are inclusive, they apply to the first n substances, and if
+    all thresholds are zero no filtering is done at all.
+    """
+
+    LEAF_SIZE = 256
+
+    def __init__(self, wells: np.ndarray, offsets: np.ndarray,
+                 values: np.ndarray, levels: np.ndarray,
+                 substances: list[str], amount_of_sites: int):
+        """
+        Args:
+            wells: The well names, sorted
+            offsets: The start of each well in values, with the end
+                of the last well appended
+            values: The values in the shape (substances, cells), per well
+                sorted on the first substance
+            levels: The merge sort tree on the second substance, in the
+                shape (levels, cells)
+            substances: The substance names
+            amount_of_sites: The highest site number
+        """
+        self.wells = wells
+        self.offsets = offsets
+        self.values = values
+        self.levels = levels
+        self.substances = substances
+        self.amount_of_sites = amount_of_sites
+
+    @classmethod
+    def from_dataframe(cls, df: pl.DataFrame) -> "WellThresholdIndex":
+        """
+        Builds the index of a parsed input file.
+
+        Sorting millions of cells on multiple keys is slow, so every
+        sort is done on a single integer key instead. The key combines
+        the group, the well or block, in the high bits with the rank
+        of the value in the low bits.
+        Missing values can never be above a threshold, so they are
+        stored as -inf.
+        """
+        substances = df.columns[3:]
+
+        wells, well_codes = sorted_well_codes(df)
+
+        values = df.select(substances).to_numpy().astype(np.float32).T
+        values = np.nan_to_num(values, nan=-np.inf)
+
+        order = cls._argsort(cls._group_key(well_codes, values[0]))
+        values = np.ascontiguousarray(values[:, order])
+
+        well_sizes = np.bincount(well_codes, minlength=len(wells))
+        offsets = np.zeros(len(wells) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(well_sizes)
+
+        levels = np.empty((0, values.shape[1]), dtype=np.float32)
+        if len(substances) >= 2:
+            levels = cls._build_levels(values[1], offsets)
+
+        return cls(wells, offsets, values, levels, list(substances),
+                   int(df["Site"].max()))
+
+    @staticmethod
+    def _argsort(values: np.ndarray) -> np.ndarray:
+        """
+        Polars sorts using multiple threads, which for millions of
+        values is a lot faster than numpy.
+        """
+        return pl.Series(values).arg_sort().to_numpy()
+
+    @staticmethod
+    def _group_key(groups: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """
+        A single int64 key which sorts on the groups first, and
+        on the values within a group.
+        """
+        order = WellThresholdIndex._argsort(values)
+        ranks = np.empty(len(values), dtype=np.int64)
+        ranks[order] = np.arange(len(values))
+        shift = max(int(len(values)).bit_length(), 1)
+        return (groups.astype(np.int64) << shift) | ranks
+
+    @classmethod
+    def _build_levels(cls, second_values: np.ndarray,
+                      offsets: np.ndarray) -> np.ndarray:
+        """
+        Builds the merge sort tree. Blocks start at the beginning of
+        each well, the last block of a well is cut off at the end
+        of the well.
+        """
+        well_sizes = np.diff(offsets)
+        well_codes = np.repeat(np.arange(len(well_sizes)), well_sizes)
+        position_in_well = np.arange(offsets[-1]) - offsets[well_codes]
+        largest_well = int(well_sizes.max(initial=0))
+
+        ranks = cls._group_key(np.zeros(len(second_values), dtype=np.int64),
+                               second_values)
+        sorted_values = np.sort(second_values)
+        shift = max(int(len(second_values)).bit_length(), 1)
+
+        # Every level merges two sorted blocks of the level before it.
+        # The stable sort finds these sorted runs, making it a merge.
+        mask = (1 << shift) - 1
+        keys = ranks & mask
+        levels = []
+        block_size = cls.LEAF_SIZE
+        while True:
+            blocks = well_codes * (largest_well // block_size + 1) \
+                + position_in_well // block_size
+            keys = np.sort((blocks << shift) | (keys & mask), kind="stable")
+            levels.append(sorted_values[keys & mask])
+            if block_size >= largest_well:
+                break
+            block_size *= 2
+        return np.stack(levels)
+
+    def save(self, path: str) -> None:
+        """
+        Writes the index as a directory. It is written to a temporary
+        directory with a unique name first which is then moved in
+        place, so writers of the same index do not write into each
+        other's directory.
+        
+        An existing index is moved aside before, a directory can only
+        be replaced when it is empty. If another writer moved its index
+        in place in between, that index is kept, it holds the same.
+        """
+        temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        old_path = f"{path}.{uuid.uuid4().hex}.old"
+        os.makedirs(temporary_path)
+        try:
+            np.save(os.path.join(temporary_path, "wells.npy"),
+                    self.wells.astype(str))
+            np.save(os.path.join(temporary_path, "offsets.npy"), self.offsets)
+            np.save(os.path.join(temporary_path, "values.npy"), self.values)
+            np.save(os.path.join(temporary_path, "levels.npy"), self.levels)
+            with open(os.path.join(temporary_path, "meta.json"), "w") as f:
+                json.dump({"substances": self.substances,
+                           "amount_of_sites": self.amount_of_sites,
+                           "leaf_size": self.LEAF_SIZE}, f)
+
+            try:
+                os.replace(path, old_path)
+            except FileNotFoundError:
+                pass
+            try:
+                os.replace(temporary_path, path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+        finally:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str) -> "WellThresholdIndex":
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["leaf_size"] != cls.LEAF_SIZE:
+            raise ValueError("The index was built with a different leaf size")
+
+        return cls(
+            np.load(os.path.join(path, "wells.npy")),
+            np.load(os.path.join(path, "offsets.npy")),
+            np.load(os.path.join(path, "values.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "levels.npy"), mmap_mode="r"),
+            meta["substances"],
+            meta["amount_of_sites"],
+        )
+
+    def total_counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def positive_counts(self, substance_thresholds: list[float]) -> np.ndarray:
+        """
+        Counts per well the cells with all substances at or above their
+        threshold.
+
+        Args:
+            substance_thresholds:
+
+        Returns: The counts in the order of self.wells
+
+        """
+        thresholds = np.asarray(substance_thresholds, dtype=np.float32)
+        if not np.any(thresholds != 0):
+            return self.total_counts()
+        if len(thresholds) > len(self.substances):
+            raise IndexError("More thresholds than substances")
+
+        counts = np.empty(len(self.wells), dtype=np.int64)
+        for well, (start, end) in enumerate(zip(self.offsets[:-1],
+                                                self.offsets[1:])):
+            suffix_start = start + int(np.searchsorted(
+                self.values[0, start:end], thresholds[0], side="left"))
+
+            if len(thresholds) == 1:
+                counts[well] = end - suffix_start
+            elif len(thresholds) == 2:
+                counts[well] = self._count_suffix_at_least(
+                    start, end, suffix_start, thresholds[1])
+            else:
+                above = self.values[1:len(thresholds), suffix_start:end] \
+                    >= thresholds[1:, None]
+                counts[well] = np.count_nonzero(above.all(axis=0))
+        return counts
+
+    def _count_suffix_at_least(self, start: int, end: int,
+                               suffix_start: int, threshold) -> int:
+        """
+        Counts the cells between suffix_start and the end of the well
+        with the second substance at or above the threshold, using the
+        merge sort tree.
+
+        Every step takes the largest sorted block that starts at the
+        current position, so the suffix is covered in O(log n) blocks.
+        Only the part before the first leaf block boundary is checked
+        directly.
+        """
+        top_level = len(self.levels) - 1
+        position = suffix_start - start
+        well_size = end - start
+
+        leaf_end = min(well_size, -(-position // self.LEAF_SIZE)
+                       * self.LEAF_SIZE)
+        count = int(np.count_nonzero(
+            self.values[1, start + position:start + leaf_end] >= threshold))
+        position = leaf_end
+
+        while position < well_size:
+            level = 0
+            while level < top_level and \
+                    position % (self.LEAF_SIZE << (level + 1)) == 0:
+                level += 1
+            block_end = min(position + (self.LEAF_SIZE << level), well_size)
+            block = self.levels[level, start + position:start + block_end]
+            count += (block_end - position) - int(
+                np.searchsorted(block, threshold, side="left"))
+            position = block_end
+        return count
+
+    def well_counts_and_percent(self, substance_thresholds: list[float]) \
+            -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """
+        The index equivalent of calculate_well_counts_and_percent,
+        returning the matrices in the same format.
+        """
+        well_count_matrix = well_counts_to_matrix(self.wells,
+                                                  self.total_counts())
+        filtered_well_count_matrix = well_counts_to_matrix(
+            self.wells, self.positive_counts(substance_thresholds))
+        well_count_matrix_percent = calculate_well_count_percent(
+            well_count_matrix, filtered_well_count_matrix)
+
+        return (well_count_matrix, filtered_well_count_matrix,
+                well_count_matrix_percent)
+
+    def threshold_sweep(self, threshold_vectors: list[list[float]]
+                        ) -> tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+        """
+        The index equivalent of calculate_threshold_sweep, returning
+        the result in the same format.
+
+        The values are already grouped per well, so the sweep counts
+        them straight from the memory mapped index, a well at a time
+        when needed, without loading the file.
+        """
+        filtered_per_well = count_threshold_sweep(
+            self.values, self.offsets, threshold_vectors)
+        return threshold_sweep_plates(self.wells.tolist(),
+                                      self.total_counts(), filtered_per_well)
@@ -0,0 +1,113 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+class RunningWellStatistics:
+    """
+    The running mean and variance of each well, over plates that are
+    added one at a time, with Welford's method.
+
+    Only the amount of plates, the mean and the sum of squared
+    differences to the mean are kept, so a plate does not need to be
+    kept after it has been added, and the result of some plates can be
+    extended with another plate without going over the others again.
+    Two results can also be combined with merge.
+
+    The plates are matched on the row and col names of the first
+    plate that is added. A well that is missing from a plate is NaN,
+    which makes the statistics of that well NaN, the same as
+    calculate_mean_across_each_well.
+    """
+
+    def __init__(self):
+        self.row_names = None
+        self.col_names = None
+        self.count = 0
+        self._mean = None
+        self._m2 = None
+
+    def add(self, matrix: pd.DataFrame) -> None:
+        if self.count == 0:
+            self.row_names, self.col_names = matrix.index, matrix.columns
+            self._mean = np.zeros((len(self.row_names), len(self.col_names)))
+            self._m2 = np.zeros_like(self._mean)
+        elif not (matrix.index.equals(self.row_names) and
+                  matrix.columns.equals(self.col_names)):
+            matrix = matrix.reindex(index=self.row_names,
+                                    columns=self.col_names)
+
+        values = matrix.to_numpy(dtype=np.float64)
+        self.count += 1
+        delta = values - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (values - self._mean)
+
+    def merge(self, other: "RunningWellStatistics") -> None:
+        """
+        Adds the plates of another result to this one, as if they
+        had been added one by one.
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.row_names, self.col_names = other.row_names, other.col_names
+            self.count = other.count
+            self._mean, self._m2 = other._mean.copy(), other._m2.copy()
+            return
+
+        other_mean = other.mean().reindex(
+            index=self.row_names, columns=self.col_names).to_numpy()
+        other_m2 = pd.DataFrame(
+            other._m2, index=other.row_names, columns=other.col_names
+        ).reindex(index=self.row_names, columns=self.col_names).to_numpy()
+
+        count = self.count + other.count
+        delta = other_mean - self._mean
+        self._mean = self._mean + delta * other.count / count
+        self._m2 = self._m2 + other_m2 + \
+            delta ** 2 * self.count * other.count / count
+        self.count = count
+
+    def to_matrix(self, plate: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(plate, index=self.row_names,
+                            columns=self.col_names)
+
+    def mean(self) -> pd.DataFrame:
+        return self.to_matrix(self._mean.copy())
+
+    def std(self, ddof: int = None) -> pd.DataFrame:
+        """
+        The standard deviation of each well, with the same default as
+        PlateCube.std, dividing by n - 1 below 30 plates and by n
+        from 30 plates on.
+
+        Args:
+            ddof: Divide by n - ddof instead of the default
+
+        Returns:
+
+        """
+        if ddof is None:
+            ddof = 1 if self.count < 30 else 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.to_matrix(
+                np.sqrt(np.maximum(self._m2, 0) / (self.count - ddof)))
+
+
+def well_statistics_key(plates: list[tuple[str, str]]) -> str:
+    """
+    The cache key of the RunningWellStatistics of a group of plates.
+    A plate is identified by the hash of the file and the thresholds,
+    the order of the plates does not matter.
+
+    Args:
+        plates: (file hash, substance thresholds) of each plate
+
+    Returns:
+
+    """
+    content = "\n".join(sorted(f"{file_hash}:{thresholds}"
+                               for file_hash, thresholds in plates))
+    return "well_statistics:" + hashlib.sha256(content.encode()).hexdigest()
@@ -1,13 +1,33 @@
+import hashlib
+import io
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.http import FileResponse, HttpResponse
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from apps.cellviewer.models.BackgroundTask import BackgroundTask
 from apps.cellviewer.models.FilteredFile import FilteredFile
 
 import pandas as pd
 
-from apps.cellviewer.util.matrix_functions import \
-    calculate_mean_across_each_well, \
-    calculate_standard_deviation_across_each_well
-from apps.cellviewer.util.plots import generate_heatmap_with_label
+from django.core.cache import caches
+
+from apps.cellviewer.models.AnalysisSnapshot import AnalysisSnapshot
+from apps.cellviewer.util.background_tasks import background_task
+from apps.cellviewer.util.parallel import map_in_threads
+
+from apps.cellviewer.util.result_cache import RESULT_CACHE_ALIAS
+from apps.cellviewer.util.well_statistics import RunningWellStatistics, \
+    well_statistics_key
+from apps.cellviewer.util.plots import generate_heatmap_with_label, \
+    figure_to_html
 from apps.cellviewer.util.excel_writers import write_comparison_analysis_to_binary
+from apps.cellviewer.views.excel_export import EXCEL_CONTENT_TYPE, \
+    EXPORT_CACHE_TIMEOUT
 
 
 def aggregate_jobs(request):
@@ -16,29 +36,11 @@ def aggregate_jobs(request):
     A page that displays an aggregation of multiple
     experiments.
     
-    This page displays multiple things:
-     - The mean of the double positives percentage of each
-        well across the experiments
-     - The standard deviation of the double positive percentages of
-        each well across the experiments
-     
-    This page calculates and uses for the file, but does not display:
-     - The double positives of each well for each experiment individually
-    
-    The progress of what the code does
-    This page at first calculates for each experiment the
-    cell count matrix and the filtered cell count matrix.
-    It then calculates the double positive matrix.
-    
-    Using the double positive matrices of all the files, it calculates
-    the mean of each well across the experiments.
-    Using the double positive matrices and the mean, it
-    calculates the standard deviation.
-    
-    It creates a file in excell format that displays the metadata
-    about each individual experiment, and the aggregated information
-    that is displayed.
-    For this it uses the specific function that does this.
+    The request only checks that the experiments can be compared.
+    The aggregation itself is done in a BackgroundTask, see
+    aggregate_jobs_task, so a comparison of many experiments does not
+    hold up the server for other users. The page polls the task and
+    the aggregation is swapped in when it is done.
     
     Args:
         request:
@@ -48,73 +50,92 @@ def aggregate_jobs(request):
     """
     job_ids = request.POST.getlist("selected-jobs")
     # job_ids = ["11", "13"]
+    
+    if comparable_files(job_ids, request.user) is None:
+        return
+    
+    task = BackgroundTask.objects.enqueue(
+        "aggregate_jobs", {"job_ids": job_ids}, request.user)
+    
+    return render(request, "cellviews/aggregate_jobs.html", {"task": task})
+
+
+def comparable_files(job_ids: list[str], user) -> list[FilteredFile] | None:
+    """
+    Helper function
+    
+    The files of the experiments to compare, if they can be compared.
+    There have to be at least two, all viewable by the user,
+    with the same dimension.
+    
+    Args:
+        job_ids:
+        user:
 
+    Returns: The FilteredFiles, or None if they can not be compared
+
+    """
     if len(job_ids) < 2:
-        return
+        return None
     
     filtered_files = FilteredFile.objects.filter(job_id__in=job_ids).select_related \
-        ('job', 'saved_file')
-    if filtered_files.count() < 2:
-        return
-    
+        ('job', 'saved_file', 'snapshot')
     filtered_files: list[FilteredFile] = list(filtered_files)
-    first_files_job = filtered_files[0].job
+    if len(filtered_files) < 2:
+        return None
     
     # can expand this to require having the same annotation matrix
-    dimension = first_files_job.dimension
+    dimension = filtered_files[0].job.dimension
     for filtered_file in filtered_files:
-        if not filtered_file.job.is_viewable_by(request.user):
-            return
+        if not filtered_file.job.is_viewable_by(user):
+            return None
         if dimension != filtered_file.job.dimension:
-            return
-    
-    labels = first_files_job.label_matrix.get_labels
+            return None
+    return filtered_files
+
+
+@background_task("aggregate_jobs")
+def aggregate_jobs_task(task: BackgroundTask, job_ids: list[str]) -> str:
+    """
+    The aggregation of multiple experiments, run as a BackgroundTask.
     
-    matrices = []
+    This displays multiple things:
+     - The mean of the double positives percentage of each
+        well across the experiments
+     - The standard deviation of the double positive percentages of
+        each well across the experiments
+     
+    The statistics are calculated by calculate_comparison.
     
-    substance_names = []
-    amount_of_sites = []
-    for filtered_file in filtered_files:
-        df = filtered_file.load_polars_dataframe()
+    The Excel file of the comparison, which also holds the double
+    positives of each well for each experiment individually, is not
+    part of the result. The result is kept in the database and the
+    file can be large. It is made when it is downloaded,
+    see download_comparison.
     
-        well_count_matrix, _, well_count_matrix_percent = (
-            filtered_file.get_well_counts_and_percent(df))
-        
-        matrices.append(
-            (well_count_matrix, well_count_matrix_percent)
-        )
-        substance_names.append(df.columns[3:])
-        amount_of_sites.append(df["Site"].max())
+    Args:
+        task:
+        job_ids:
+
+    Returns: The HTML of the aggregation
+
+    """
+    filtered_files = FilteredFile.objects.filter(job_id__in=job_ids).select_related \
+        ('job', 'saved_file', 'snapshot')
+    filtered_files: list[FilteredFile] = list(filtered_files)
+    first_files_job = filtered_files[0].job
     
-    mean_matrix = calculate_mean_across_each_well([a for _, a in matrices])
+    labels = first_files_job.label_matrix.get_labels
     
-    std_matrix = calculate_standard_deviation_across_each_well(
-        [a for _, a in matrices], mean_matrix
-    )
+    substance_names, amount_of_sites, _, statistics = \
+        calculate_comparison(filtered_files, task)
+    mean_matrix = statistics.mean()
+    std_matrix = statistics.std()
     
     mean_heatmap = generate_heatmap_with_label(labels, mean_matrix, "Mean percentage", gradient_range=(0, 100))
     
     std_heatmap = generate_heatmap_with_label(labels, std_matrix, "Std")
     
-    individual_file_info = [
-        [f.original_file_name for f in filtered_files],
-        [f.job.name for f in filtered_files],
-        
-    ]
-
-    excell_content = write_comparison_analysis_to_binary(
-        file_names=individual_file_info[0],
-        experiment_names=individual_file_info[1],
-        amount_of_sites=amount_of_sites,
-        substance_names=substance_names,
-        substance_thresholds=[f.get_substance_thresholds_as_list for f in filtered_files],
-        individual_matrix_explanations=[["Cell count", "Double positive percent"] for f in filtered_files],
-        individual_matrices=[[count, percent] for count, percent in matrices],
-        matrix_explanations=["Mean of double positive percentages",
-                             "Standard deviation of double positive percentages calculated through Population standard deviation"],
-        matrices=[mean_matrix, std_matrix]
-    )
-    
     # this works through magic
     reshaped_substance_info = [
         [[name, threshold] for name, threshold in
@@ -131,12 +152,212 @@ def aggregate_jobs(request):
     ))
 
     context = {
-        "mean_heatmap": mean_heatmap.to_html(),
-        "std_heatmap": std_heatmap.to_html(),
-        "excell_content": excell_content,
+        "mean_heatmap": figure_to_html(mean_heatmap),
+        "std_heatmap": figure_to_html(std_heatmap),
         "individual_file_info": individual_file_info,
+        "job_ids": job_ids,
     }
     
-    return render(request, "cellviews/aggregate_jobs.html", context)
+    return render_to_string("cellviews/sub_page/aggregate_jobs_result.html",
+                            context)
+
+
+def calculate_comparison(filtered_files: list[FilteredFile],
+                         task: BackgroundTask = None
+                         ) -> tuple[list[list[str]], list[int],
+                                    list[tuple[pd.DataFrame, pd.DataFrame]],
+                                    RunningWellStatistics]:
+    """
+    Helper function
+    
+    This at first calculates for each experiment the
+    cell count matrix and the filtered cell count matrix.
+    It then calculates the double positive matrix.
+    
+    Using the double positive matrices of all the files, it calculates
+    the mean and the standard deviation of each well across the
+    experiments. This is done in one pass, adding one file at a time
+    to a RunningWellStatistics. The counts come from the
+    AnalysisSnapshot of each file, so the files themselves are not read.
+    
+    The statistics are cached for the combination of files and
+    thresholds. When one job is added to a comparison that was made
+    before, only that job is added to the cached statistics,
+    see load_cached_well_statistics.
+    
+    The snapshots and matrices of the files are loaded in a pool of
+    AGGREGATE_WORKERS threads, as a snapshot that has to be made again
+    reads the whole file, see load_file_matrices. They are added to
+    the statistics in the order of the files afterwards. The progress
+    of the task is the share of the files that is loaded.
+    
+    Args:
+        filtered_files:
+        task: The task to report the progress to, if any
+
+    Returns:
+        The substance names and amount of sites of each file,
+        the cell count and double positive matrices of each file,
+        and the statistics across the files
+    """
+    def set_progress(progress: float, message: str):
+        if task is not None:
+            task.set_progress(progress, message)
+    
+    matrices = []
+    
+    plates = [(f.saved_file.hash, f.substance_thresholds)
+              for f in filtered_files]
+    statistics, to_add = load_cached_well_statistics(plates)
+    
+    set_progress(0, f"Loading {len(filtered_files)} experiments")
+    task_thread = threading.get_ident()
+    progress_lock = threading.Lock()
+    loaded_count = [0]
+    
+    def load(filtered_file: FilteredFile):
+        # Django opens a database connection for each thread, which is
+        # not closed by itself like the connection of a request.
+        try:
+            result = load_file_matrices(filtered_file)
+            with progress_lock:
+                loaded_count[0] += 1
+                set_progress(
+                    loaded_count[0] / (len(filtered_files) + 1),
+                    f"Loaded {loaded_count[0]} of {len(filtered_files)} experiments")
+            return result
+        finally:
+            if threading.get_ident() != task_thread:
+                connection.close()
+    
+    loaded = map_in_threads(load, filtered_files, settings.AGGREGATE_WORKERS)
+    
+    substance_names = []
+    amount_of_sites = []
+    for i, (snapshot, well_count_matrix, well_count_matrix_percent) in \
+            enumerate(loaded):
+        substance_names.append(snapshot.substance_names)
+        amount_of_sites.append(snapshot.amount_of_sites)
+        if i in to_add:
+            statistics.add(well_count_matrix_percent)
+        
+        matrices.append(
+            (well_count_matrix, well_count_matrix_percent)
+        )
+    
+    set_progress(len(filtered_files) / (len(filtered_files) + 1),
+                 "Calculating the statistics")
+    caches[RESULT_CACHE_ALIAS].set(well_statistics_key(plates), statistics)
+    return substance_names, amount_of_sites, matrices, statistics
 
 
+def download_comparison(request):
+    """
+    Returns the Excel file of a comparison of multiple experiments,
+    with the metadata and matrices of each experiment and the
+    aggregated matrices.
+    
+    It is made when it is downloaded, instead of being part of the
+    result of aggregate_jobs_task. The statistics are cached by then,
+    so only the snapshots of the files are loaded again.
+    The file itself is cached too, in the same way as download_analysis.
+    
+    Args:
+        request:
+
+    Returns: The xlsx file as an attachment
+
+    """
+    if request.method != "POST":
+        return HttpResponse("The request is not a post", status=405)
+    
+    filtered_files = comparable_files(request.POST.getlist("selected-jobs"),
+                                      request.user)
+    if filtered_files is None:
+        return HttpResponse("The experiments can not be compared",
+                            status=404)
+    
+    file_names = [f.original_file_name for f in filtered_files]
+    experiment_names = [f.job.name for f in filtered_files]
+    plates = [(f.saved_file.hash, f.substance_thresholds)
+              for f in filtered_files]
+    key = "comparison_export:" + hashlib.sha256(json.dumps(
+        [plates, file_names, experiment_names]).encode()).hexdigest()
+    
+    content = cache.get(key)
+    if content is None:
+        substance_names, amount_of_sites, matrices, statistics = \
+            calculate_comparison(filtered_files)
+        
+        content = write_comparison_analysis_to_binary(
+            file_names=file_names,
+            experiment_names=experiment_names,
+            amount_of_sites=amount_of_sites,
+            substance_names=substance_names,
+            substance_thresholds=[f.get_substance_thresholds_as_list for f in filtered_files],
+            individual_matrix_explanations=[["Cell count", "Double positive percent"] for f in filtered_files],
+            individual_matrices=[[count, percent] for count, percent in matrices],
+            matrix_explanations=["Mean of double positive percentages",
+                                 "Standard deviation of double positive percentages calculated through Population standard deviation"],
+            matrices=[statistics.mean(), statistics.std()]
+        )
+        cache.set(key, content, EXPORT_CACHE_TIMEOUT)
+    
+    return FileResponse(io.BytesIO(content), as_attachment=True,
+                        filename="comparison_analysis.xlsx",
+                        content_type=EXCEL_CONTENT_TYPE)
+
+
+def load_file_matrices(filtered_file: FilteredFile
+                       ) -> tuple[AnalysisSnapshot, pd.DataFrame, pd.DataFrame]:
+    """
+    Helper function
+    
+    Loads the snapshot of a file, making it again if needed, and the
+    well count and double positive percentage matrices.
+    
+    Args:
+        filtered_file:
+
+    Returns:
+
+    """
+    snapshot = filtered_file.get_snapshot()
+    well_count_matrix, _, well_count_matrix_percent = (
+        snapshot.get_well_counts_and_percent())
+    return snapshot, well_count_matrix, well_count_matrix_percent
+
+
+def load_cached_well_statistics(plates: list[tuple[str, str]]
+                                ) -> tuple[RunningWellStatistics, set[int]]:
+    """
+    Helper function
+    
+    Looks up the RunningWellStatistics of the plates in the results
+    cache. If these are not cached, it looks for the statistics of
+    all but one of the plates, so a comparison that has one more job
+    than a previous comparison only needs to add that one job.
+    
+    Args:
+        plates: (file hash, substance thresholds) of each plate
+
+    Returns:
+        The statistics,
+        and the positions of the plates that still need to be added.
+    """
+    results = caches[RESULT_CACHE_ALIAS]
+    statistics = results.get(well_statistics_key(plates))
+    if statistics is not None:
+        return statistics, set()
+    
+    if len(plates) > 2:
+        leave_one_out = {
+            well_statistics_key(plates[:i] + plates[i + 1:]): i
+            for i in range(len(plates))
+        }
+        found = results.get_many(list(leave_one_out))
+        if found:
+            key, statistics = next(iter(found.items()))
+            return statistics, {leave_one_out[key]}
+    
+    return RunningWellStatistics(), set(range(len(plates)))
@@ -0,0 +1,40 @@
+from django.http import HttpResponse, Http404
+from django.shortcuts import render
+
+from apps.cellviewer.models.BackgroundTask import BackgroundTask
+
+
+def background_task(request, task_id: int):
+    """
+    Polled by the page of a BackgroundTask with htmx.
+
+    While the task is running this responds with the progress, which
+    polls again. When the task is done the result of the task is
+    returned instead, and swapped into the page.
+
+    A task is only visible to the user that started it.
+    
+    Polling also keeps the tasks table maintained, see
+    BackgroundTaskManager.maintain.
+
+    Args:
+        request:
+        task_id:
+
+    Returns:
+
+    """
+    BackgroundTask.objects.maintain()
+    
+    try:
+        task = BackgroundTask.objects.get(id=task_id,
+                                          created_by=request.user)
+    except BackgroundTask.DoesNotExist:
+        raise Http404("Task does not exist")
+
+    task.fail_if_expired()
+    if task.status == BackgroundTask.DONE:
+        return HttpResponse(task.result)
+
+    return render(request, "cellviews/sub_page/background_task.html",
+                  {"task": task})
@@ -0,0 +1,22 @@
+from django.http import JsonResponse
+
+from apps.cellviewer.util.result_cache import well_counts_cache
+
+
+def result_cache_stats(request):
+    """
+    The hit and miss counters of the well counts cache, as JSON.
+    Only available to staff.
+    
+    The counters are kept per process, so with multiple workers this
+    shows the counters of the worker that handled the request.
+    
+    Args:
+        request:
+
+    Returns: JsonResponse
+
+    """
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Only available to staff"}, status=403)
+    return JsonResponse(well_counts_cache.stats())
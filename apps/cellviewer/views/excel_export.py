@@ -0,0 +1,132 @@
+import hashlib
+import io
+import json
+
+from django.core.cache import cache
+from django.http import FileResponse, HttpResponse
+
+from apps.cellviewer.models.FilteredFile import FilteredFile
+from apps.cellviewer.util.dataset_store import load_dataset
+from apps.cellviewer.util.excel_writers import \
+    write_individual_analysis_to_bytes, INDIVIDUAL_MATRIX_EXPLANATIONS
+from apps.cellviewer.util.index_helpers import default_experiment_name
+from apps.cellviewer.util.matrix_functions import \
+    calculate_well_counts_and_percent
+
+EXCEL_CONTENT_TYPE = \
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_CACHE_TIMEOUT = 60 * 60
+
+
+def analysis_export_key(source: str, substance_thresholds: list[float],
+                        file_name: str, experiment_name: str) -> str:
+    """
+    The cache key of an exported Excel file.
+    
+    The source identifies the cells, the hash of a saved file or
+    the token of an unsaved dataset. The file and experiment name are
+    part of the key, as they are written in the file.
+    
+    Args:
+        source:
+        substance_thresholds:
+        file_name:
+        experiment_name:
+
+    Returns:
+
+    """
+    content = json.dumps([source, substance_thresholds,
+                          file_name, experiment_name])
+    return "analysis_export:" + hashlib.sha256(content.encode()).hexdigest()
+
+
+def download_analysis(request):
+    """
+    Returns the Excel file with all content of the analysis,
+    for the thresholds that are currently set on the page.
+    
+    Creating the Excel file is slow compared to the rest of the page,
+    so it is not made for every change of the thresholds, only
+    when it is downloaded. The result is cached, downloading the same
+    analysis again returns the cached file.
+    
+    It is requested with the same form as update_filtered_plots.
+    The job_id is -1 for a file that has not been saved, the dataset
+    is then loaded through the dataset_token. The token is only
+    valid for the user that loaded the dataset, so the user is
+    part of the cache key.
+    
+    Args:
+        request:
+
+    Returns: The xlsx file as an attachment
+
+    """
+    if request.method != "POST":
+        return HttpResponse("The request is not a post", status=405)
+    
+    substance_thresholds = [float(i) if i else 0 for i in
+                            request.POST.getlist("substance_threshold")]
+    
+    saved = request.POST.get("job_id", "-1") != "-1"
+    if not saved:
+        token = request.POST.get("dataset_token")
+        file_name = request.POST.get("file_name")
+        experiment_name = request.POST.get("name") or \
+            default_experiment_name(file_name)
+        source = f"dataset:{request.user.id}:{token}"
+    else:
+        filtered_file = FilteredFile.objects.filter(
+            job_id=int(request.POST.get("job_id"))
+        ).select_related('job', 'saved_file').first()
+        if filtered_file is None or \
+                not filtered_file.job.is_viewable_by(request.user.id):
+            return HttpResponse("The job does not exist", status=404)
+        file_name = filtered_file.original_file_name
+        experiment_name = filtered_file.job.name
+        source = f"file:{filtered_file.saved_file.hash}"
+    
+    key = analysis_export_key(source, substance_thresholds,
+                              file_name, experiment_name)
+    content = cache.get(key)
+    if content is None:
+        df = well_index = None
+        if not saved:
+            try:
+                df = load_dataset(token, request.user.id)
+            except (FileNotFoundError, ValueError):
+                return HttpResponse("The loaded file has expired, please "
+                                    "load the dashboard again.", status=404)
+        else:
+            well_index = filtered_file.saved_file.load_well_index()
+            if well_index is None:
+                df = filtered_file.load_polars_dataframe()
+        
+        if well_index is not None:
+            substances = well_index.substances
+            amount_of_sites = well_index.amount_of_sites
+        else:
+            substances = df.columns[3:]
+            amount_of_sites = df["Site"].max()
+        if saved:
+            matrices = filtered_file.get_well_counts_and_percent(
+                df, substance_thresholds)
+        else:
+            matrices = calculate_well_counts_and_percent(
+                df, substance_thresholds)
+        
+        content = write_individual_analysis_to_bytes(
+            file_name=file_name,
+            experiment_name=experiment_name,
+            amount_of_sites=amount_of_sites,
+            substance_names=substances,
+            substance_thresholds=substance_thresholds,
+            matrix_explanations=INDIVIDUAL_MATRIX_EXPLANATIONS,
+            matrices=list(matrices)
+        )
+        cache.set(key, content, EXPORT_CACHE_TIMEOUT)
+    
+    return FileResponse(io.BytesIO(content), as_attachment=True,
+                        filename=f"{experiment_name}_all_data.xlsx",
+                        content_type=EXCEL_CONTENT_TYPE)
@@ -1,13 +1,19 @@
 import os
-import polars as pl
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
 from django.shortcuts import render, HttpResponse
 from apps.cellviewer.models.SavedJob import SavedJob
-from apps.cellviewer.models.SavedFile import file_dimensions
 from apps.cellviewer.models.LabelMatrix import LabelMatrix
+from apps.cellviewer.models.BackgroundTask import BackgroundTask
 from apps.cellviewer.components.response_modal import ResponseModal
-import regex as re
 
 from apps.cellviewer.util.index_helpers import load_and_save_processing
+from apps.cellviewer.util.dataset_store import store_dataset
+from apps.cellviewer.util.ingest import ingest_request_files
+from apps.cellviewer.util.background_tasks import background_task
+from apps.cellviewer.util.upload_spool import spool_upload, \
+    open_spooled_upload, remove_spooled_upload
 from apps.cellviewer.views.plot_insert_context import plot_insert_element
 
 
@@ -64,12 +70,12 @@ def index_follow_up_input(request):
     if preprocess is not None:
         return preprocess
     
-    file = request.FILES.getlist("inputData")[0]
-    df = pl.read_csv(file)
+    ingested = ingest_request_files(request)[0]
+    df = ingested.df
     
     header = df.columns
     
-    _, (rows, cols) = file_dimensions(df)
+    rows, cols = ingested.dimension
     
     available_labels = LabelMatrix.objects.get_all_same_size(request.user, len(rows), len(cols))
     
@@ -102,7 +108,10 @@ def load_dash(request):
     request and sessions objects. This is because the dash app is
     loaded in the page as an embed.
     
-    The content of the dataframe is added to the session.
+    The parsed file is stored server side under a token, which
+    is sent along with the dashboard. Updating the thresholds afterwards
+    only sends the token, instead of uploading the full file again.
+    See dataset_store for how long this is kept.
     
     Args:
         request:
@@ -116,8 +125,7 @@ def load_dash(request):
     
     files, name, labels, file_name = load_and_save_processing(request)
     
-    file = files[0]
-    df = pl.read_csv(file)
+    df = ingest_request_files(request)[0].df
     
     sub_context = plot_insert_element(
         df, labels,
@@ -125,7 +133,9 @@ def load_dash(request):
         experiment_name=name)
     
     context = {
-        **sub_context
+        **sub_context,
+        "dataset_token": store_dataset(df, request.user.id),
+        "file_name": file_name,
     }
     
     return render(request, "cellviews/visualization/base_visualization.html", context)
@@ -141,6 +151,13 @@ def save_job(request):
     
     All the inputs on the index page are used to save teh job.
     
+    The file is validated while it is uploaded, see
+    IngestingUploadHandler, so the request only checks that result.
+    Saving the file itself, hashing, parsing and writing it, is done
+    by the save_job background task. The uploaded files are spooled
+    so the task can still read them after this request, see
+    spool_upload, and the modal polls the task until it is done.
+    
     Currently this doens't display very extensive error messages
     if something goes wrong and why.
     This could be added. Right now it will just dump the python error
@@ -163,32 +180,77 @@ def save_job(request):
     substance_cutoffs = [substance_cutoffs] # this is because multi file is not
     # done, but savedjob excepts multi file
     
+    task = BackgroundTask.objects.enqueue(
+        "save_job",
+        {
+            "uploads": [[spool_upload(file), file.name] for file in files],
+            "files_substance_thresholds": substance_cutoffs,
+            "name": name,
+            "labels": labels,
+            "label_matrix_name": label_matrix_name,
+        },
+        request.user
+    )
+    
+    return render(request, "cellviews/sub_page/background_task.html",
+                  {"task": task})
+
+
+@background_task("save_job")
+def save_job_task(task: BackgroundTask, uploads: list[list[str]],
+                  files_substance_thresholds: list[list[str]], name: str,
+                  labels: list[list[str]], label_matrix_name: str) -> str:
+    """
+    Saves the spooled uploads of save_job as a job, and returns the
+    response shown in the modal. If the save fails the task fails,
+    which shows the error in the modal instead.
+    
+    The spooled uploads are removed when the task is done, whether the
+    save succeeded or not.
+    
+    Args:
+        task:
+        uploads: The spooled name and the file name of every upload
+        files_substance_thresholds:
+        name:
+        labels:
+        label_matrix_name:
+
+    Returns: The HTML of the response
+
+    """
+    files = []
     try:
+        task.set_progress(0, "Saving the files")
+        for spooled_name, file_name in uploads:
+            files.append(open_spooled_upload(spooled_name, file_name))
+        
+        # SavedJobManager.create only needs the user of the request,
+        # and keeps the ingested files on it
+        request = SimpleNamespace(user=User.objects.get(id=task.created_by_id))
         saved = SavedJob.objects.create(
             request,
             files,
-            substance_cutoffs,
+            files_substance_thresholds,
             name,
             labels,
             label_matrix_name
         )
-        
-        html_content = ResponseModal.render(
-            args=("Saved experiment with configuration successfully",
-                  f"You can find the saved version at <a "
-                  f"href='http://127.0.0.1:8000/saved_jobs/{saved.id}'>saved "
-                  f"job</a>"
-                  f"<br>Used the thresholds: {', '.join(substance_cutoffs[0])}"
-                  )
-        )
-        
-    except Exception as e:
-        html_content = ResponseModal.render(
-            args=(f"Something went wrong,",
-                  f"\n Please let the team know if this is unexpected: {e}")
-        )
-        
-    return HttpResponse(html_content)
+    finally:
+        for file in files:
+            file.close()
+        for spooled_name, _ in uploads:
+            remove_spooled_upload(spooled_name)
+    
+    return ResponseModal.render(
+        args=("Saved experiment with configuration successfully",
+              f"You can find the saved version at <a "
+              f"href='http://127.0.0.1:8000/saved_jobs/{saved.id}'>saved "
+              f"job</a>"
+              f"<br>Used the thresholds: "
+              f"{', '.join(files_substance_thresholds[0])}"
+              )
+    )
 
 
 def index_file_preprocess_checking(request):
@@ -206,12 +268,16 @@ def index_file_preprocess_checking(request):
     or to save a wrongly formatted file to the database.
     
     It adds an overhead as a result of checking the full file
-    content.
+    content. The file is read in chunks by the CellFileValidator,
+    so it is never in memory as a whole.
+    This is done through ingest_file, which hashes the file in the same
+    pass and keeps the result on the request, so the steps after
+    this check do not read the file again.
     
     It checks the request method, the presence of the files.
     It checks if all files have the required header.
-    And if the content matches the pattern as described in regex.
-    Currently it demands
+    And if every line matches the pattern, see line_pattern.
+    If not, the first wrong line numbers are shown to the user.
     Args:
         request:
 
@@ -227,28 +293,11 @@ def index_file_preprocess_checking(request):
         response_title = "Error missing file"
         response_text += "Missing file input"
         
-    for file in request.FILES.getlist("inputData", []):
-        header = file.file.readline().decode("utf-8").strip().split(",")
-        if header[:3] != ["Well", "Site", "Cell"]:
-            response_title = "Wrong file header"
-            response_text += ("The file header does not start with Well,Site,"
-                              "Cell")
+    for ingested in ingest_request_files(request):
+        if not ingested.is_valid:
+            response_title = ingested.validator.error_title
+            response_text += ingested.validator.error_text
             break
-        
-        content = file.file.read().decode("utf-8")
-        
-        file.file.seek(0)
-        n = len(header) - 3
-        match_line = fr"[A-Z]\d{{,3}},\d+,\d+(,{r"\d+\.?\d*"}){{{n}}}"
-        match_enter = r"(\r\n|\r|\n)"
-        pattern = fr"^({match_line}{match_enter})+({match_line}{match_enter}?)$"
-        file_format_match = re.fullmatch(pattern, content)
-        
-        if file_format_match is None:
-            response_title = "Wrong file format"
-            response_text += ("There is a mistake in the file somewhere, "
-                              "a "
-                              "mistaken input is somewhere ")
     
     if response_title or response_text:
         html_content = ResponseModal.render(
@@ -4,19 +4,26 @@ import polars as pl
 from django.shortcuts import render, HttpResponse
 
 from apps.cellviewer.models.FilteredFile import FilteredFile
-from apps.cellviewer.util.excel_writers import \
-    write_individual_analysis_to_binary
-from apps.cellviewer.util.plots import create_hist, generate_heatmap_with_label
+from apps.cellviewer.util.plots import create_hist, \
+    generate_heatmap_with_label, figure_to_html
 from apps.cellviewer.util.matrix_functions import filtered_polars_dataframe, \
     calculate_well_counts_and_percent
-from apps.cellviewer.util.index_helpers import load_and_save_processing
+from apps.cellviewer.util.index_helpers import \
+    load_stored_dataset_processing, load_stored_dataset_names
+from apps.cellviewer.util.dataset_store import load_dataset_cube, \
+    load_dataset_metadata
 
 
 def plot_insert_element(df: pl.dataframe, labels,
                         substance_thresholds: list[float] = None,
                         include: list[str]=("all",),
                         file_name=None,
-                        experiment_name=None
+                        experiment_name=None,
+                        substances=None,
+                        amount_of_sites=None,
+                        well_counts=None,
+                        preview=False,
+                        histograms=None
                         ):
     """
     Does not directly render a view.
@@ -51,12 +58,25 @@ def plot_insert_element(df: pl.dataframe, labels,
     and the amount of double positives.
     
     The page has buttons to allow downloading the files.
-    This also sends the content of said files
+    This also sends the content of the csv files. The Excel file with
+    all content is only made when it is downloaded, see
+    download_analysis.
     
     This function is used in three different places in "three different ways".
     Please keep this in mind when making changes to it.
     It's used in index, saved job, and within this file.
     
+    When only the filtered part is needed, the DataFrame is not required
+    if the substances, amount of sites and well counts are passed,
+    for example from a WellThresholdIndex. Then df can be None.
+    
+    A preview only shows the filtered heatmaps, it does not offer
+    the files to download, as the counts of a preview are approximate.
+    
+    The histograms are drawn from bin counts. A SavedFile keeps these
+    next to the file, so they can be passed as histograms instead of
+    being counted from df again.
+    
     Args:
         df: a polars dataframe
         labels: The labels in the list format [row, col, cells]
@@ -65,14 +85,23 @@ def plot_insert_element(df: pl.dataframe, labels,
             Leaving this empty gives all.
         file_name: The name of the file from which the data came
         experiment_name:
+        substances: The substance names, taken from df if None
+        amount_of_sites: The highest site, taken from df if None
+        well_counts: The result of calculate_well_counts_and_percent,
+            calculated from df if None
+        preview: If the well counts are a preview
+        histograms: The SubstanceHistograms of the file,
+            counted from df if None
     
     Returns:
         context dictionary to be used in combination with the
         base_visualiation.html
 
     """
-    substances = df.columns[3:]
-    amount_of_sites = df["Site"].max()
+    if substances is None:
+        substances = df.columns[3:]
+    if amount_of_sites is None:
+        amount_of_sites = df["Site"].max()
     
     if substance_thresholds is None:
         substance_thresholds = (0,) * len(substances)
@@ -84,47 +113,32 @@ def plot_insert_element(df: pl.dataframe, labels,
         histograms_data = []
         for substance, threshold in zip(substances, substance_thresholds):
             hist, max_value = create_hist(
-                df, substance
+                df, substance,
+                histograms[substance] if histograms is not None else None
             )
             histograms_data.append(
-                (substance, hist.to_html(), max_value, threshold)
+                (substance, figure_to_html(hist), max_value, threshold)
             ) # this order is important for the rendering.
         
         context.update({
             "histogram_data": histograms_data,
         })
     
-    well_count_matrix, filtered_well_count_matrix, \
-        well_positives_percent = (
-        calculate_well_counts_and_percent(
+    if well_counts is None:
+        well_counts = calculate_well_counts_and_percent(
             df, substance_thresholds
-        ))
+        )
+    well_count_matrix, filtered_well_count_matrix, \
+        well_positives_percent = well_counts
     
     if "all" in include:
         context.update({
-            "heatmap_total_cell_counts": generate_heatmap_with_label(
-                labels, well_count_matrix, "Count"
-            ).to_html(),
+            "heatmap_total_cell_counts": figure_to_html(
+                generate_heatmap_with_label(labels, well_count_matrix, "Count")
+            ),
             "file_count_matrix": well_count_matrix.to_csv(),
         })
         
-    matrix_explanations = [
-        "Well counts per well",
-        "Well counts filtered on the substance thresholds",
-        "Double positives above the thresholds"
-    ]
-    matrices = [well_count_matrix, filtered_well_count_matrix,
-                well_positives_percent]
-    
-    excel_file_content = write_individual_analysis_to_binary(
-        file_name=file_name,
-        experiment_name=experiment_name,
-        amount_of_sites=amount_of_sites,
-        substance_names=substances, substance_thresholds=substance_thresholds,
-        matrix_explanations=matrix_explanations,
-        matrices=matrices
-    )
-    
     context.update({
         "substances_str": " and ".join(substances),
         "sub_and_threshold_str": " and ".join(
@@ -132,17 +146,22 @@ def plot_insert_element(df: pl.dataframe, labels,
         ),
         "amount_of_sites": amount_of_sites,
         
-        "heatmap_filtered_cell_counts": generate_heatmap_with_label(
-            labels, filtered_well_count_matrix, "Count"
-        ).to_html(),
+        "heatmap_filtered_cell_counts": figure_to_html(
+            generate_heatmap_with_label(
+                labels, filtered_well_count_matrix, "Count"
+            )
+        ),
         "file_filtered_counts": filtered_well_count_matrix.to_csv(),
         
-        "heatmap_percentage": generate_heatmap_with_label(
-            labels, well_positives_percent, "Percent", gradient_range=(0, 100)
-        ).to_html(),
+        "heatmap_percentage": figure_to_html(
+            generate_heatmap_with_label(
+                labels, well_positives_percent, "Percent",
+                gradient_range=(0, 100)
+            )
+        ),
         "file_double_positives": well_positives_percent.to_csv(),
         
-        "file_all": excel_file_content,
+        "preview": preview,
         
         "job_id": "-1",
         "name": experiment_name,
@@ -162,15 +181,23 @@ def update_filtered_plots(request):
     If it has been saved the job id will be a non -1
     integer, if it has not been saved it is -1.
     
-    When it has not been saved, it will load the information
-    relevant through the same function the index load
-    function uses. As such, thanks to the reuse, this function
-    has been abstracted to utils.
+    When it has not been saved, the file is not sent again.
+    The dashboard sends the token of the dataset that load_dash
+    stored server side, which is loaded instead. If this dataset
+    has expired, the user is asked to load the dashboard again.
     
     If it has been saved, it uses the same methodology that
     saved_jobs uses to load the data. Currently, this is
     not a function yet, however this too should be abstracted
     for consistency. Currently, there is code duplication
+    When the saved file has a WellThresholdIndex, the cells are not
+    loaded at all and the counts come from the index. The counts of a
+    saved file are cached, see FilteredFile.get_well_counts_and_percent.
+    
+    While a slider is being moved the request is a preview. The counts
+    then come from the WellHistogramCube, which is near instant
+    but rounds the thresholds down to its bin edges. When the slider
+    is released an exact request follows.
     
     After having the info loaded,
     It only renders the plots that are relevant and created the
@@ -205,9 +232,37 @@ def update_filtered_plots(request):
     Returns:
 
     """
+    substance_thresholds = [float(i) for i in
+                           request.POST.getlist("substance_threshold")]
+    preview = request.POST.get("preview") == "1"
+    
+    df = None
+    well_index = None
+    well_cube = None
+    filtered_file = None
+    substances = amount_of_sites = None
     if request.POST.get("job_id") == "-1":
-        files, name, labels, file_name = load_and_save_processing(request)
-        df = pl.read_csv(files[0])
+        # A preview only needs the cube and the metadata of the dataset,
+        # the dataset itself is only read without them
+        token = request.POST.get("dataset_token")
+        try:
+            if preview:
+                try:
+                    well_cube = load_dataset_cube(token, request.user.id)
+                    metadata = load_dataset_metadata(token, request.user.id)
+                    substances = metadata["substances"]
+                    amount_of_sites = metadata["amount_of_sites"]
+                except FileNotFoundError:
+                    pass
+            if substances is None:
+                df, name, labels, file_name = \
+                    load_stored_dataset_processing(request)
+            else:
+                name, labels, file_name = load_stored_dataset_names(request)
+        except (FileNotFoundError, ValueError):
+            return HttpResponse(
+                "<p class='text-gray-900 dark:text-white'>The loaded file "
+                "has expired, please load the dashboard again.</p>")
     else:
         # duplicates part with saved_jobs, find a better way
         # to do this.
@@ -224,15 +279,36 @@ def update_filtered_plots(request):
         
         labels = job.label_matrix.get_labels
         
-        df = filtered_file.load_polars_dataframe()
+        if preview:
+            well_cube = filtered_file.saved_file.load_well_cube()
+        well_index = filtered_file.saved_file.load_well_index()
+        if well_index is None:
+            df = filtered_file.load_polars_dataframe()
         
         name = job.name
         file_name=filtered_file.original_file_name
     
-    substance_thresholds = [float(i) for i in
-                           request.POST.getlist("substance_threshold")]
+    well_counts = None
+    if well_cube is not None:
+        well_counts = well_cube.well_counts_and_percent(substance_thresholds)
+    elif filtered_file is not None:
+        well_counts = filtered_file.get_well_counts_and_percent(
+            df, substance_thresholds)
+    
+    if well_index is not None:
+        substances = well_index.substances
+        amount_of_sites = well_index.amount_of_sites
     
-    context = plot_insert_element(df, labels, substance_thresholds, file_name=file_name, experiment_name=name)
+    context = plot_insert_element(df, labels, substance_thresholds,
+                                  include=("filtered",),
+                                  file_name=file_name,
+                                  experiment_name=name,
+                                  substances=substances,
+                                  amount_of_sites=amount_of_sites,
+                                  well_counts=well_counts,
+                                  preview=well_cube is not None)
+    # used by the download button to request the Excel file
+    context["job_id"] = request.POST.get("job_id")
     return render(request,
                   "cellviews/visualization/base_visualization_filtered_part.html",
                   context)
@@ -1,3 +1,4 @@
+from django.contrib.auth.models import User
 from django.shortcuts import render, redirect
 from apps.cellviewer.models.FilteredFile import FilteredFile
 from apps.cellviewer.models.SavedJob import SavedJob
@@ -7,43 +8,100 @@ from functools import reduce
 from apps.cellviewer.views.plot_insert_context import plot_insert_element
 
 
+SAVED_JOBS_PAGE_SIZE = 50
+
+
 def saved_jobs(request):
     """
-    Gets all of a user jobs and displays them in a table.
-    To be able to display the job and link to it, but not display the
-    id to the user as this adds no value,
-    the template iterates over parts of the jobs
-    list. This is a bit convoluted but adds simplicity to the template itself.
+    Renders the page with the table of saved jobs, with the filters
+    above it and the first page of jobs in it.
     
-    so id matches with name
-    label_matrix_id matches with label_matrix__matrix_name
+    The next pages and the filtered pages are loaded with htmx
+    from saved_jobs_page.
     
-    and every other field just iterates normally
     Args:
         request:
 
     Returns:
 
     """
-    jobs = SavedJob.objects.get_all_viewable_jobs(request.user).select_related("label_matrix").select_related("User")
-    fields = ["id", "label_matrix_id", "user",
-              "name", "label_matrix__matrix_name", "user__username","date", "dimension"]
-    headers = ["name", "annotation", "user", "date", "dimension", ""]
-    jobs = jobs.values(*fields)
-    
-    data = (
-        list(job.values())
-        for job in jobs[::-1]
-    )
-    
     context = {
-        "header": headers,
-        'jobs': data,
+        "header": ["name", "annotation", "user", "date", "dimension", ""],
+        "users": User.objects.filter(savedjob__isnull=False).distinct()
+        .order_by("username").values_list("id", "username"),
+        "dimensions": SavedJob.objects.order_by("dimension")
+        .values_list("dimension", flat=True).distinct(),
         'segment': 'stored',
+        **_page_context(request),
     }
     return render(request, "cellviews/saved-jobs.html", context)
 
 
+def saved_jobs_page(request):
+    """
+    A page of rows of the saved jobs table, for the filters and the
+    cursor in the query. Requested by htmx, when the filters change
+    the rows replace those in the table, when more jobs are loaded
+    they replace the load more row.
+    
+    Args:
+        request:
+
+    Returns:
+
+    """
+    return render(request, "cellviews/sub_page/saved_jobs_rows.html",
+                  _page_context(request))
+
+
+def _page_context(request) -> dict:
+    """
+    Helper function
+    
+    Reads the filters from the query of the request and gets the
+    page of jobs after the cursor in the query. An owner or
+    cursor that can not be read is ignored.
+    
+    Args:
+        request:
+
+    Returns: The jobs of the page, and the query of the next page,
+        None if it is the last page
+
+    """
+    query = request.GET
+    
+    owner = query.get("owner", "")
+    owner = int(owner) if owner.isdigit() else None
+    
+    jobs = SavedJob.objects.filter_viewable_jobs(
+        request.user,
+        owner=owner,
+        dimension=query.get("dimension", "").strip(),
+        annotation=query.get("annotation", "").strip(),
+        search=query.get("search", "").strip()
+    )
+    
+    oldest_first = query.get("order") == "oldest"
+    try:
+        page, next_cursor = SavedJob.objects.page_of_jobs(
+            jobs, query.get("after"), SAVED_JOBS_PAGE_SIZE, oldest_first)
+    except ValueError:
+        page, next_cursor = SavedJob.objects.page_of_jobs(
+            jobs, None, SAVED_JOBS_PAGE_SIZE, oldest_first)
+    
+    next_query = None
+    if next_cursor is not None:
+        next_query = query.copy()
+        next_query["after"] = next_cursor
+        next_query = next_query.urlencode()
+    
+    return {
+        "jobs": page,
+        "next_query": next_query,
+    }
+
+
 def display_job(request, job_id: int):
     """
     Renders the page for a specific job
@@ -62,7 +120,7 @@ def display_job(request, job_id: int):
     Returns:
 
     """
-    filtered_files = FilteredFile.objects.filter(job_id=job_id).select_related('job', 'saved_file')
+    filtered_files = FilteredFile.objects.filter(job_id=job_id).select_related('job', 'saved_file', 'snapshot')
 
     if filtered_files.count() == 0:
         return
@@ -73,14 +131,25 @@ def display_job(request, job_id: int):
     
     labels = job.label_matrix.get_labels
     
-    df = filtered_file.load_polars_dataframe()
+    # The counts come from the snapshot written when the job was saved,
+    # and the histograms are stored next to the file, so the file itself
+    # is not read. Only files saved before the histograms existed are.
+    snapshot = filtered_file.get_snapshot()
+    saved_file = filtered_file.saved_file
+    df = None
+    if not saved_file.has_substance_histograms():
+        df = filtered_file.load_polars_dataframe()
     
-    substance_names = df.columns[3:]
+    substance_names = snapshot.substance_names
     substance_thresholds = filtered_file.get_substance_thresholds_as_list
     
     sub_context = plot_insert_element(
         df, labels, file_name=filtered_file.original_file_name,
-        experiment_name=job.name, substance_thresholds=substance_thresholds
+        experiment_name=job.name, substance_thresholds=substance_thresholds,
+        substances=substance_names,
+        amount_of_sites=snapshot.amount_of_sites,
+        well_counts=snapshot.get_well_counts_and_percent(),
+        histograms=saved_file.load_substance_histograms(df)
     )
     
     context = {
@@ -0,0 +1,63 @@
+from django.http import JsonResponse
+
+from apps.cellviewer.models.FilteredFile import FilteredFile
+from apps.cellviewer.util.matrix_functions import calculate_threshold_sweep
+from apps.cellviewer.util.threshold_sweep import parse_sweep_thresholds
+
+
+def threshold_sweep(request, job_id: int):
+    """
+    Returns the filtered well counts and double positive percentages of
+    a saved job for many sets of thresholds at once, as JSON.
+
+    Instead of trying thresholds one at a time through
+    update_filtered_plots, a whole grid of thresholds can be requested,
+    after which the page can move through the results without
+    requesting anything from the server.
+
+    The cells are counted from the WellThresholdIndex of the file,
+    which holds them grouped per well, or from the columnar copy when
+    the index has not been built yet, see SavedFile.load_polars_dataframe.
+
+    See parse_sweep_thresholds for the query parameters.
+    The response has the rows and cols of the plate, the total well
+    counts as a rows x cols list, and the filtered counts and
+    percentages as a thresholds x rows x cols list.
+
+    Args:
+        request:
+        job_id:
+
+    Returns: JsonResponse
+
+    """
+    filtered_file = FilteredFile.objects.filter(job_id=job_id) \
+        .select_related('job', 'saved_file').first()
+    if filtered_file is None or \
+            not filtered_file.job.is_viewable_by(request.user.id):
+        return JsonResponse({"error": "The job does not exist"}, status=404)
+
+    try:
+        vectors = parse_sweep_thresholds(request.GET)
+        well_index = filtered_file.saved_file.load_well_index()
+        if well_index is not None:
+            substances = list(well_index.substances)
+            well_count_matrix, filtered_counts, percentages = \
+                well_index.threshold_sweep(vectors)
+        else:
+            df = filtered_file.load_polars_dataframe()
+            substances = df.columns[3:]
+            well_count_matrix, filtered_counts, percentages = \
+                calculate_threshold_sweep(df, vectors)
+    except (ValueError, IndexError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return JsonResponse({
+        "substances": substances,
+        "thresholds": vectors,
+        "rows": list(well_count_matrix.index),
+        "cols": list(well_count_matrix.columns),
+        "well_counts": well_count_matrix.to_numpy().astype(int).tolist(),
+        "filtered_counts": filtered_counts.tolist(),
+        "percentages": percentages.round(3).tolist(),
+    })
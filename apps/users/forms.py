@@ -72,7 +72,8 @@ class UserPasswordChangeForm(PasswordChangeForm):
 class ProfileForm(forms.ModelForm):
     class Meta:
         model = Profile
-        exclude = ('user', 'role', 'avatar', 'storage_space_in_gb')
+        exclude = ('user', 'role', 'avatar', 'storage_space_in_gb',
+                   'used_storage_in_b')
 
     def __init__(self, *args, **kwargs):
         super(ProfileForm, self).__init__(*args, **kwargs)
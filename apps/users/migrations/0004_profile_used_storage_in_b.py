@@ -0,0 +1,41 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+def calculate_used_storage(apps, schema_editor):
+    """
+    Fills in the used storage of every user from the distinct files
+    used by their jobs, the same way SavedJobManager calculates it.
+    """
+    Profile = apps.get_model("users", "Profile")
+    FilteredFile = apps.get_model("cellviewer", "FilteredFile")
+
+    used_storage = {}
+    user_files = FilteredFile.objects \
+        .values_list("job__user_id", "saved_file_id",
+                     "saved_file__storage_space_in_b") \
+        .distinct()
+    for user_id, saved_file_id, size in user_files:
+        used_storage[user_id] = used_storage.get(user_id, 0) + (size or 0)
+
+    for profile in Profile.objects.all():
+        profile.used_storage_in_b = used_storage.get(profile.user_id, 0)
+        profile.save(update_fields=["used_storage_in_b"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_profile_storage_space_in_gb'),
+        ('cellviewer', '0008_labelmatrix_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='used_storage_in_b',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(calculate_used_storage, migrations.RunPython.noop),
+    ]
@@ -20,6 +20,9 @@ class Profile(models.Model):
     avatar    = models.ImageField(upload_to='avatar', null=True, blank=True)
     
     storage_space_in_gb = models.FloatField(default=5)
+    # The size of the distinct files used by the jobs of the user, kept up
+    # to date by SavedJobManager, see the reconcile_storage_usage command
+    used_storage_in_b   = models.BigIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
\ No newline at end of file
@@ -0,0 +1,8 @@
+# Celery is optional, without it the background tasks run in the web
+# process or through the run_background_tasks command
+try:
+    from core.celery import app as celery_app
+except ImportError:
+    celery_app = None
+
+__all__ = ("celery_app",)
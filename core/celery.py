@@ -0,0 +1,16 @@
+import os
+
+from celery import Celery
+
+# Runs the background tasks when BACKGROUND_TASK_USE_CELERY is set, see
+# apps/cellviewer/models/BackgroundTask.py. Start a worker with
+#   celery -A core worker -l info
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+
+app = Celery("core")
+
+# - namespace='CELERY' means all celery-related configuration keys should have a `CELERY_` prefix.
+app.config_from_object("django.conf:settings", namespace="CELERY")
+
+# Load task modules from all registered Django apps.
+app.autodiscover_tasks()
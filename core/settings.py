@@ -10,7 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
-import os, random, string
+import os, random, string, tempfile
+import plotly
 from pathlib        import Path
 from dotenv         import load_dotenv
 from str2bool       import str2bool
@@ -132,6 +133,53 @@ ASGI_APPLICATION = "core.asgi.application"
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 300000000
 
+# Input files are hashed and validated while they are being uploaded, and
+# written to a temporary file instead of being kept in memory.
+FILE_UPLOAD_HANDLERS = [
+    "apps.cellviewer.util.upload_handlers.IngestingUploadHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
+# Files loaded into the dashboard without being saved are kept server side
+# for a while, so updating the thresholds does not require uploading the file again.
+# DATASET_STORE_TTL is the amount of seconds an unused dataset is kept.
+DATASET_STORE_DIR = os.environ.get(
+    "DATASET_STORE_DIR", os.path.join(tempfile.gettempdir(), "cellviewer_datasets"))
+DATASET_STORE_TTL = int(os.environ.get("DATASET_STORE_TTL", 60 * 60 * 2))
+
+# The amount of files of a comparison that are processed at the same time,
+# see apps/cellviewer/views/aggregate_jobs.py. Set it to 1 to process them one by one.
+AGGREGATE_WORKERS = int(os.environ.get("AGGREGATE_WORKERS", min(8, os.cpu_count() or 1)))
+
+# Heavy operations run as background tasks stored in the database, see
+# apps/cellviewer/models/BackgroundTask.py. They run in a pool of BACKGROUND_TASK_WORKERS
+# threads in the web process. With 0 they are only run by `manage.py run_background_tasks`.
+# With BACKGROUND_TASK_USE_CELERY they are sent to the Celery workers instead,
+# which needs celery installed and the broker of CELERY_BROKER, see docs/celery.md.
+# A task that is not done after BACKGROUND_TASK_TIMEOUT seconds is seen as failed.
+# Finished tasks are removed BACKGROUND_TASK_RETENTION seconds after they finished.
+BACKGROUND_TASK_WORKERS = int(os.environ.get("BACKGROUND_TASK_WORKERS", 2))
+BACKGROUND_TASK_USE_CELERY = str2bool(os.environ.get("BACKGROUND_TASK_USE_CELERY", "False"))
+BACKGROUND_TASK_TIMEOUT = int(os.environ.get("BACKGROUND_TASK_TIMEOUT", 30 * 60))
+BACKGROUND_TASK_RETENTION = int(os.environ.get("BACKGROUND_TASK_RETENTION", 60 * 60 * 24))
+
+# The analysis_results cache holds the calculated well counts of saved files,
+# shared between the workers, see apps/cellviewer/util/result_cache.py.
+# The results only depend on the file and the thresholds, so they never go stale.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "analysis_results": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get(
+            "RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "cellviewer_results")),
+        "TIMEOUT": 60 * 60 * 24 * 30,
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+}
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
@@ -154,10 +202,18 @@ if DB_ENGINE and DB_NAME and DB_USERNAME:
         }, 
     }
 else:
+    # Background tasks write to the database while requests do.
+    # IMMEDIATE transactions take the write lock when they start, so a
+    # transaction waits up to the timeout for the lock instead of failing
+    # with "database is locked" when it would have to upgrade to a write.
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': 'db.sqlite3',
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
         }
     }
 
@@ -199,16 +255,25 @@ USE_TZ = True
 STATIC_URL  = "static/"
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# plotly.js is served from the installed plotly package, so it always
+# matches the version the figures are made with. The version is part of
+# the url, so browsers can cache it for as long as they want.
+# Only plotly.min.js is served, see apps/cellviewer/finders.py.
+PLOTLY_STATIC_PREFIX = f"plotly-{plotly.__version__}"
+
 STATICFILES_DIRS = (
     os.path.join(BASE_DIR, 'static'),
 )
 
+WHITENOISE_IMMUTABLE_FILE_TEST = rf"/{PLOTLY_STATIC_PREFIX}/plotly\.min\.js$"
+
 STATICFILES_FINDERS = [
 
     'django.contrib.staticfiles.finders.FileSystemFinder',
     'django.contrib.staticfiles.finders.AppDirectoriesFinder',
     
     "django_components.finders.ComponentsFileSystemFinder",
+    "apps.cellviewer.finders.PlotlyJsFinder",
 ]
 
 # PLOTLY_COMPONENTS = [
@@ -3,8 +3,12 @@
 Copyright (c) 2019 - present AppSeed.us
 """
 
+import os
+
 bind = '0.0.0.0:5005'
-workers = 1
+# Saved files are memory mapped, so workers share the loaded data through the
+# page cache instead of each keeping their own copy.
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
 accesslog = '-'
 loglevel = 'debug'
 capture_output = True
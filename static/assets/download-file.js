@@ -33,4 +33,36 @@ function fileDownloaderXlsx(csvContent, fileName) {
         a.click();
         URL.revokeObjectURL(url);
     };
-}
\ No newline at end of file
+}
+
+function fileDownloaderPost(url, button, fileName) {
+    // Requests the file from the server with the inputs of the form the
+    // button is in, without the uploaded file, the same as the plot updates.
+    return function () {
+        event.preventDefault();
+
+        const formData = new FormData(button.closest("form"));
+        formData.delete("inputData");
+        formData.set("job_id", button.dataset.jobId);
+        const headers = JSON.parse(document.body.getAttribute("hx-headers") || "{}");
+
+        button.disabled = true;
+        fetch(url, {method: "POST", body: formData, headers: headers})
+            .then(response => {
+                if (!response.ok) {
+                    return response.text().then(text => { throw new Error(text); });
+                }
+                return response.blob();
+            })
+            .then(blob => {
+                const url = URL.createObjectURL(blob);
+                const a = document.createElement('a');
+                a.href = url;
+                a.download = fileName;
+                a.click();
+                URL.revokeObjectURL(url);
+            })
+            .catch(error => alert(`The download failed: ${error.message}`))
+            .finally(() => { button.disabled = false; });
+    };
+}